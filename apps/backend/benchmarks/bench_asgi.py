@@ -0,0 +1,334 @@
+"""
+Load benchmark: the chat API under WSGI and ASGI.
+
+Runs the same polling workload -- inbox, incremental message poll, typing
+status and health, round-robin -- from many concurrent clients against each
+stack in a separate process, driving the real WSGI/ASGI callables in-process
+(no sockets) over a throwaway SQLite database:
+
+* wsgi: ``config.wsgi.application`` behind a pool of ``--wsgi-threads``
+  worker threads, like a threaded WSGI server.
+* asgi: ``config.asgi.application`` with every client as a coroutine on one
+  event loop, like a single ASGI worker.
+
+``--parked`` long-polls (``conversations/<id>/updates/``) are held open for
+the whole run to model idle clients occupying connections; under WSGI each
+one holds a worker thread, under ASGI only a coroutine.
+
+Usage (from apps/backend):
+
+    python benchmarks/bench_asgi.py [--clients 50] [--requests 20]
+        [--wsgi-threads 8] [--parked 0]
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+MODES = ("wsgi", "asgi")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--wsgi-threads", type=int, default=8)
+    parser.add_argument("--parked", type=int, default=0)
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument(
+        "--response-cache",
+        action="store_true",
+        help="keep the version-keyed response cache on (off by default so "
+        "every request reaches the ORM)",
+    )
+    parser.add_argument(
+        "--mode", choices=("all", *MODES), default="all"
+    )
+    return parser.parse_args(argv)
+
+
+# Worker process ------------------------------------------------------------
+
+
+def setup_django(db_path: str, response_cache: bool) -> None:
+    sys.path.insert(0, str(BACKEND_DIR))
+    os.environ["DJANGO_SETTINGS_MODULE"] = "config.settings"
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+
+    import django
+    from django.conf import settings
+
+    django.setup()
+    settings.DEBUG = False
+    if not response_cache:
+        settings.CHAT_RESPONSE_CACHE_SIZE = 0
+
+    from django.core.management import call_command
+
+    call_command("migrate", verbosity=0)
+
+
+def populate(clients: int, messages: int) -> list[dict]:
+    """
+    One 1:1 conversation per client with ``messages`` messages; returns
+    each client's token, conversation id and newest message id.
+    """
+
+    from django.contrib.auth import get_user_model
+    from rest_framework.authtoken.models import Token
+
+    from chat.models import Conversation, ConversationMember, Message, Profile
+
+    User = get_user_model()
+    sessions = []
+    for i in range(clients):
+        users = [
+            User.objects.create(username=f"{role}{i}", email=f"{role}{i}@example.com")
+            for role in ("a", "b")
+        ]
+        for j, user in enumerate(users):
+            Profile.objects.create(user=user, ref_code=f"{'AB'[j]}{i:05d}")
+        conversation = Conversation.objects.create()
+        ConversationMember.objects.bulk_create(
+            [ConversationMember(conversation=conversation, user=u) for u in users]
+        )
+        Message.objects.bulk_create(
+            [
+                Message(
+                    conversation=conversation,
+                    sender=users[k % 2],
+                    content=f"message {k}",
+                )
+                for k in range(messages)
+            ]
+        )
+        last_id = (
+            Message.objects.filter(conversation=conversation)
+            .order_by("-id")
+            .values_list("id", flat=True)
+            .first()
+        )
+        sessions.append(
+            {
+                "token": Token.objects.create(user=users[0]).key,
+                "conversation": conversation.id,
+                "last_id": last_id,
+            }
+        )
+    return sessions
+
+
+def workload(session: dict, count: int) -> list[tuple[str, str]]:
+    conversation = session["conversation"]
+    paths = [
+        ("/api/conversations/", ""),
+        (
+            f"/api/conversations/{conversation}/messages/",
+            f"after={session['last_id']}",
+        ),
+        (f"/api/conversations/{conversation}/typing/", ""),
+        ("/api/health/", ""),
+    ]
+    return [paths[i % len(paths)] for i in range(count)]
+
+
+def run_wsgi(sessions, args) -> tuple[list[float], int, float]:
+    from config.wsgi import application
+
+    def call(token: str, path: str, query: str) -> int:
+        environ = {
+            "REQUEST_METHOD": "GET",
+            "PATH_INFO": path,
+            "QUERY_STRING": query,
+            "SERVER_NAME": "localhost",
+            "SERVER_PORT": "80",
+            "HTTP_HOST": "localhost",
+            "HTTP_AUTHORIZATION": f"Token {token}",
+            "wsgi.input": io.BytesIO(),
+            "wsgi.errors": sys.stderr,
+            "wsgi.url_scheme": "http",
+        }
+        status = []
+        body = application(environ, lambda s, h, e=None: status.append(s))
+        b"".join(body)
+        if hasattr(body, "close"):
+            body.close()
+        return int(status[0].split()[0])
+
+    latencies, errors = [], 0
+    lock = threading.Lock()
+    pool = ThreadPoolExecutor(max_workers=args.wsgi_threads)
+
+    def client(session):
+        # Each client waits for its response before sending the next
+        # request; time queued for a server thread counts as latency.
+        nonlocal errors
+        for path, query in workload(session, args.requests):
+            start = time.perf_counter()
+            code = pool.submit(call, session["token"], path, query).result()
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if code >= 400:
+                    errors += 1
+
+    try:
+        for i in range(args.parked):
+            session = sessions[i % len(sessions)]
+            pool.submit(
+                call,
+                session["token"],
+                f"/api/conversations/{session['conversation']}/updates/",
+                f"cursor={session['last_id']}&timeout=30",
+            )
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(sessions)) as clients:
+            list(clients.map(client, sessions))
+        wall = time.perf_counter() - start
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    return latencies, errors, wall
+
+
+def run_asgi(sessions, args) -> tuple[list[float], int, float]:
+    from config.asgi import application
+
+    async def call(token: str, path: str, query: str) -> int:
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query.encode(),
+            "root_path": "",
+            "headers": [
+                (b"host", b"localhost"),
+                (b"authorization", f"Token {token}".encode()),
+            ],
+            "client": ("127.0.0.1", 1234),
+            "server": ("localhost", 80),
+        }
+        sent = asyncio.Event()
+        status = []
+
+        async def receive():
+            if not sent.is_set():
+                sent.set()
+                return {"type": "http.request", "body": b"", "more_body": False}
+            await asyncio.Event().wait()
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+
+        await application(scope, receive, send)
+        return status[0]
+
+    latencies, errors = [], 0
+
+    async def client(session):
+        nonlocal errors
+        for path, query in workload(session, args.requests):
+            start = time.perf_counter()
+            code = await call(session["token"], path, query)
+            latencies.append(time.perf_counter() - start)
+            if code >= 400:
+                errors += 1
+
+    async def main():
+        parked = [
+            asyncio.create_task(
+                call(
+                    s["token"],
+                    f"/api/conversations/{s['conversation']}/updates/",
+                    f"cursor={s['last_id']}&timeout=30",
+                )
+            )
+            for s in (sessions[i % len(sessions)] for i in range(args.parked))
+        ]
+        await asyncio.sleep(0.1)
+        start = time.perf_counter()
+        await asyncio.gather(*(client(s) for s in sessions))
+        wall = time.perf_counter() - start
+        for task in parked:
+            task.cancel()
+        return wall
+
+    wall = asyncio.run(main())
+    return latencies, errors, wall
+
+
+def worker(args) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_django(os.path.join(tmp, "bench.sqlite3"), args.response_cache)
+        sessions = populate(args.clients, args.messages)
+        runner = run_wsgi if args.mode == "wsgi" else run_asgi
+        latencies, errors, wall = runner(sessions, args)
+        latencies.sort()
+        print(
+            json.dumps(
+                {
+                    "mode": args.mode,
+                    "requests": len(latencies),
+                    "errors": errors,
+                    "wall": wall,
+                    "rps": len(latencies) / wall,
+                    "p50": statistics.median(latencies),
+                    "p95": latencies[int(len(latencies) * 0.95) - 1],
+                }
+            )
+        )
+        # Parked long-polls may still hold worker threads; don't wait.
+        sys.stdout.flush()
+        os._exit(0)
+
+
+# Driver ----------------------------------------------------------------------
+
+
+def main() -> None:
+    args = parse_args()
+    if args.mode != "all":
+        worker(args)
+        return
+
+    results = []
+    for mode in MODES:
+        argv = [a for a in sys.argv[1:] if not a.startswith("--mode")]
+        out = subprocess.run(
+            [sys.executable, __file__, *argv, "--mode", mode],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+
+    print(
+        f"clients={args.clients} requests/client={args.requests} "
+        f"wsgi_threads={args.wsgi_threads} parked={args.parked} "
+        f"response_cache={'on' if args.response_cache else 'off'}"
+    )
+    print(f"{'stack':9} {'reqs':>6} {'errors':>6} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9}")
+    for r in results:
+        print(
+            f"{r['mode']:9} {r['requests']:6d} {r['errors']:6d} {r['rps']:9.1f} "
+            f"{r['p50'] * 1000:9.2f} {r['p95'] * 1000:9.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
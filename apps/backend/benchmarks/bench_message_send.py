@@ -0,0 +1,150 @@
+"""
+Throughput benchmark for sending messages (sends/sec).
+
+Builds a throwaway test database with ``--conversations`` two-person chats and
+sends ``--sends`` messages round-robin across them three ways:
+
+* legacy: the statements the POST branch of ``conversation_messages`` used to
+  run one by one in autocommit mode (load the conversation, get_or_create
+  the membership, COUNT recent sends for the rate limit, INSERT the message,
+  UPDATE ``updated_at``, then ``MessageSerializer``). It maintains no inbox
+  summary, counters or versions and is not atomic.
+* service: ``membership.require_member`` + ``messaging.send_message`` + the
+  row serializer, i.e. what the view does now (one transaction, counters
+  and inbox summary included).
+* replay: the same sends repeated with their ``client_msg_id``, as a retrying
+  client would; every one must come back as the original message.
+
+SQLite test databases live in memory, so round trips are nearly free here;
+the round-trip counts (BEGIN/COMMIT included) are the number to watch for a
+networked database.
+
+Usage (from apps/backend):
+
+    python benchmarks/bench_message_send.py [--sends 2000] [--conversations 20]
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from chat import membership, messaging  # noqa: E402
+from chat.models import Conversation, ConversationMember, Message, Profile  # noqa: E402
+from chat.serializers import MessageSerializer, serialize_message_rows  # noqa: E402
+
+
+class _Request:
+    def __init__(self, user):
+        self.user = user
+
+
+def populate(conversations: int) -> list[tuple[int, object]]:
+    """
+    Returns (conversation_id, sender) for each two-person conversation.
+    """
+
+    User = get_user_model()
+    targets = []
+    for i in range(conversations):
+        users = [
+            User.objects.create(username=f"{role}{i}", email=f"{role}{i}@example.com")
+            for role in ("a", "b")
+        ]
+        for j, user in enumerate(users):
+            Profile.objects.create(user=user, ref_code=f"{'AB'[j]}{i:05d}")
+        conversation = Conversation.objects.create()
+        ConversationMember.objects.bulk_create(
+            [ConversationMember(conversation=conversation, user=u) for u in users]
+        )
+        targets.append((conversation.id, users[0]))
+    return targets
+
+
+def legacy_send(conversation_id: int, sender, content: str, key: str):
+    conversation = Conversation.objects.get(id=conversation_id)
+    ConversationMember.objects.get_or_create(conversation=conversation, user=sender)
+    Message.objects.filter(
+        sender=sender, created_at__gte=timezone.now() - timedelta(minutes=1)
+    ).count()
+    message = Message.objects.create(
+        conversation=conversation, sender=sender, content=content
+    )
+    Conversation.objects.filter(pk=conversation.pk).update(updated_at=timezone.now())
+    return MessageSerializer(message, context={"request": _Request(sender)}).data
+
+
+def service_send(conversation_id: int, sender, content: str, key: str):
+    membership.require_member(sender, conversation_id)
+    message, created = messaging.send_message(conversation_id, sender, content, key)
+    return serialize_message_rows([message], sender)[0], created
+
+
+def run(label: str, send, targets, sends: int, prefix: str) -> tuple[float, list]:
+    conversation_id, sender = targets[0]
+    send(conversation_id, sender, "warm-up", f"{prefix}-warm")
+    with CaptureQueriesContext(connection) as queries:
+        send(conversation_id, sender, "probe", f"{prefix}-probe")
+    results = []
+    start = time.perf_counter()
+    for i in range(sends):
+        conversation_id, sender = targets[i % len(targets)]
+        results.append(send(conversation_id, sender, f"message {i}", f"{prefix}-{i}"))
+    elapsed = time.perf_counter() - start
+    print(
+        f"{label:8} {sends / elapsed:10.0f} sends/s  "
+        f"{elapsed / sends * 1e6:8.1f} us/send  "
+        f"{len(queries)} round trips/send"
+    )
+    return elapsed, results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sends", type=int, default=2000)
+    parser.add_argument("--conversations", type=int, default=20)
+    args = parser.parse_args()
+    # Query logging would otherwise dominate the timings.
+    settings.DEBUG = False
+
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        targets = populate(args.conversations)
+        print(f"sends={args.sends} conversations={args.conversations}")
+        legacy, _ = run("legacy", legacy_send, targets, args.sends, "legacy")
+        service, sent = run("service", service_send, targets, args.sends, "svc")
+        _, replayed = run("replay", service_send, targets, args.sends, "svc")
+
+        duplicates = sum(created for _, created in replayed)
+        same = all(a[0]["id"] == b[0]["id"] for a, b in zip(sent, replayed))
+        counted = sum(
+            Conversation.objects.values_list("message_count", flat=True)
+        )
+        stored = Message.objects.exclude(client_msg_id=None).count()
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    print(f"speedup  {legacy / service:10.2f}x")
+    print(f"replays  {'ok' if same and not duplicates else 'DUPLICATED'}")
+    print(f"counters {'ok' if counted == stored else 'MISMATCH'}")
+    if duplicates or not same or counted != stored:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
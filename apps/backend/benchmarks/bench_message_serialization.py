@@ -0,0 +1,133 @@
+"""
+Benchmark MessageSerializer against the fast row-based message path.
+
+Builds a throwaway test database with one conversation, renders a page of
+messages both ways, checks the JSON is byte-identical and reports timings.
+
+Usage (from apps/backend):
+
+    python benchmarks/bench_message_serialization.py [--page 200] [--rounds 50]
+"""
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.db import connection, reset_queries  # noqa: E402
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+
+from chat.models import Conversation, ConversationMember, Message, Profile  # noqa: E402
+from chat.serializers import (  # noqa: E402
+    MessageSerializer,
+    message_rows,
+    serialize_message_rows,
+)
+
+
+class _Request:
+    def __init__(self, user):
+        self.user = user
+
+
+def populate(page: int, senders: int):
+    User = get_user_model()
+    users = [
+        User.objects.create(username=f"bench{i}", email=f"bench{i}@example.com")
+        for i in range(senders)
+    ]
+    for i, user in enumerate(users):
+        Profile.objects.create(
+            user=user,
+            ref_code=f"B{i:05d}",
+            display_name=f"Bench {i}",
+            avatar_color="#336699",
+        )
+    conversation = Conversation.objects.create(title="bench", is_group=True)
+    ConversationMember.objects.bulk_create(
+        [ConversationMember(conversation=conversation, user=u) for u in users]
+    )
+    Message.objects.bulk_create(
+        [
+            Message(
+                conversation=conversation,
+                sender=users[i % senders],
+                content=f"message {i} " + "lorem ipsum " * 8,
+            )
+            for i in range(page)
+        ]
+    )
+    return conversation, users[0]
+
+
+def timed(fn, rounds: int) -> tuple[float, bytes, int]:
+    renderer = JSONRenderer()
+    # Start from an empty query log: once it holds its 9000 entries, a
+    # capture sees no growth and would report 0 queries.
+    reset_queries()
+    with CaptureQueriesContext(connection) as queries:
+        body = renderer.render(fn())
+    start = time.perf_counter()
+    for _ in range(rounds):
+        renderer.render(fn())
+    return (time.perf_counter() - start) / rounds, body, len(queries)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--page", type=int, default=200)
+    parser.add_argument("--senders", type=int, default=5)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+    # Query logging would otherwise dominate the timings; the capture above
+    # turns it on just for the counted call.
+    settings.DEBUG = False
+
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        conversation, viewer = populate(args.page, args.senders)
+        read_map = {}
+        qs = Message.objects.filter(conversation=conversation).order_by("-id")
+
+        def slow():
+            messages = list(qs[: args.page])[::-1]
+            return MessageSerializer(
+                messages,
+                many=True,
+                context={
+                    "request": _Request(viewer),
+                    "read_by_all_map": read_map,
+                },
+            ).data
+
+        def fast():
+            rows = message_rows(qs[: args.page])[::-1]
+            return serialize_message_rows(rows, viewer, read_map)
+
+        slow_time, slow_body, slow_queries = timed(slow, args.rounds)
+        fast_time, fast_body, fast_queries = timed(fast, args.rounds)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    print(f"page={args.page} senders={args.senders} rounds={args.rounds}")
+    print(f"MessageSerializer : {slow_time * 1000:8.2f} ms/page  {slow_queries} queries")
+    print(f"fast row path     : {fast_time * 1000:8.2f} ms/page  {fast_queries} queries")
+    print(f"speedup           : {slow_time / fast_time:8.1f}x")
+    print(f"byte-identical    : {slow_body == fast_body}")
+    if slow_body != fast_body:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
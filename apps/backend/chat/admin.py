@@ -1,6 +1,12 @@
 from django.contrib import admin
 
-from .models import Conversation, ConversationMember, Message, Profile
+from .models import (
+    ArchivedMessage,
+    Conversation,
+    ConversationMember,
+    Message,
+    Profile,
+)
 
 
 @admin.register(Conversation)
@@ -29,6 +35,13 @@ class MessageAdmin(admin.ModelAdmin):
     short_content.short_description = "Content"
 
 
+@admin.register(ArchivedMessage)
+class ArchivedMessageAdmin(admin.ModelAdmin):
+    list_display = ("id", "conversation", "sender", "created_at", "archived_at")
+    list_filter = ("archived_at",)
+    raw_id_fields = ("conversation", "sender")
+
+
 @admin.register(Profile)
 class ProfileAdmin(admin.ModelAdmin):
     list_display = ("id", "user", "ref_code", "created_at")
@@ -4,3 +4,15 @@ from django.apps import AppConfig
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chat'
+
+    def ready(self):
+        # Registers the token and membership cache invalidation handlers,
+        # the search index trigger check and the version cache and rate
+        # limit system checks.
+        from . import (  # noqa: F401
+            authentication,
+            membership,
+            ratelimit,
+            search,
+            versions,
+        )
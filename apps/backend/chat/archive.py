@@ -0,0 +1,131 @@
+"""
+Cold tier for conversation history.
+
+``archive_batch`` moves messages older than a cutoff from ``Message`` into
+``ArchivedMessage`` (same ids), so the hot table and its indexes only hold
+recent history. It is driven by the ``archive_messages`` management command.
+A conversation's newest message is never archived: it backs the inbox
+summary (``Conversation.last_message``).
+
+Only messages older than the cutoff move, and ids grow with ``created_at``,
+so a conversation's archived ids all lie below its hot ids. History reads
+therefore page through ``Message`` first and continue into the archive only
+when a page runs past the oldest hot message of a conversation whose
+``archived_until_id`` says it has archived rows. Recent history and
+never-archived conversations cost no extra query.
+
+Archived messages keep their place in history pagination (``before=`` and
+``around=``), incremental sync (``after=``) and the read-receipt watermark,
+and stay searchable through their own full-text index (see chat/search.py).
+"""
+
+from django.db import transaction
+from django.db.models import Case, Value, When
+
+from .models import ArchivedMessage, Conversation, Message
+from .serializers import message_rows
+
+
+ARCHIVE_FIELDS = (
+    "id",
+    "conversation_id",
+    "sender_id",
+    "content",
+    "created_at",
+    "client_msg_id",
+)
+
+
+def archive_batch(cutoff, batch_size: int) -> int:
+    """
+    Move up to ``batch_size`` messages created before ``cutoff`` (oldest
+    first) to the archive in one transaction; returns how many moved.
+    """
+
+    with transaction.atomic():
+        rows = list(
+            Message.objects.filter(created_at__lt=cutoff)
+            .exclude(
+                id__in=Conversation.objects.filter(
+                    last_message__isnull=False
+                ).values("last_message_id")
+            )
+            .order_by("id")
+            .values_list(*ARCHIVE_FIELDS)[:batch_size]
+        )
+        if not rows:
+            return 0
+        ArchivedMessage.objects.bulk_create(
+            [
+                ArchivedMessage(**dict(zip(ARCHIVE_FIELDS, row)))
+                for row in rows
+            ]
+        )
+        until = {}
+        for row in rows:
+            # Rows come in id order, so the last one per conversation wins.
+            until[row[1]] = row[0]
+        Conversation.objects.filter(pk__in=until).update(
+            archived_until_id=Case(
+                *(
+                    When(pk=conversation_id, then=Value(message_id))
+                    for conversation_id, message_id in until.items()
+                )
+            )
+        )
+        Message.objects.filter(id__in=[row[0] for row in rows]).delete()
+    return len(rows)
+
+
+def older(conversation, before_id, hot_rows: list, limit: int) -> list:
+    """
+    Top up ``hot_rows`` -- newest first, at most ``limit + 1`` rows below
+    ``before_id`` from ``Message`` -- with archived rows when the hot tier
+    ran out.
+    """
+
+    if conversation.archived_until_id is None or len(hot_rows) > limit:
+        return hot_rows
+    bound = hot_rows[-1].id if hot_rows else before_id
+    archived = ArchivedMessage.objects.filter(conversation_id=conversation.id)
+    if bound is not None:
+        archived = archived.filter(id__lt=bound)
+    return hot_rows + message_rows(
+        archived.order_by("-id")[: limit + 1 - len(hot_rows)]
+    )
+
+
+def newer(conversation, from_id: int, hot_rows: list, limit: int) -> list:
+    """
+    Prefix ``hot_rows`` -- oldest first, at most ``limit + 1`` rows from
+    ``from_id`` on -- with archived rows when ``from_id`` is in the archive.
+    """
+
+    until = conversation.archived_until_id
+    if until is None or from_id > until:
+        return hot_rows
+    archived = message_rows(
+        ArchivedMessage.objects.filter(
+            conversation_id=conversation.id, id__gte=from_id
+        ).order_by("id")[: limit + 1]
+    )
+    return (archived + hot_rows)[: limit + 1]
+
+
+def newest_until(conversation, created_at, hot_id: int | None) -> int | None:
+    """
+    ``hot_id`` -- the newest ``Message`` id created at or before
+    ``created_at`` -- or, when the hot tier has none, the newest such
+    archived id.
+    """
+
+    if hot_id is not None or conversation.archived_until_id is None:
+        return hot_id
+    return (
+        ArchivedMessage.objects.filter(
+            conversation_id=conversation.id, created_at__lte=created_at
+        )
+        .order_by("-created_at", "-id")
+        .values_list("id", flat=True)
+        .first()
+    )
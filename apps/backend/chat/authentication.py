@@ -0,0 +1,165 @@
+"""
+Token authentication with a per-process token -> user cache.
+
+``CachingTokenAuthentication`` is a drop-in replacement for DRF's
+``TokenAuthentication`` that skips the Token + User join for keys seen in the
+last ``CHAT_AUTH_CACHE_TTL`` seconds. The cache is a bounded LRU
+(``CHAT_AUTH_CACHE_SIZE`` entries, 0 disables it).
+
+Each entry remembers the user's auth version (``chat.versions``) at the time
+it was read from the database, and only counts as a hit while that version
+is current. Deleting or rotating a token, or saving or deleting its user,
+bumps the version once the transaction commits, so every worker sharing
+``CHAT_VERSION_CACHE`` stops honouring the old entry on its next request;
+this process also drops it at once. With a per-process version cache other
+workers cannot see the bump, so entries then live at most
+``UNSHARED_CACHE_TTL`` seconds.
+
+The helpers below serve entry points that live outside DRF's request cycle
+(the WebSocket endpoint and the long-poll view) and share the same cache.
+"""
+
+import copy
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from . import versions
+from .caching import LRUCache, process_singleton
+
+
+DEFAULT_CACHE_SIZE = 4096
+DEFAULT_CACHE_TTL = 300
+UNSHARED_CACHE_TTL = 5
+
+
+class TokenCache(LRUCache):
+    """
+    LRU of token key -> (token, auth version), expiring after ``ttl``
+    seconds.
+
+    Tokens are stored with their user but without any other related objects
+    cached, and every hit returns fresh copies so requests never share
+    mutable model instances.
+    """
+
+    def get(self, key: str):
+        entry = super().get(key)
+        if entry is None:
+            return None
+        token, version = entry
+        if version != versions.auth_version(token.user_id):
+            self.invalidate(key)
+            return None
+        token = copy.copy(token)
+        token.user = copy.copy(token.user)
+        return token
+
+    def set(self, token, version: int) -> None:
+        token = copy.copy(token)
+        user = copy.copy(token.user)
+        user._state.fields_cache = {}
+        token._state.fields_cache = {}
+        token.user = user
+        super().set(token.key, (token, version))
+
+    def invalidate_user(self, user_id: int) -> None:
+        self.invalidate_where(lambda key, entry: entry[0].user_id == user_id)
+
+
+@process_singleton
+def get_token_cache() -> TokenCache:
+    ttl = getattr(settings, "CHAT_AUTH_CACHE_TTL", DEFAULT_CACHE_TTL)
+    if not versions.shared():
+        ttl = min(ttl, UNSHARED_CACHE_TTL)
+    return TokenCache(
+        getattr(settings, "CHAT_AUTH_CACHE_SIZE", DEFAULT_CACHE_SIZE),
+        ttl=ttl,
+    )
+
+
+def _lookup_token(key: str):
+    token = get_token_cache().get(key)
+    if token is not None:
+        return token
+    user_id = (
+        Token.objects.filter(key=key).values_list("user_id", flat=True).first()
+    )
+    if user_id is None:
+        return None
+    # Read the version before the row that gets cached: a change committed
+    # after this read bumps past it, so the entry can never outlive it.
+    version = versions.auth_version(user_id)
+    token = Token.objects.select_related("user").filter(key=key).first()
+    if token is None:
+        return None
+    get_token_cache().set(token, version)
+    return token
+
+
+class CachingTokenAuthentication(TokenAuthentication):
+    """
+    ``TokenAuthentication`` backed by the process-wide token cache.
+    """
+
+    def authenticate_credentials(self, key):
+        token = _lookup_token(key)
+        if token is None:
+            raise exceptions.AuthenticationFailed(_("Invalid token."))
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _("User inactive or deleted.")
+            )
+        return (token.user, token)
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def _invalidate_token(sender, instance, **kwargs):
+    get_token_cache().invalidate(instance.key)
+    # A rotated key leaves the old key cached under the same user.
+    get_token_cache().invalidate_user(instance.user_id)
+    versions.bump_auth(instance.user_id)
+
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def _invalidate_user(sender, instance, **kwargs):
+    get_token_cache().invalidate_user(instance.pk)
+    versions.bump_auth(instance.pk)
+
+
+def token_from_header(value: str | None) -> str | None:
+    """
+    Extract the key from an ``Authorization: Token <key>`` header value.
+    """
+
+    parts = (value or "").split()
+    if len(parts) == 2 and parts[0].lower() == "token":
+        return parts[1]
+    return None
+
+
+async def aget_token_user(key: str | None):
+    """
+    Async equivalent of DRF's TokenAuthentication.authenticate_credentials;
+    returns the active user for ``key`` or ``None``.
+    """
+
+    if not key:
+        return None
+    token = get_token_cache().get(key)
+    if token is None:
+        token = await sync_to_async(_lookup_token)(key)
+        if token is None:
+            return None
+    if not token.user.is_active:
+        return None
+    return token.user
@@ -0,0 +1,116 @@
+"""
+Per-process building blocks shared by the chat modules.
+
+``LRUCache`` is the bounded, thread-safe LRU (with an optional TTL) behind
+the response, token and membership caches. ``process_singleton`` turns a
+factory into the lazily built, process-wide accessor used for every cache,
+queue, store and backend (``get_token_cache()``, ``get_email_queue()`` ...);
+``reset_singletons()`` drops them all so the next call rebuilds them from
+the current settings, which is what tests do between cases.
+"""
+
+import functools
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Thread-safe LRU of at most ``maxsize`` entries (0 disables it). With a
+    ``ttl`` entries also expire that many seconds after they were set.
+    Values must not be ``None``; ``get`` returns ``None`` for a miss.
+    """
+
+    def __init__(self, maxsize: int, ttl: float | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # key -> (value, expires_at or None)
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, key):
+        if self.maxsize <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value) -> None:
+        if self.maxsize <= 0:
+            return
+        expires_at = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_where(self, predicate) -> None:
+        """
+        Drop every entry for which ``predicate(key, value)`` is true.
+        """
+
+        with self._lock:
+            stale = [
+                key
+                for key, (value, _) in self._entries.items()
+                if predicate(key, value)
+            ]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+_singletons = []
+
+
+def process_singleton(factory):
+    """
+    Decorate a zero-argument factory so that calling it returns one shared
+    instance per process, built on first use.
+    """
+
+    lock = threading.Lock()
+    instance = None
+
+    @functools.wraps(factory)
+    def get():
+        nonlocal instance
+        if instance is None:
+            with lock:
+                if instance is None:
+                    instance = factory()
+        return instance
+
+    def reset() -> None:
+        nonlocal instance
+        with lock:
+            instance = None
+
+    get.reset = reset
+    _singletons.append(get)
+    return get
+
+
+def reset_singletons() -> None:
+    """
+    Forget every process singleton; each is rebuilt on its next use.
+    """
+
+    for get in _singletons:
+        get.reset()
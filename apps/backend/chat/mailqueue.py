@@ -0,0 +1,223 @@
+"""
+Background delivery for outbound email (login codes).
+
+Views hand a ready ``EmailMessage`` to ``enqueue`` and return; worker
+threads deliver queued messages in batches over one reused backend
+connection per worker, retrying failures with exponential backoff. The
+connection comes from ``django.core.mail.get_connection()``, so whatever
+``EMAIL_BACKEND`` is configured (SMTP, console, locmem) is used.
+
+``settings.CHAT_EMAIL_QUEUE_WORKERS`` sets the number of worker threads;
+0 sends inline in the calling thread, which keeps tests deterministic.
+With workers, tests can call ``get_email_queue().flush()`` before looking at
+``mail.outbox``.
+"""
+
+import atexit
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.db import transaction
+
+from .caching import process_singleton
+
+
+DEFAULT_WORKERS = 1
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_RETRY_DELAY = 2.0
+
+logger = logging.getLogger(__name__)
+
+
+class EmailQueue:
+    """
+    Thread-safe delivery queue. Entries are ordered by the time they become
+    due, so retries wait out their backoff without blocking fresh mail.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        retry_delay: float = DEFAULT_RETRY_DELAY,
+    ):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._cond = threading.Condition()
+        # (due_at, sequence, attempts, message)
+        self._heap: list = []
+        self._sequence = itertools.count()
+        self._pending = 0
+        self._threads: list[threading.Thread] = []
+        self._sent = 0
+        self._retried = 0
+        self._failed = 0
+
+    def enqueue(self, message) -> None:
+        if self.workers <= 0:
+            get_connection().send_messages([message])
+            with self._cond:
+                self._sent += 1
+            return
+        with self._cond:
+            heapq.heappush(
+                self._heap, (0.0, next(self._sequence), 0, message)
+            )
+            self._pending += 1
+            self._cond.notify()
+        self._ensure_threads()
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """
+        Wait until every queued message is delivered or given up on;
+        returns False on timeout.
+        """
+
+        with self._cond:
+            return self._cond.wait_for(lambda: self._pending == 0, timeout)
+
+    def metrics(self) -> dict:
+        with self._cond:
+            return {
+                "pending": self._pending,
+                "sent": self._sent,
+                "retried": self._retried,
+                "failed": self._failed,
+            }
+
+    def _ensure_threads(self) -> None:
+        if len(self._threads) >= self.workers:
+            return
+        with self._cond:
+            if self._threads:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(
+                    target=self._run,
+                    name=f"email-queue-{index}",
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+        atexit.register(self.flush, 10)
+
+    def _next_batch(self, block: bool) -> list:
+        """
+        Pop up to ``batch_size`` due entries. When ``block`` is set, wait
+        until at least one is due; otherwise return what is due right now.
+        """
+
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self._heap and self._heap[0][0] <= now:
+                    break
+                if not block:
+                    return []
+                timeout = self._heap[0][0] - now if self._heap else None
+                self._cond.wait(timeout)
+            batch = []
+            while (
+                self._heap
+                and self._heap[0][0] <= now
+                and len(batch) < self.batch_size
+            ):
+                batch.append(heapq.heappop(self._heap))
+            return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch(block=True)
+            connection = get_connection()
+            try:
+                # Keep one connection open while there is mail to send.
+                while batch:
+                    self._deliver(connection, batch)
+                    batch = self._next_batch(block=False)
+            finally:
+                try:
+                    connection.close()
+                except Exception:
+                    logger.exception("Failed to close the email connection")
+
+    def _deliver(self, connection, batch) -> None:
+        try:
+            connection.open()
+        except Exception:
+            logger.exception("Failed to open the email connection")
+            self._retry(batch)
+            return
+        for entry in batch:
+            try:
+                connection.send_messages([entry[3]])
+            except Exception:
+                logger.exception("Failed to send email to %s", entry[3].to)
+                # The connection may be broken; reopen it for the next one.
+                try:
+                    connection.close()
+                    connection.open()
+                except Exception:
+                    pass
+                self._retry([entry])
+            else:
+                with self._cond:
+                    self._sent += 1
+                    self._pending -= 1
+                    self._cond.notify_all()
+
+    def _retry(self, entries) -> None:
+        with self._cond:
+            for _, _, attempts, message in entries:
+                attempts += 1
+                if attempts >= self.max_attempts:
+                    logger.error(
+                        "Giving up on email to %s after %d attempts",
+                        message.to,
+                        attempts,
+                    )
+                    self._failed += 1
+                    self._pending -= 1
+                    continue
+                self._retried += 1
+                due_at = time.monotonic() + self.retry_delay * 2 ** (
+                    attempts - 1
+                )
+                heapq.heappush(
+                    self._heap,
+                    (due_at, next(self._sequence), attempts, message),
+                )
+            self._cond.notify_all()
+
+
+@process_singleton
+def get_email_queue() -> EmailQueue:
+    return EmailQueue(
+        getattr(settings, "CHAT_EMAIL_QUEUE_WORKERS", DEFAULT_WORKERS),
+        batch_size=getattr(
+            settings, "CHAT_EMAIL_BATCH_SIZE", DEFAULT_BATCH_SIZE
+        ),
+        max_attempts=getattr(
+            settings, "CHAT_EMAIL_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS
+        ),
+        retry_delay=getattr(
+            settings, "CHAT_EMAIL_RETRY_DELAY", DEFAULT_RETRY_DELAY
+        ),
+    )
+
+
+def enqueue(message) -> None:
+    """
+    Queue ``message`` once the current transaction (if any) commits, so a
+    rolled-back request never sends mail.
+    """
+
+    transaction.on_commit(lambda: get_email_queue().enqueue(message))
@@ -0,0 +1,66 @@
+"""
+Move old messages from the hot Message table into the archive tier.
+
+Meant to run periodically (cron, systemd timer, ...):
+
+    python manage.py archive_messages [--older-than-days 180]
+        [--batch-size 1000] [--pause 0.1]
+
+See chat/archive.py for how archived history is read back.
+"""
+
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone as dj_timezone
+
+from chat import archive
+
+
+DEFAULT_ARCHIVE_AFTER_DAYS = 180
+
+
+class Command(BaseCommand):
+    help = "Archive messages older than a given age, in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than-days",
+            type=int,
+            default=getattr(
+                settings, "CHAT_ARCHIVE_AFTER_DAYS", DEFAULT_ARCHIVE_AFTER_DAYS
+            ),
+            help="Archive messages older than this many days "
+            "(default settings.CHAT_ARCHIVE_AFTER_DAYS).",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Messages moved per transaction (default 1000).",
+        )
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=0.0,
+            help="Seconds to sleep between batches, to spread the load.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options["batch_size"])
+        cutoff = dj_timezone.now() - timedelta(
+            days=max(0, options["older_than_days"])
+        )
+
+        total = 0
+        while True:
+            moved = archive.archive_batch(cutoff, batch_size)
+            total += moved
+            if moved < batch_size:
+                break
+            if options["pause"]:
+                time.sleep(options["pause"])
+
+        self.stdout.write(f"Archived {total} messages.")
@@ -0,0 +1,55 @@
+"""
+Delete expired and used login codes in small batches.
+
+Meant to run periodically (cron, systemd timer, ...):
+
+    python manage.py purge_login_codes [--batch-size 1000] [--pause 0.1]
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone as dj_timezone
+
+from chat.models import LoginCode
+
+
+class Command(BaseCommand):
+    help = "Purge expired and used login codes in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Rows deleted per statement (default 1000).",
+        )
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=0.0,
+            help="Seconds to sleep between batches, to spread the load.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options["batch_size"])
+        now = dj_timezone.now()
+        stale = LoginCode.objects.filter(
+            Q(expires_at__lt=now) | Q(is_used=True)
+        ).order_by()
+
+        total = 0
+        while True:
+            # Short transactions: select a batch of ids, delete exactly those.
+            ids = list(stale.values_list("id", flat=True)[:batch_size])
+            if not ids:
+                break
+            deleted, _ = LoginCode.objects.filter(id__in=ids).delete()
+            total += deleted
+            if len(ids) < batch_size:
+                break
+            if options["pause"]:
+                time.sleep(options["pause"])
+
+        self.stdout.write(f"Purged {total} login codes.")
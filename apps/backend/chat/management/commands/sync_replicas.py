@@ -0,0 +1,47 @@
+"""
+Copy the primary SQLite database onto the configured read replicas.
+
+Local stand-in for database replication when trying DATABASE_REPLICA_URLS
+with SQLite files (see chat/routers.py). Replicas only change when this runs,
+which makes replica lag easy to observe:
+
+    python manage.py sync_replicas
+"""
+
+import sqlite3
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from chat.routers import replica_aliases
+
+
+class Command(BaseCommand):
+    help = "Copy the primary SQLite database onto every SQLite replica."
+
+    def handle(self, *args, **options):
+        aliases = replica_aliases()
+        if not aliases:
+            raise CommandError("No replicas configured (DATABASE_REPLICA_URLS).")
+        primary = connections[DEFAULT_DB_ALIAS]
+        if primary.vendor != "sqlite" or any(
+            connections[alias].vendor != "sqlite" for alias in aliases
+        ):
+            raise CommandError(
+                "sync_replicas only copies SQLite files; use the database's "
+                "own replication otherwise."
+            )
+
+        source = sqlite3.connect(primary.settings_dict["NAME"])
+        try:
+            for alias in aliases:
+                # Drop any open handle so the copy is seen by the next query.
+                connections[alias].close()
+                target = sqlite3.connect(connections[alias].settings_dict["NAME"])
+                try:
+                    source.backup(target)
+                finally:
+                    target.close()
+                self.stdout.write(f"Synced {alias}.")
+        finally:
+            source.close()
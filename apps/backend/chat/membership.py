@@ -0,0 +1,119 @@
+"""
+Conversation membership authorization.
+
+``require_member(user, conversation_id)`` is the single gate for
+conversation endpoints: it returns the caller's ``ConversationMember`` id,
+raises ``Http404`` for an unknown conversation and ``PermissionDenied`` for
+a conversation the caller is not in. Nobody is auto-joined.
+
+Positive answers are kept in a per-process LRU of
+(user_id, conversation_id) -> membership id, so a polling client is
+authorized without a query. Entries are dropped when a membership is created
+(join) or deleted (leave) in this process; ``CHAT_MEMBERSHIP_CACHE_TTL``
+bounds how long another process may keep honouring a membership that was
+removed elsewhere. Joins and leaves also bump the conversation's and the
+members' versions (``chat.versions``), so cached pages and ETags issued
+before the change stop matching, and a leave tells the user's open
+WebSockets to drop the conversation (``membership.removed``).
+Negative answers are never cached, so a new member is let in immediately.
+
+Membership rows also carry the inbox sort key
+(``ConversationMember.conversation_updated_at``); ``Conversation.save()``
+copies its ``updated_at`` onto them here, sends do it in
+``chat.messaging``.
+"""
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.http import Http404
+from rest_framework.exceptions import PermissionDenied
+
+from . import realtime, versions
+from .caching import LRUCache, process_singleton
+from .models import Conversation, ConversationMember
+
+
+DEFAULT_CACHE_SIZE = 65536
+DEFAULT_CACHE_TTL = 60
+
+
+@process_singleton
+def get_membership_cache() -> LRUCache:
+    """
+    LRU of (user_id, conversation_id) -> membership id.
+    """
+
+    return LRUCache(
+        getattr(settings, "CHAT_MEMBERSHIP_CACHE_SIZE", DEFAULT_CACHE_SIZE),
+        ttl=getattr(settings, "CHAT_MEMBERSHIP_CACHE_TTL", DEFAULT_CACHE_TTL),
+    )
+
+
+@receiver(post_save, sender=ConversationMember)
+@receiver(post_delete, sender=ConversationMember)
+def _membership_changed(sender, instance, created=False, **kwargs):
+    if kwargs["signal"] is post_save and not created:
+        # Read markers and counters change constantly; only joins matter.
+        return
+    get_membership_cache().invalidate(
+        (instance.user_id, instance.conversation_id)
+    )
+    if kwargs["signal"] is post_delete:
+        # Live sockets subscribed when the user was still a member.
+        realtime.publish_membership_removed(
+            instance.conversation_id, instance.user_id
+        )
+    # Member lists show up in the conversation and in every member's inbox;
+    # the joining or leaving user's inbox gains or loses the conversation.
+    versions.bump_conversation(instance.conversation_id)
+    versions.bump_inboxes(
+        {
+            instance.user_id,
+            *ConversationMember.objects.filter(
+                conversation_id=instance.conversation_id
+            ).values_list("user_id", flat=True),
+        }
+    )
+
+
+@receiver(post_save, sender=Conversation)
+def _sync_inbox_order(sender, instance, created=False, **kwargs):
+    # Conversation.save() moves updated_at (auto_now); carry it over to the
+    # members' inbox sort key. New conversations have no members yet.
+    if created:
+        return
+    ConversationMember.objects.filter(conversation=instance).update(
+        conversation_updated_at=instance.updated_at
+    )
+
+
+def _denied(conversation_exists: bool):
+    if not conversation_exists:
+        return Http404("No Conversation matches the given query.")
+    return PermissionDenied("You are not a member of this conversation.")
+
+
+def require_member(user, conversation_id: int) -> int:
+    """
+    Return the user's membership id in the conversation, or raise Http404 /
+    PermissionDenied.
+    """
+
+    key = (user.id, conversation_id)
+    membership_id = get_membership_cache().get(key)
+    if membership_id is not None:
+        return membership_id
+    membership_id = (
+        ConversationMember.objects.filter(
+            conversation_id=conversation_id, user=user
+        )
+        .values_list("id", flat=True)
+        .first()
+    )
+    if membership_id is None:
+        raise _denied(
+            Conversation.objects.filter(id=conversation_id).exists()
+        )
+    get_membership_cache().set(key, membership_id)
+    return membership_id
@@ -0,0 +1,161 @@
+"""
+Sending messages.
+
+``send_message`` is the one write path for new messages. Inside a single
+transaction it issues the minimum set of statements:
+
+1. INSERT the message;
+2. UPDATE the conversation -- inbox order (``updated_at``), the last-message
+   summary and ``message_count`` -- in one statement, without reading the
+   row first;
+3. UPDATE the members' inbox order (``conversation_updated_at``) and the
+   other members' ``unread_count`` in one statement;
+4. SELECT the member ids whose inbox versions must be bumped.
+
+Membership is checked by the caller (``chat.membership.require_member``,
+normally a cache hit), so nothing is fetched up front. Version bumps and
+realtime events only go out once the transaction commits.
+
+A send may carry a ``client_msg_id``. It is unique per (conversation,
+sender), so a retried request loses the INSERT race to the original and gets
+the original message back (``created`` is False) instead of a duplicate,
+with no counters touched twice.
+
+``send_messages`` does the same for a batch (a client flushing its offline
+queue): one SELECT for already-sent keys, one ``bulk_create`` and a single
+conversation/counter bump for the whole batch.
+"""
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, When
+from django.utils import timezone
+
+from . import versions
+from .models import Conversation, ConversationMember, Message
+
+
+MESSAGE_PREVIEW_LENGTH = 120
+CLIENT_MSG_ID_MAX_LENGTH = 64
+# Keep within views.MESSAGE_RATE, which every bulk item is charged against.
+BULK_MAX_MESSAGES = 50
+
+
+def message_preview(content: str) -> str:
+    content = " ".join(content.split())
+    if len(content) > MESSAGE_PREVIEW_LENGTH:
+        return content[: MESSAGE_PREVIEW_LENGTH - 1] + "…"
+    return content
+
+
+def _record_sent(conversation_id: int, sender, last_message, count: int):
+    """
+    Bump the conversation summary and counters for ``count`` new messages
+    ending with ``last_message``. Must run inside the sending transaction.
+    """
+
+    now = timezone.now()
+    Conversation.objects.filter(pk=conversation_id).update(
+        updated_at=now,
+        last_message=last_message,
+        last_message_preview=message_preview(last_message.content),
+        last_message_at=last_message.created_at,
+        message_count=F("message_count") + count,
+    )
+    ConversationMember.objects.filter(conversation_id=conversation_id).update(
+        conversation_updated_at=now,
+        unread_count=Case(
+            When(user=sender, then=F("unread_count")),
+            default=F("unread_count") + count,
+        ),
+    )
+    versions.bump_conversation(conversation_id)
+    versions.bump_inboxes(
+        ConversationMember.objects.filter(
+            conversation_id=conversation_id
+        ).values_list("user_id", flat=True)
+    )
+
+
+def send_message(
+    conversation_id: int, sender, content: str, client_msg_id=None
+) -> tuple[Message, bool]:
+    """
+    Append a message from ``sender`` (already known to be a member) and
+    return (message, created). ``created`` is False when ``client_msg_id``
+    matched an earlier send, which is returned unchanged.
+    """
+
+    try:
+        with transaction.atomic():
+            message = Message.objects.create(
+                conversation_id=conversation_id,
+                sender=sender,
+                content=content,
+                client_msg_id=client_msg_id,
+            )
+            _record_sent(conversation_id, sender, message, 1)
+    except IntegrityError:
+        if client_msg_id is None:
+            raise
+        existing = Message.objects.filter(
+            conversation_id=conversation_id,
+            sender=sender,
+            client_msg_id=client_msg_id,
+        ).first()
+        if existing is None:
+            raise
+        return existing, False
+    return message, True
+
+
+def send_messages(
+    conversation_id: int, sender, items
+) -> list[tuple[Message, bool]]:
+    """
+    Append a batch of (content, client_msg_id) items from ``sender`` in
+    order and return (message, created) for each item. Items whose key was
+    already sent -- earlier, or earlier in the same batch -- come back as the
+    existing message with ``created`` False.
+    """
+
+    items = list(items)
+    keys = {key for _, key in items if key is not None}
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                sent = {}
+                if keys:
+                    sent = {
+                        message.client_msg_id: message
+                        for message in Message.objects.filter(
+                            conversation_id=conversation_id,
+                            sender=sender,
+                            client_msg_id__in=keys,
+                        )
+                    }
+                results, new = [], []
+                for content, key in items:
+                    if key is not None and key in sent:
+                        results.append((sent[key], False))
+                        continue
+                    message = Message(
+                        conversation_id=conversation_id,
+                        sender=sender,
+                        content=content,
+                        client_msg_id=key,
+                    )
+                    new.append(message)
+                    results.append((message, True))
+                    if key is not None:
+                        sent[key] = message
+                if new:
+                    # Needs INSERT ... RETURNING (SQLite 3.35+, Postgres) so
+                    # the new rows come back with their ids.
+                    Message.objects.bulk_create(new)
+                    _record_sent(conversation_id, sender, new[-1], len(new))
+            return results
+        except IntegrityError:
+            # A concurrent request sent one of the keys after our SELECT;
+            # look again, once.
+            if attempt or not keys:
+                raise
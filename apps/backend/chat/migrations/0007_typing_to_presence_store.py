@@ -0,0 +1,26 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:07
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_indexes'),
+    ]
+
+    operations = [
+        migrations.RenameIndex(
+            model_name='conversation',
+            new_name='chat_conver_updated_09e193_idx',
+            old_name='chat_conversation_updated_at_idx',
+        ),
+        migrations.RenameIndex(
+            model_name='message',
+            new_name='chat_messag_sender__b02346_idx',
+            old_name='chat_message_sender_created_idx',
+        ),
+        migrations.DeleteModel(
+            name='TypingStatus',
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_summaries(apps, schema_editor):
+    Conversation = apps.get_model("chat", "Conversation")
+    ConversationMember = apps.get_model("chat", "ConversationMember")
+    Message = apps.get_model("chat", "Message")
+
+    for conversation in Conversation.objects.iterator():
+        last = (
+            Message.objects.filter(conversation=conversation)
+            .order_by("-created_at", "-id")
+            .first()
+        )
+        if last is not None:
+            Conversation.objects.filter(pk=conversation.pk).update(
+                last_message=last,
+                last_message_preview=last.content[:120],
+                last_message_at=last.created_at,
+            )
+    for member in ConversationMember.objects.iterator():
+        unread = Message.objects.filter(
+            conversation_id=member.conversation_id
+        ).exclude(sender_id=member.user_id)
+        if member.last_read_at is not None:
+            unread = unread.filter(created_at__gt=member.last_read_at)
+        ConversationMember.objects.filter(pk=member.pk).update(
+            unread_count=unread.count()
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_typing_to_presence_store'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.message'),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_preview',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='conversationmember',
+            name='unread_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_conversation_summary'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='conversation',
+            name='chat_conver_updated_09e193_idx',
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['updated_at', 'id'], name='chat_conver_updated_47af34_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:10
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_conversation_keyset_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'id'], name='chat_messag_convers_0a488e_idx'),
+        ),
+    ]
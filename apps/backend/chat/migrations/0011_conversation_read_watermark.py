@@ -0,0 +1,40 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:11
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Q
+
+
+def backfill_read_watermarks(apps, schema_editor):
+    Conversation = apps.get_model("chat", "Conversation")
+    ConversationMember = apps.get_model("chat", "ConversationMember")
+
+    for conversation in Conversation.objects.iterator():
+        stats = ConversationMember.objects.filter(
+            conversation=conversation
+        ).aggregate(
+            members=Count("id"),
+            never_read=Count("id", filter=Q(last_read_at__isnull=True)),
+            oldest=Min("last_read_at"),
+        )
+        if stats["members"] > 1 and not stats["never_read"]:
+            Conversation.objects.filter(pk=conversation.pk).update(
+                read_watermark=stats["oldest"]
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0010_message_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='read_watermark',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(
+            backfill_read_watermarks, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:30
+
+from django.db import migrations, models
+from django.utils.crypto import salted_hmac
+
+
+def hash_existing_codes(apps, schema_editor):
+    LoginCode = apps.get_model("chat", "LoginCode")
+    for login_code in LoginCode.objects.only("id", "code_hash").iterator():
+        # Same keyed hash as LoginCode.hash_code at the time of writing.
+        login_code.code_hash = salted_hmac(
+            "chat.LoginCode.code",
+            login_code.code_hash.strip().upper(),
+            algorithm="sha256",
+        ).hexdigest()
+        login_code.save(update_fields=["code_hash"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0011_conversation_read_watermark'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='logincode',
+            old_name='code',
+            new_name='code_hash',
+        ),
+        migrations.AlterField(
+            model_name='logincode',
+            name='code_hash',
+            field=models.CharField(max_length=64),
+        ),
+        migrations.RunPython(hash_existing_codes, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='logincode',
+            index=models.Index(fields=['user', 'code_hash', 'expires_at'], name='chat_loginc_user_id_3603ee_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='logincode',
+            index=models.Index(fields=['expires_at'], name='chat_loginc_expires_d9557f_idx'),
+        ),
+    ]
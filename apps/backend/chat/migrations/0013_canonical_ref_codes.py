@@ -0,0 +1,59 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:25
+
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Frozen copies of chat.refcodes.ALPHABET / LENGTH: migrations must not
+# depend on live app code (or on SECRET_KEY, which refcodes.encode now does).
+ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+LENGTH = 6
+
+
+def _suffixed(code, n):
+    """
+    ``code`` with its tail replaced by ``n`` written in base 36.
+    """
+
+    suffix = ""
+    while True:
+        n, digit = divmod(n, len(ALPHABET))
+        suffix = ALPHABET[digit] + suffix
+        if not n:
+            break
+    return code[: LENGTH - len(suffix)] + suffix
+
+
+def uppercase_ref_codes(apps, schema_editor):
+    Profile = apps.get_model("chat", "Profile")
+    taken = set(Profile.objects.values_list("ref_code", flat=True))
+    for profile in Profile.objects.exclude(
+        ref_code=django.db.models.functions.text.Upper("ref_code")
+    ):
+        code = profile.ref_code.upper()
+        n = 0
+        # The upper-cased code can clash with another profile's code; walk
+        # suffixes until a free one turns up.
+        while code in taken:
+            code = _suffixed(profile.ref_code.upper(), n)
+            n += 1
+        taken.discard(profile.ref_code)
+        taken.add(code)
+        Profile.objects.filter(pk=profile.pk).update(ref_code=code)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0012_hashed_login_codes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(uppercase_ref_codes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='profile',
+            constraint=models.CheckConstraint(condition=models.Q(('ref_code', django.db.models.functions.text.Upper('ref_code'))), name='chat_profile_ref_code_upper'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:25
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_direct_pairs(apps, schema_editor):
+    Conversation = apps.get_model("chat", "Conversation")
+    ConversationMember = apps.get_model("chat", "ConversationMember")
+
+    members = {}
+    for conversation_id, user_id in ConversationMember.objects.filter(
+        conversation__is_group=False
+    ).values_list("conversation_id", "user_id"):
+        members.setdefault(conversation_id, set()).add(user_id)
+
+    # Duplicate direct chats may exist from before the constraint; the most
+    # recently active one becomes the canonical chat for the pair.
+    claimed = set()
+    for conversation_id in Conversation.objects.filter(
+        is_group=False
+    ).order_by("-updated_at", "-id").values_list("id", flat=True):
+        users = members.get(conversation_id, set())
+        if len(users) != 2:
+            continue
+        pair = tuple(sorted(users))
+        if pair in claimed:
+            continue
+        claimed.add(pair)
+        Conversation.objects.filter(pk=conversation_id).update(
+            direct_user_min_id=pair[0], direct_user_max_id=pair[1]
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0013_canonical_ref_codes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='direct_user_max',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='direct_user_min',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(backfill_direct_pairs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='conversation',
+            constraint=models.UniqueConstraint(fields=('direct_user_min', 'direct_user_max'), name='chat_conversation_direct_pair'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:29
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_message_counts(apps, schema_editor):
+    Conversation = apps.get_model("chat", "Conversation")
+    Message = apps.get_model("chat", "Message")
+
+    counts = (
+        Message.objects.filter(conversation=OuterRef("pk"))
+        .order_by()
+        .values("conversation")
+        .annotate(total=Count("id"))
+        .values("total")
+    )
+    Conversation.objects.update(message_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0014_conversation_direct_pair'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(
+            backfill_message_counts, migrations.RunPython.noop
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='client_msg_id',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='message',
+            constraint=models.UniqueConstraint(condition=models.Q(('client_msg_id__isnull', False)), fields=('conversation', 'sender', 'client_msg_id'), name='chat_message_client_msg_id'),
+        ),
+    ]
@@ -0,0 +1,88 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:41
+
+from django.db import migrations
+
+
+# Also reinstalled after every migrate by chat/search.py: rebuilding
+# chat_message on SQLite (as some schema changes do) drops its triggers.
+SQLITE_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS chat_message_fts_insert
+    AFTER INSERT ON chat_message BEGIN
+        INSERT INTO chat_message_fts (rowid, content)
+        VALUES (new.id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS chat_message_fts_delete
+    AFTER DELETE ON chat_message BEGIN
+        INSERT INTO chat_message_fts (chat_message_fts, rowid, content)
+        VALUES ('delete', old.id, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS chat_message_fts_update
+    AFTER UPDATE OF content ON chat_message BEGIN
+        INSERT INTO chat_message_fts (chat_message_fts, rowid, content)
+        VALUES ('delete', old.id, old.content);
+        INSERT INTO chat_message_fts (rowid, content)
+        VALUES (new.id, new.content);
+    END
+    """,
+]
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS chat_message_fts USING fts5(
+        content,
+        content='chat_message',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    *SQLITE_TRIGGERS,
+    # Index the messages that already exist.
+    "INSERT INTO chat_message_fts (chat_message_fts) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS chat_message_fts_insert",
+    "DROP TRIGGER IF EXISTS chat_message_fts_delete",
+    "DROP TRIGGER IF EXISTS chat_message_fts_update",
+    "DROP TABLE IF EXISTS chat_message_fts",
+]
+
+POSTGRES_FORWARD = [
+    """
+    CREATE INDEX IF NOT EXISTS chat_message_content_fts
+    ON chat_message USING gin (to_tsvector('simple', content))
+    """,
+]
+
+POSTGRES_BACKWARD = [
+    "DROP INDEX IF EXISTS chat_message_content_fts",
+]
+
+
+def _run(statements_by_vendor):
+    def run(apps, schema_editor):
+        for statement in statements_by_vendor.get(
+            schema_editor.connection.vendor, []
+        ):
+            schema_editor.execute(statement)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0015_message_send_service'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run({"sqlite": SQLITE_FORWARD, "postgresql": POSTGRES_FORWARD}),
+            _run({"sqlite": SQLITE_BACKWARD, "postgresql": POSTGRES_BACKWARD}),
+        ),
+    ]
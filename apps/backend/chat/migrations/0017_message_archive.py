@@ -0,0 +1,37 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:36
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0016_message_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='archived_until_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='ArchivedMessage',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('content', models.TextField()),
+                ('created_at', models.DateTimeField()),
+                ('client_msg_id', models.CharField(blank=True, max_length=64, null=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('conversation', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='archived_messages', to='chat.conversation')),
+                ('sender', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['conversation', 'id'], name='chat_archiv_convers_bae8b5_idx')],
+            },
+        ),
+    ]
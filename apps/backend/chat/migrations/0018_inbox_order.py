@@ -0,0 +1,46 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:50
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_conversation_updated_at(apps, schema_editor):
+    Conversation = apps.get_model("chat", "Conversation")
+    ConversationMember = apps.get_model("chat", "ConversationMember")
+
+    ConversationMember.objects.update(
+        conversation_updated_at=Subquery(
+            Conversation.objects.filter(pk=OuterRef("conversation_id")).values(
+                "updated_at"
+            )[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0017_message_archive'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='conversation',
+            name='chat_conver_updated_47af34_idx',
+        ),
+        migrations.AddField(
+            model_name='conversationmember',
+            name='conversation_updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(
+            backfill_conversation_updated_at, migrations.RunPython.noop
+        ),
+        migrations.AddIndex(
+            model_name='conversationmember',
+            index=models.Index(fields=['user', 'conversation_updated_at', 'conversation'], name='chat_conver_user_id_796eab_idx'),
+        ),
+    ]
@@ -0,0 +1,91 @@
+# Generated by Django 5.2.8 on 2026-10-17 06:10
+
+from django.db import migrations
+
+
+# Also reinstalled after every migrate by chat/search.py, like the
+# chat_message triggers of 0016.
+SQLITE_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS chat_archivedmessage_fts_insert
+    AFTER INSERT ON chat_archivedmessage BEGIN
+        INSERT INTO chat_archivedmessage_fts (rowid, content)
+        VALUES (new.id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS chat_archivedmessage_fts_delete
+    AFTER DELETE ON chat_archivedmessage BEGIN
+        INSERT INTO chat_archivedmessage_fts
+            (chat_archivedmessage_fts, rowid, content)
+        VALUES ('delete', old.id, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS chat_archivedmessage_fts_update
+    AFTER UPDATE OF content ON chat_archivedmessage BEGIN
+        INSERT INTO chat_archivedmessage_fts
+            (chat_archivedmessage_fts, rowid, content)
+        VALUES ('delete', old.id, old.content);
+        INSERT INTO chat_archivedmessage_fts (rowid, content)
+        VALUES (new.id, new.content);
+    END
+    """,
+]
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS chat_archivedmessage_fts USING fts5(
+        content,
+        content='chat_archivedmessage',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    *SQLITE_TRIGGERS,
+    # Index the messages archived before this migration.
+    "INSERT INTO chat_archivedmessage_fts (chat_archivedmessage_fts) "
+    "VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS chat_archivedmessage_fts_insert",
+    "DROP TRIGGER IF EXISTS chat_archivedmessage_fts_delete",
+    "DROP TRIGGER IF EXISTS chat_archivedmessage_fts_update",
+    "DROP TABLE IF EXISTS chat_archivedmessage_fts",
+]
+
+POSTGRES_FORWARD = [
+    """
+    CREATE INDEX IF NOT EXISTS chat_archivedmessage_content_fts
+    ON chat_archivedmessage USING gin (to_tsvector('simple', content))
+    """,
+]
+
+POSTGRES_BACKWARD = [
+    "DROP INDEX IF EXISTS chat_archivedmessage_content_fts",
+]
+
+
+def _run(statements_by_vendor):
+    def run(apps, schema_editor):
+        for statement in statements_by_vendor.get(
+            schema_editor.connection.vendor, []
+        ):
+            schema_editor.execute(statement)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0018_inbox_order'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run({"sqlite": SQLITE_FORWARD, "postgresql": POSTGRES_FORWARD}),
+            _run({"sqlite": SQLITE_BACKWARD, "postgresql": POSTGRES_BACKWARD}),
+        ),
+    ]
@@ -1,6 +1,8 @@
 from django.conf import settings
 from django.db import models
+from django.db.models.functions import Upper
 from django.utils import timezone
+from django.utils.crypto import salted_hmac
 
 
 class Conversation(models.Model):
@@ -13,9 +15,49 @@ class Conversation(models.Model):
     is_group = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Denormalized summary of the newest message so the inbox can render
+    # previews without touching the Message table.
+    last_message = models.ForeignKey(
+        "Message",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    last_message_preview = models.CharField(max_length=255, blank=True)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    message_count = models.PositiveIntegerField(default=0)
+    # Oldest last_read_at across members (None while anyone has read
+    # nothing): a message is "read by all" iff created_at <= read_watermark.
+    read_watermark = models.DateTimeField(null=True, blank=True)
+    # Highest message id moved to ArchivedMessage (None: nothing archived),
+    # so history reads know whether to look in the archive at all.
+    archived_until_id = models.BigIntegerField(null=True, blank=True)
+    # Canonical (lower id, higher id) participants of a direct conversation;
+    # unique, so each pair has at most one direct chat. Null for groups.
+    direct_user_min = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    direct_user_max = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
 
     class Meta:
         ordering = ["-updated_at"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["direct_user_min", "direct_user_max"],
+                name="chat_conversation_direct_pair",
+            ),
+        ]
 
     def __str__(self) -> str:
         if self.title:
@@ -42,10 +84,24 @@ class ConversationMember(models.Model):
     joined_at = models.DateTimeField(auto_now_add=True)
     is_admin = models.BooleanField(default=False)
     last_read_at = models.DateTimeField(null=True, blank=True)
+    # Messages from other members newer than last_read_at; maintained on
+    # send and on read so badges need no COUNT over Message.
+    unread_count = models.PositiveIntegerField(default=0)
+    # Copy of Conversation.updated_at, so a user's inbox pages along the
+    # (user, conversation_updated_at, conversation) index without touching
+    # other users' rows. Kept in step by chat.messaging and
+    # chat.membership.
+    conversation_updated_at = models.DateTimeField(default=timezone.now)
 
     class Meta:
         unique_together = ("conversation", "user")
         ordering = ["joined_at"]
+        indexes = [
+            # Keyset pagination of the inbox.
+            models.Index(
+                fields=["user", "conversation_updated_at", "conversation"]
+            ),
+        ]
 
     def __str__(self) -> str:
         return f"{self.user} in {self.conversation}"
@@ -68,50 +124,74 @@ class Message(models.Model):
     )
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    # Optional key chosen by the sending client; a retried send with the
+    # same key returns the original message instead of a duplicate.
+    client_msg_id = models.CharField(max_length=64, null=True, blank=True)
 
     class Meta:
         ordering = ["created_at"]
         indexes = [
             models.Index(fields=["conversation", "created_at"]),
+            # Keyset pagination of history on (conversation_id, id).
+            models.Index(fields=["conversation", "id"]),
             models.Index(fields=["sender", "created_at"]),
         ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["conversation", "sender", "client_msg_id"],
+                condition=models.Q(client_msg_id__isnull=False),
+                name="chat_message_client_msg_id",
+            ),
+        ]
 
     def __str__(self) -> str:
         return f"Message {self.pk} in {self.conversation}"
 
 
-class TypingStatus(models.Model):
+class ArchivedMessage(models.Model):
     """
-    Ephemeral typing indicator per conversation/user.
-    Entries are considered active only for a short window based on updated_at.
+    Cold storage for old messages, moved out of Message by the
+    ``archive_messages`` management command. Rows keep their original id,
+    so history pagination by id continues across both tables (see
+    chat/archive.py).
     """
 
+    id = models.BigIntegerField(primary_key=True)
     conversation = models.ForeignKey(
         Conversation,
         on_delete=models.CASCADE,
-        related_name="typing_statuses",
+        related_name="archived_messages",
+        # Covered by the (conversation, id) index.
+        db_index=False,
     )
-    user = models.ForeignKey(
+    sender = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
-        related_name="typing_statuses",
+        related_name="+",
     )
-    is_typing = models.BooleanField(default=False)
-    updated_at = models.DateTimeField(auto_now=True)
+    content = models.TextField()
+    created_at = models.DateTimeField()
+    client_msg_id = models.CharField(max_length=64, null=True, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
-        unique_together = ("conversation", "user")
+        ordering = ["id"]
         indexes = [
-            models.Index(fields=["conversation", "updated_at"]),
+            models.Index(fields=["conversation", "id"]),
         ]
 
     def __str__(self) -> str:
-        return f"TypingStatus(user={self.user_id}, conv={self.conversation_id})"
+        return f"ArchivedMessage {self.pk} in {self.conversation}"
 
 
 class LoginCode(models.Model):
     """
     One-time login code sent to a user's email.
+
+    Only a keyed hash of the normalized code is stored (see ``hash_code``),
+    so verification is an exact match on the (user, code_hash, expires_at)
+    index. Expired and used rows are removed by the ``purge_login_codes``
+    management command.
     """
 
     user = models.ForeignKey(
@@ -119,7 +199,7 @@ class LoginCode(models.Model):
         on_delete=models.CASCADE,
         related_name="login_codes",
     )
-    code = models.CharField(max_length=8)
+    code_hash = models.CharField(max_length=64)
     created_at = models.DateTimeField(auto_now_add=True)
     expires_at = models.DateTimeField()
     is_used = models.BooleanField(default=False)
@@ -128,10 +208,22 @@ class LoginCode(models.Model):
         ordering = ["-created_at"]
         indexes = [
             models.Index(fields=["user", "created_at"]),
+            models.Index(fields=["user", "code_hash", "expires_at"]),
+            models.Index(fields=["expires_at"]),
         ]
 
     def __str__(self) -> str:
-        return f"LoginCode({self.user}, {self.code})"
+        return f"LoginCode({self.user}, {self.created_at})"
+
+    @staticmethod
+    def hash_code(code: str) -> str:
+        """
+        Case- and whitespace-insensitive HMAC of a login code.
+        """
+
+        return salted_hmac(
+            "chat.LoginCode.code", code.strip().upper(), algorithm="sha256"
+        ).hexdigest()
 
     @property
     def is_expired(self) -> bool:
@@ -148,6 +240,7 @@ class Profile(models.Model):
         on_delete=models.CASCADE,
         related_name="profile",
     )
+    # Canonical upper-case form, allocated by chat.refcodes.
     ref_code = models.CharField(max_length=6, unique=True)
     display_name = models.CharField(max_length=64, blank=True)
     avatar_color = models.CharField(max_length=7, blank=True)
@@ -156,6 +249,12 @@ class Profile(models.Model):
 
     class Meta:
         ordering = ["user_id"]
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(ref_code=Upper("ref_code")),
+                name="chat_profile_ref_code_upper",
+            ),
+        ]
 
     def __str__(self) -> str:
         return f"Profile({self.user}, {self.ref_code})"
@@ -0,0 +1,423 @@
+"""
+Ephemeral presence (last seen) and typing state.
+
+Both are short-lived by nature -- a typing flag matters for 10 seconds and
+"online" means seen in the last minute -- so they live in a TTL store rather
+than in relational tables. The store is pluggable through
+``settings.CHAT_PRESENCE_BACKEND``:
+
+* ``InMemoryPresenceStore`` (default) keeps everything in process memory.
+* ``CachePresenceStore`` goes through Django's cache framework, so several
+  workers can share state by pointing ``CHAT_PRESENCE_CACHE`` at a shared
+  cache (locmem works as a local stand-in).
+
+``Profile.last_seen_at`` is still persisted, but only coarsely: at most once
+per ``CHAT_LAST_SEEN_GRANULARITY`` seconds per user, and those writes are
+buffered by ``LastSeenRecorder`` and flushed in bulk from a background thread
+every ``CHAT_LAST_SEEN_FLUSH_INTERVAL`` seconds.
+
+The store also counts each user's open WebSockets, so a user is only
+announced offline when their last socket closes.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone as dj_timezone
+from django.utils.module_loading import import_string
+
+from .caching import process_singleton
+from .models import Profile
+
+
+TYPING_TTL = timedelta(seconds=10)
+ONLINE_WINDOW = timedelta(seconds=60)
+
+DEFAULT_BACKEND = "chat.presence.InMemoryPresenceStore"
+DEFAULT_GRANULARITY = 60
+DEFAULT_FLUSH_INTERVAL = 5
+
+logger = logging.getLogger(__name__)
+
+
+def _granularity() -> timedelta:
+    return timedelta(
+        seconds=getattr(
+            settings, "CHAT_LAST_SEEN_GRANULARITY", DEFAULT_GRANULARITY
+        )
+    )
+
+
+class BasePresenceStore:
+    """
+    Interface every presence backend implements.
+    """
+
+    def touch(self, user_id: int, now) -> bool:
+        """
+        Record that ``user_id`` was seen at ``now``. Returns True when the
+        caller should persist ``last_seen_at`` to the database.
+        """
+        raise NotImplementedError
+
+    def last_seen(self, user_ids) -> dict:
+        """
+        Map user_id -> last seen datetime for users seen within the online
+        window. Users not in the result fall back to the database value.
+        """
+        raise NotImplementedError
+
+    def set_typing(
+        self, conversation_id: int, user_id: int, is_typing: bool, now
+    ) -> None:
+        raise NotImplementedError
+
+    def typing_ids(self, conversation_id: int, now) -> list[int]:
+        raise NotImplementedError
+
+    def socket_opened(self, user_id: int) -> int:
+        """
+        Count a newly connected WebSocket of ``user_id``; returns how many
+        are open now.
+        """
+        raise NotImplementedError
+
+    def socket_closed(self, user_id: int) -> int:
+        """
+        Count a closed WebSocket of ``user_id``; returns how many are still
+        open.
+        """
+        raise NotImplementedError
+
+    def typing_map(self, conversation_ids, now) -> dict:
+        """
+        Map conversation_id -> typing user ids for several conversations.
+        """
+        return {
+            conversation_id: self.typing_ids(conversation_id, now)
+            for conversation_id in conversation_ids
+        }
+
+
+class InMemoryPresenceStore(BasePresenceStore):
+    """
+    Process-local store with lazy TTL eviction.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seen: dict[int, object] = {}
+        self._flushed: dict[int, object] = {}
+        self._typing: dict[int, dict[int, object]] = {}
+        self._sockets: dict[int, int] = {}
+        self._next_sweep = None
+
+    def _sweep(self, now) -> None:
+        # Called with the lock held; bounded to one pass per typing TTL.
+        if self._next_sweep is not None and now < self._next_sweep:
+            return
+        self._next_sweep = now + TYPING_TTL
+        stale = now - max(ONLINE_WINDOW, _granularity())
+        for user_id in [u for u, seen in self._seen.items() if seen < stale]:
+            del self._seen[user_id]
+            self._flushed.pop(user_id, None)
+        for conversation_id in list(self._typing):
+            typing = self._typing[conversation_id]
+            for user_id in [u for u, exp in typing.items() if exp <= now]:
+                del typing[user_id]
+            if not typing:
+                del self._typing[conversation_id]
+
+    def touch(self, user_id: int, now) -> bool:
+        with self._lock:
+            self._sweep(now)
+            self._seen[user_id] = now
+            flushed = self._flushed.get(user_id)
+            if flushed is not None and now - flushed < _granularity():
+                return False
+            self._flushed[user_id] = now
+            return True
+
+    def last_seen(self, user_ids) -> dict:
+        threshold = dj_timezone.now() - ONLINE_WINDOW
+        with self._lock:
+            return {
+                user_id: self._seen[user_id]
+                for user_id in user_ids
+                if user_id in self._seen and self._seen[user_id] >= threshold
+            }
+
+    def set_typing(
+        self, conversation_id: int, user_id: int, is_typing: bool, now
+    ) -> None:
+        with self._lock:
+            self._sweep(now)
+            if is_typing:
+                self._typing.setdefault(conversation_id, {})[user_id] = (
+                    now + TYPING_TTL
+                )
+            else:
+                self._typing.get(conversation_id, {}).pop(user_id, None)
+
+    def typing_ids(self, conversation_id: int, now) -> list[int]:
+        with self._lock:
+            typing = self._typing.get(conversation_id, {})
+            return [u for u, expires in typing.items() if expires > now]
+
+    def socket_opened(self, user_id: int) -> int:
+        with self._lock:
+            self._sockets[user_id] = self._sockets.get(user_id, 0) + 1
+            return self._sockets[user_id]
+
+    def socket_closed(self, user_id: int) -> int:
+        with self._lock:
+            remaining = self._sockets.get(user_id, 0) - 1
+            if remaining > 0:
+                self._sockets[user_id] = remaining
+            else:
+                self._sockets.pop(user_id, None)
+            return max(remaining, 0)
+
+
+class CachePresenceStore(BasePresenceStore):
+    """
+    Store backed by a Django cache alias (``settings.CHAT_PRESENCE_CACHE``),
+    so presence can be shared between worker processes.
+    """
+
+    def __init__(self):
+        self.cache = caches[getattr(settings, "CHAT_PRESENCE_CACHE", "default")]
+
+    def touch(self, user_id: int, now) -> bool:
+        self.cache.set(
+            f"chat:seen:{user_id}", now, timeout=ONLINE_WINDOW.total_seconds()
+        )
+        # add() only succeeds when the key is absent, i.e. once per
+        # granularity window.
+        return self.cache.add(
+            f"chat:seen-flush:{user_id}",
+            1,
+            timeout=_granularity().total_seconds(),
+        )
+
+    def last_seen(self, user_ids) -> dict:
+        keys = {f"chat:seen:{user_id}": user_id for user_id in user_ids}
+        found = self.cache.get_many(list(keys))
+        return {keys[key]: seen for key, seen in found.items()}
+
+    def set_typing(
+        self, conversation_id: int, user_id: int, is_typing: bool, now
+    ) -> None:
+        key = f"chat:typing:{conversation_id}"
+        typing = self.cache.get(key) or {}
+        typing = {u: expires for u, expires in typing.items() if expires > now}
+        if is_typing:
+            typing[user_id] = now + TYPING_TTL
+        else:
+            typing.pop(user_id, None)
+        self.cache.set(key, typing, timeout=TYPING_TTL.total_seconds())
+
+    def typing_ids(self, conversation_id: int, now) -> list[int]:
+        typing = self.cache.get(f"chat:typing:{conversation_id}") or {}
+        return [u for u, expires in typing.items() if expires > now]
+
+    def socket_opened(self, user_id: int) -> int:
+        key = f"chat:sockets:{user_id}"
+        self.cache.add(key, 0, timeout=None)
+        return self.cache.incr(key)
+
+    def socket_closed(self, user_id: int) -> int:
+        key = f"chat:sockets:{user_id}"
+        try:
+            remaining = self.cache.decr(key)
+        except ValueError:
+            return 0
+        if remaining <= 0:
+            self.cache.delete(key)
+        return max(remaining, 0)
+
+    def typing_map(self, conversation_ids, now) -> dict:
+        keys = {
+            f"chat:typing:{conversation_id}": conversation_id
+            for conversation_id in conversation_ids
+        }
+        found = self.cache.get_many(list(keys))
+        return {
+            conversation_id: [
+                u
+                for u, expires in (found.get(key) or {}).items()
+                if expires > now
+            ]
+            for key, conversation_id in keys.items()
+        }
+
+
+@process_singleton
+def get_presence_store() -> BasePresenceStore:
+    return import_string(
+        getattr(settings, "CHAT_PRESENCE_BACKEND", DEFAULT_BACKEND)
+    )()
+
+
+class LastSeenRecorder:
+    """
+    Buffers ``Profile.last_seen_at`` writes and flushes them as one UPDATE
+    with a CASE expression per batch.
+
+    With a positive ``interval`` a daemon thread flushes every ``interval``
+    seconds; with ``interval=0`` every record is flushed inline, which keeps
+    tests deterministic.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._pending: dict[int, object] = {}
+        self._thread = None
+        self._touches = 0
+        self._statements = 0
+        self._rows = 0
+
+    def touch(self, user_id: int, seen_at, due: bool) -> None:
+        """
+        Count one presence touch; buffer it when the store says a write is
+        ``due`` for this user.
+        """
+
+        with self._lock:
+            self._touches += 1
+            if not due:
+                return
+            previous = self._pending.get(user_id)
+            if previous is None or previous < seen_at:
+                self._pending[user_id] = seen_at
+        if self.interval <= 0:
+            self.flush()
+        else:
+            self._ensure_thread()
+
+    def flush(self) -> int:
+        """
+        Write all buffered timestamps; returns the number of rows updated.
+        """
+
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        updated = Profile.objects.filter(user_id__in=list(pending)).update(
+            last_seen_at=Case(
+                *[
+                    When(user_id=user_id, then=Value(seen_at))
+                    for user_id, seen_at in pending.items()
+                ],
+                output_field=DateTimeField(),
+            )
+        )
+        with self._lock:
+            self._statements += 1
+            self._rows += updated
+        logger.debug("Flushed last_seen_at for %d users", updated)
+        return updated
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "touches": self._touches,
+                "pending": len(self._pending),
+                "statements": self._statements,
+                "rows_written": self._rows,
+                "writes_saved": self._touches - self._statements,
+            }
+
+    def _ensure_thread(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="last-seen-recorder", daemon=True
+            )
+            self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to flush last_seen_at updates")
+
+
+@process_singleton
+def get_last_seen_recorder() -> LastSeenRecorder:
+    return LastSeenRecorder(
+        getattr(
+            settings, "CHAT_LAST_SEEN_FLUSH_INTERVAL", DEFAULT_FLUSH_INTERVAL
+        )
+    )
+
+
+def touch_last_seen(user) -> None:
+    """
+    Mark ``user`` as seen now. The database write, when one is due for this
+    user, is buffered and flushed in bulk by the LastSeenRecorder.
+    """
+
+    if not getattr(user, "is_authenticated", False):
+        return
+    now = dj_timezone.now()
+    due = get_presence_store().touch(user.id, now)
+    get_last_seen_recorder().touch(user.id, now, due)
+
+
+def last_seen_map(profiles_by_user_id: dict) -> dict:
+    """
+    Merge fresh in-store timestamps over the persisted
+    ``Profile.last_seen_at`` values for the given users.
+    """
+
+    seen = {
+        user_id: getattr(profile, "last_seen_at", None)
+        for user_id, profile in profiles_by_user_id.items()
+    }
+    seen.update(get_presence_store().last_seen(list(seen)))
+    return seen
+
+
+def is_online(last_seen_at, now) -> bool:
+    return bool(last_seen_at and last_seen_at >= now - ONLINE_WINDOW)
+
+
+def socket_opened(user_id: int) -> int:
+    return get_presence_store().socket_opened(user_id)
+
+
+def socket_closed(user_id: int) -> int:
+    return get_presence_store().socket_closed(user_id)
+
+
+def set_typing(conversation_id: int, user_id: int, is_typing: bool) -> None:
+    get_presence_store().set_typing(
+        conversation_id, user_id, is_typing, dj_timezone.now()
+    )
+
+
+def typing_ids(conversation_id: int) -> list[int]:
+    return get_presence_store().typing_ids(conversation_id, dj_timezone.now())
+
+
+def typing_map(conversation_ids) -> dict:
+    return get_presence_store().typing_map(
+        conversation_ids, dj_timezone.now()
+    )
@@ -0,0 +1,298 @@
+"""
+Declarative rate limiting for API views.
+
+    @api_view(["POST"])
+    @rate_limit("email", "5/m", detail="Too many login code requests.")
+    def request_login_code(request): ...
+
+Limits are counted per key -- ``"user"``, ``"ip"``, ``"email"`` or any
+callable taking the request -- with either a token bucket (default, allows
+short bursts up to the limit) or a sliding window. State is kept by a
+pluggable backend (``settings.CHAT_RATELIMIT_BACKEND``):
+
+* ``CacheBackend`` (default) stores state in a Django cache alias
+  (``settings.CHAT_RATELIMIT_CACHE``) so workers share limits.
+* ``InMemoryBackend`` counts per process.
+
+A limit only holds across N workers when its state is shared; otherwise
+each worker allows the full rate and "5/m" becomes 5*N per minute. The
+``chat.W002`` deployment check (``manage.py check --deploy``) warns when
+limits are counted per process, including a CacheBackend on a per-process
+cache such as locmem.
+
+Responses carry ``X-RateLimit-Limit``, ``X-RateLimit-Remaining`` and
+``X-RateLimit-Reset``; rejected requests get a 429 with ``Retry-After``.
+"""
+
+import functools
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+from rest_framework import status
+from rest_framework.response import Response
+
+from .caching import process_singleton
+from .versions import PER_PROCESS_CACHES
+
+
+DEFAULT_BACKEND = "chat.ratelimit.CacheBackend"
+
+_PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_rate(rate: str) -> tuple[int, int]:
+    """
+    "60/m" -> (60, 60). The period may carry a multiplier: "10/5m".
+    """
+
+    count, _, period = rate.partition("/")
+    multiplier = int(period[:-1] or 1)
+    return int(count), multiplier * _PERIODS[period[-1]]
+
+
+class Decision:
+    def __init__(self, allowed: bool, limit: int, remaining: int, reset: float):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        # Seconds until the request would be allowed (when rejected) or
+        # until the quota is fully restored (when allowed).
+        self.reset = reset
+
+
+class TokenBucket:
+    """
+    ``limit`` tokens refilled continuously over ``period`` seconds.
+    State: (tokens, updated_at).
+    """
+
+    def apply(
+        self, state, limit: int, period: int, now: float, cost: int = 1
+    ):
+        rate = limit / period
+        tokens, updated_at = state or (float(limit), now)
+        tokens = min(float(limit), tokens + (now - updated_at) * rate)
+        if tokens >= cost:
+            tokens -= cost
+            decision = Decision(
+                True, limit, int(tokens), (limit - tokens) / rate
+            )
+        else:
+            decision = Decision(
+                False, limit, int(tokens), (cost - tokens) / rate
+            )
+        return (tokens, now), decision
+
+
+class SlidingWindow:
+    """
+    Sliding-window counter approximated from the current and previous fixed
+    windows. State: (window_start, previous_count, current_count).
+    """
+
+    def apply(
+        self, state, limit: int, period: int, now: float, cost: int = 1
+    ):
+        start = now - (now % period)
+        window_start, previous, current = state or (start, 0, 0)
+        if window_start != start:
+            previous = current if start - window_start == period else 0
+            current = 0
+        weight = 1 - (now - start) / period
+        used = previous * weight + current
+        if used + cost <= limit:
+            current += cost
+            decision = Decision(
+                True, limit, int(limit - used - cost), start + period - now
+            )
+        else:
+            decision = Decision(
+                False, limit, max(0, int(limit - used)), start + period - now
+            )
+        return (start, previous, current), decision
+
+
+ALGORITHMS = {"token_bucket": TokenBucket(), "sliding_window": SlidingWindow()}
+
+
+class BaseBackend:
+    """
+    Stores limiter state. ``update`` must apply ``fn(state) -> (state,
+    result)`` for ``key`` and return ``result``.
+    """
+
+    def update(self, key: str, fn, ttl: int):
+        raise NotImplementedError
+
+
+class InMemoryBackend(BaseBackend):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state: dict[str, tuple] = {}
+        self._expires: dict[str, float] = {}
+        self._next_sweep = 0.0
+
+    def update(self, key: str, fn, ttl: int):
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_sweep:
+                self._next_sweep = now + 60
+                for stale in [k for k, e in self._expires.items() if e <= now]:
+                    del self._expires[stale]
+                    self._state.pop(stale, None)
+            state, result = fn(self._state.get(key))
+            self._state[key] = state
+            self._expires[key] = now + ttl
+            return result
+
+
+class CacheBackend(BaseBackend):
+    """
+    Read-modify-write through the Django cache. Concurrent requests may
+    race on the same key; that only makes the limit slightly soft.
+    """
+
+    def __init__(self):
+        self.cache = caches[
+            getattr(settings, "CHAT_RATELIMIT_CACHE", "default")
+        ]
+
+    def update(self, key: str, fn, ttl: int):
+        state, result = fn(self.cache.get(key))
+        self.cache.set(key, state, timeout=ttl)
+        return result
+
+
+@process_singleton
+def get_backend() -> BaseBackend:
+    return import_string(
+        getattr(settings, "CHAT_RATELIMIT_BACKEND", DEFAULT_BACKEND)
+    )()
+
+
+@checks.register(checks.Tags.caches, deploy=True)
+def check_ratelimit_backend(app_configs, **kwargs):
+    backend = import_string(
+        getattr(settings, "CHAT_RATELIMIT_BACKEND", DEFAULT_BACKEND)
+    )
+    if issubclass(backend, CacheBackend):
+        alias = getattr(settings, "CHAT_RATELIMIT_CACHE", "default")
+        if not isinstance(caches[alias], PER_PROCESS_CACHES):
+            return []
+    elif not issubclass(backend, InMemoryBackend):
+        return []
+    return [
+        checks.Warning(
+            "Rate limits are counted per process.",
+            hint="Every worker allows the full rate, so N workers allow N "
+            "times each limit. Use chat.ratelimit.CacheBackend with "
+            "CHAT_RATELIMIT_CACHE pointing at a shared cache.",
+            id="chat.W002",
+        )
+    ]
+
+
+def _client_ip(request) -> str:
+    return request.META.get("REMOTE_ADDR") or "unknown"
+
+
+def _email(request) -> str | None:
+    return (request.data.get("email") or "").strip().lower() or None
+
+
+def _user(request) -> str | None:
+    user = getattr(request, "user", None)
+    if user is None or not user.is_authenticated:
+        return None
+    return str(user.pk)
+
+
+KEY_FUNCTIONS = {"user": _user, "ip": _client_ip, "email": _email}
+
+
+def check(
+    scope: str,
+    key: str,
+    rate: str,
+    algorithm: str = "token_bucket",
+    cost: int = 1,
+) -> Decision:
+    """
+    Charge ``cost`` requests for ``key`` within ``scope`` and return the
+    decision. A rejected request is not charged at all.
+    """
+
+    limit, period = parse_rate(rate)
+    apply = ALGORITHMS[algorithm].apply
+    now = time.time()
+    return get_backend().update(
+        f"chat:ratelimit:{scope}:{key}",
+        lambda state: apply(state, limit, period, now, cost),
+        ttl=period,
+    )
+
+
+def _set_headers(response, decision: Decision) -> None:
+    response["X-RateLimit-Limit"] = str(decision.limit)
+    response["X-RateLimit-Remaining"] = str(decision.remaining)
+    response["X-RateLimit-Reset"] = str(math.ceil(decision.reset))
+
+
+def rate_limit(
+    key,
+    rate: str,
+    methods=("POST",),
+    algorithm: str = "token_bucket",
+    scope: str | None = None,
+    detail: str = "Request was throttled. Please try again later.",
+    cost=1,
+):
+    """
+    Limit a DRF function view to ``rate`` requests per ``key``. Place it
+    below ``@api_view`` so the request is already authenticated. Requests
+    whose key cannot be determined (e.g. no email given) are not counted.
+
+    Views passing the same ``scope`` (and rate) share one limit. ``cost`` is
+    what one request is charged: an int, or a callable taking the request
+    for requests that do several units of work at once. A cost of 0 leaves
+    the request uncounted, e.g. one the view is going to reject anyway.
+    """
+
+    key_func = KEY_FUNCTIONS[key] if isinstance(key, str) else key
+
+    def decorator(view):
+        key_name = key if isinstance(key, str) else key.__name__
+        limit_scope = scope or f"{view.__name__}:{key_name}"
+
+        @functools.wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if request.method not in methods:
+                return view(request, *args, **kwargs)
+            key_value = key_func(request)
+            if key_value is None:
+                return view(request, *args, **kwargs)
+            request_cost = cost(request) if callable(cost) else cost
+            if request_cost <= 0:
+                return view(request, *args, **kwargs)
+            decision = check(
+                limit_scope, key_value, rate, algorithm, request_cost
+            )
+            if not decision.allowed:
+                response = Response(
+                    {"detail": detail},
+                    status=status.HTTP_429_TOO_MANY_REQUESTS,
+                )
+                response["Retry-After"] = str(math.ceil(decision.reset))
+            else:
+                response = view(request, *args, **kwargs)
+            _set_headers(response, decision)
+            return response
+
+        return wrapped
+
+    return decorator
@@ -0,0 +1,216 @@
+"""
+In-process pub/sub used to fan real-time chat events out to connected
+WebSocket clients.
+
+Events are plain JSON-serialisable dicts published on string channels
+(``conversation:<id>`` and ``user:<id>``). The broker implementation is
+pluggable through ``settings.CHAT_REALTIME_BACKEND``; the default
+``InMemoryBroker`` only reaches clients connected to the same process, which
+is enough for a single ASGI worker and for tests.
+"""
+
+import asyncio
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from .caching import process_singleton
+
+
+DEFAULT_BACKEND = "chat.realtime.InMemoryBroker"
+
+
+def conversation_channel(conversation_id: int) -> str:
+    return f"conversation:{conversation_id}"
+
+
+def user_channel(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+class Subscription:
+    """
+    A bounded event queue owned by one consumer (usually one WebSocket).
+
+    It must be created from inside the consumer's event loop; ``put`` may be
+    called from any thread, e.g. from a sync view running in a worker thread.
+    """
+
+    def __init__(self, broker, maxsize: int = 256):
+        self.broker = broker
+        self.channels: set[str] = set()
+        self._loop = asyncio.get_running_loop()
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+
+    def put(self, event: dict) -> None:
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._put_nowait(event)
+        elif not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._put_nowait, event)
+
+    def _put_nowait(self, event: dict) -> None:
+        # Slow consumers lose events rather than growing memory unbounded;
+        # clients resync over HTTP (?after=...) when they reconnect.
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+    async def get(self) -> dict:
+        return await self._queue.get()
+
+    def add(self, channel: str) -> None:
+        self.broker.add_channel(self, channel)
+
+    def remove(self, channel: str) -> None:
+        self.broker.remove_channel(self, channel)
+
+    def close(self) -> None:
+        self.broker.unsubscribe(self)
+
+
+class BaseBroker:
+    """
+    Interface every realtime backend implements.
+    """
+
+    def subscribe(self, channels) -> Subscription:
+        subscription = Subscription(self)
+        for channel in channels:
+            self.add_channel(subscription, channel)
+        return subscription
+
+    def add_channel(self, subscription: Subscription, channel: str) -> None:
+        raise NotImplementedError
+
+    def remove_channel(self, subscription: Subscription, channel: str) -> None:
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        for channel in list(subscription.channels):
+            self.remove_channel(subscription, channel)
+
+    def publish(self, channel: str, event: dict) -> None:
+        raise NotImplementedError
+
+
+class InMemoryBroker(BaseBroker):
+    """
+    Thread-safe, single-process broker.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: dict[str, set[Subscription]] = defaultdict(set)
+
+    def add_channel(self, subscription: Subscription, channel: str) -> None:
+        with self._lock:
+            self._subscribers[channel].add(subscription)
+            subscription.channels.add(channel)
+
+    def remove_channel(self, subscription: Subscription, channel: str) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[channel]
+            subscription.channels.discard(channel)
+
+    def publish(self, channel: str, event: dict) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.put(event)
+
+
+@process_singleton
+def get_broker() -> BaseBroker:
+    return import_string(
+        getattr(settings, "CHAT_REALTIME_BACKEND", DEFAULT_BACKEND)
+    )()
+
+
+
+def publish(channel: str, event: dict) -> None:
+    """
+    Publish ``event`` once the current transaction (if any) has committed, so
+    subscribers never hear about rows they cannot read yet.
+    """
+
+    transaction.on_commit(lambda: get_broker().publish(channel, event))
+
+
+def publish_message(message_payload: dict) -> None:
+    publish(
+        conversation_channel(message_payload["conversation"]),
+        {"type": "message.new", "message": message_payload},
+    )
+
+
+def publish_typing(conversation_id: int, user_id: int, is_typing: bool) -> None:
+    publish(
+        conversation_channel(conversation_id),
+        {
+            "type": "typing",
+            "conversation": conversation_id,
+            "user_id": user_id,
+            "is_typing": is_typing,
+        },
+    )
+
+
+def publish_read(conversation_id: int, user_id: int, last_read_at) -> None:
+    publish(
+        conversation_channel(conversation_id),
+        {
+            "type": "read",
+            "conversation": conversation_id,
+            "user_id": user_id,
+            "last_read_at": last_read_at.isoformat(),
+        },
+    )
+
+
+def publish_presence(
+    user_id: int, conversation_ids, is_online: bool, last_seen_at=None
+) -> None:
+    for conversation_id in conversation_ids:
+        publish(
+            conversation_channel(conversation_id),
+            {
+                "type": "presence",
+                "conversation": conversation_id,
+                "user_id": user_id,
+                "is_online": is_online,
+                "last_seen_at": (
+                    last_seen_at.isoformat() if last_seen_at else None
+                ),
+            },
+        )
+
+
+def publish_membership_removed(conversation_id: int, user_id: int) -> None:
+    """
+    Tell the user's sockets to drop the conversation's channel.
+    """
+
+    publish(
+        user_channel(user_id),
+        {"type": "membership.removed", "conversation": conversation_id},
+    )
+
+
+def publish_conversation_created(conversation_payload: dict, user_ids) -> None:
+    for user_id in user_ids:
+        publish(
+            user_channel(user_id),
+            {"type": "conversation.new", "conversation": conversation_payload},
+        )
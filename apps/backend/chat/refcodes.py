@@ -0,0 +1,118 @@
+"""
+Allocation of the short, shareable ``Profile.ref_code``.
+
+A code is a bijective encoding of the user's id: the id goes through a
+keyed permutation of [0, 36**6) and is written as six base-36 digits.
+Distinct ids therefore always get distinct codes, so a profile gets its
+code in the same single INSERT that creates it -- no "is this code free?"
+round trips and no race between concurrent sign-ups.
+
+The permutation is a Feistel network over 32-bit values whose round
+function is an HMAC keyed with ``settings.CHAT_REF_CODE_KEY`` (falling back
+to ``SECRET_KEY``); values outside [0, 36**6) are cycle-walked back into
+range. Without the key, knowing some users' codes tells nothing about
+anyone else's, so codes cannot be enumerated from ids. Changing the key
+only affects codes allocated afterwards: issued codes are stored and keep
+working, and a new code that clashes with one falls through to the next
+band (below).
+
+Profiles created before this scheme carry random codes that may clash with
+an encoded id. On such a (rare) unique violation the id is encoded again in
+the next of ``BANDS`` disjoint input bands, which no primary code can reach
+while user ids stay below ``SPACE // BANDS``.
+
+Codes are stored in canonical form (upper case, see ``canonical``), so
+lookups are exact matches on the unique index.
+"""
+
+import string
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils.crypto import salted_hmac
+
+from .models import Profile
+
+
+ALPHABET = string.digits + string.ascii_uppercase
+LENGTH = 6
+SPACE = len(ALPHABET) ** LENGTH
+BANDS = 4
+
+_HALF_BITS = 16
+_HALF_MASK = (1 << _HALF_BITS) - 1
+_ROUNDS = 8
+
+
+def canonical(code: str) -> str:
+    return (code or "").strip().upper()
+
+
+def _permute(value: int, key: str) -> int:
+    """
+    Keyed Feistel permutation of 32-bit integers.
+    """
+
+    left, right = value >> _HALF_BITS, value & _HALF_MASK
+    for round_index in range(_ROUNDS):
+        digest = salted_hmac(
+            "chat.refcodes", f"{round_index}:{right}", secret=key
+        ).digest()
+        left, right = right, left ^ (
+            int.from_bytes(digest[:2], "big") & _HALF_MASK
+        )
+    return (left << _HALF_BITS) | right
+
+
+def encode(value: int) -> str:
+    """
+    Map an integer in [0, SPACE) to its six-character code.
+    """
+
+    key = getattr(settings, "CHAT_REF_CODE_KEY", None) or settings.SECRET_KEY
+    # Cycle-walk: SPACE is just over 2**31, so this takes about two steps
+    # on average and always ends inside [0, SPACE).
+    n = _permute(value, key)
+    while n >= SPACE:
+        n = _permute(n, key)
+    digits = []
+    for _ in range(LENGTH):
+        n, digit = divmod(n, len(ALPHABET))
+        digits.append(ALPHABET[digit])
+    return "".join(reversed(digits))
+
+
+def _candidates(user_id: int):
+    stride = SPACE // BANDS
+    if user_id >= stride:
+        raise ValueError(f"user id {user_id} is outside the ref_code space")
+    for band in range(BANDS):
+        yield encode(user_id + band * stride)
+
+
+def get_or_create_profile(user) -> Profile:
+    """
+    Return the user's profile, creating it -- or filling in a missing
+    ref_code -- with the user's encoded code.
+    """
+
+    profile = Profile.objects.filter(user=user).first()
+    if profile is not None and profile.ref_code:
+        return profile
+
+    for code in _candidates(user.id):
+        try:
+            with transaction.atomic():
+                if profile is None:
+                    return Profile.objects.create(user=user, ref_code=code)
+                Profile.objects.filter(pk=profile.pk).update(ref_code=code)
+                profile.ref_code = code
+                return profile
+        except IntegrityError:
+            # Either a concurrent request created this user's profile, or
+            # the code belongs to a legacy profile; try the next band.
+            existing = Profile.objects.filter(user=user).first()
+            if existing is not None and existing.ref_code:
+                return existing
+            profile = existing
+    raise IntegrityError(f"No free ref_code for user {user.id}")
@@ -0,0 +1,198 @@
+"""
+Read replica routing.
+
+``DATABASE_REPLICA_URLS`` (see config/settings.py) adds ``replica_<n>``
+database aliases, listed in ``settings.CHAT_REPLICA_DATABASES``. Writes,
+migrations and almost every read stay on ``default``; ``ReplicaRouter`` sends
+reads to a replica only when the request has opted in with
+``use_replica(request)``. The read-heavy endpoints (``list_conversations``,
+``conversation_messages`` GET and ``conversation_typing`` GET) opt in, and
+the replica is used only while:
+
+* the user has not written anything in the last
+  ``CHAT_REPLICA_PIN_SECONDS``: a POST/PATCH/... that wrote pins its user to
+  the primary, so a user who just posted reads their own message back
+  (read-your-writes). Pins live in the ``CHAT_REPLICA_PIN_CACHE`` cache
+  alias; use a shared cache when running several workers;
+* nothing has been written in this request yet and no transaction is open.
+
+Replica data may lag, so responses built from a replica are neither stored
+in the version-keyed response cache nor given an ETag (see
+``replica_used``).
+
+``ReplicaRoutingMiddleware`` keeps the per-request state. To try this locally
+with two SQLite files:
+
+    DATABASE_URL=sqlite:///primary.sqlite3 \\
+    DATABASE_REPLICA_URLS=sqlite:///replica.sqlite3 \\
+        python manage.py migrate && python manage.py sync_replicas
+"""
+
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+DEFAULT_PIN_SECONDS = 10
+UNSAFE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+
+class _RequestState:
+    __slots__ = ("replica_ok", "wrote", "alias")
+
+    def __init__(self):
+        self.replica_ok = False
+        self.wrote = False
+        # Replica picked for this request, once one has been read from.
+        self.alias = None
+
+
+_state: ContextVar[_RequestState | None] = ContextVar(
+    "chat_replica_state", default=None
+)
+
+
+def replica_aliases() -> list[str]:
+    return list(getattr(settings, "CHAT_REPLICA_DATABASES", []))
+
+
+def _pin_cache():
+    return caches[getattr(settings, "CHAT_REPLICA_PIN_CACHE", "default")]
+
+
+def _pin_key(user_id: int) -> str:
+    return f"chat:db:pinned:{user_id}"
+
+
+def pin_to_primary(user) -> None:
+    _pin_cache().set(
+        _pin_key(user.id),
+        True,
+        timeout=getattr(
+            settings, "CHAT_REPLICA_PIN_SECONDS", DEFAULT_PIN_SECONDS
+        ),
+    )
+
+
+def is_pinned(user) -> bool:
+    return bool(_pin_cache().get(_pin_key(user.id)))
+
+
+def use_replica(request) -> None:
+    """
+    Let the rest of this request read from a replica, unless replicas are
+    not configured, the request is not a read, or its user is pinned to the
+    primary.
+    """
+
+    state = _state.get()
+    user = getattr(request, "user", None)
+    if (
+        state is None
+        or request.method not in ("GET", "HEAD")
+        or not replica_aliases()
+        or user is None
+        or not user.is_authenticated
+        or is_pinned(user)
+    ):
+        return
+    state.replica_ok = True
+
+
+def replica_used() -> bool:
+    """
+    True once this request has read from a replica.
+    """
+
+    state = _state.get()
+    return state is not None and state.alias is not None
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if (
+            state is None
+            or not state.replica_ok
+            or state.wrote
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        if state.alias is None:
+            aliases = replica_aliases()
+            if not aliases:
+                return DEFAULT_DB_ALIAS
+            # One replica per request, so its reads are mutually consistent.
+            state.alias = random.choice(aliases)
+        return state.alias
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *replica_aliases()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in replica_aliases():
+            # Replicas get their schema from the primary.
+            return False
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Holds the routing state of each request and pins users whose unsafe
+    request wrote to the database.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = _RequestState()
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        self._finish(request, state)
+        return response
+
+    async def __acall__(self, request):
+        state = _RequestState()
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        self._finish(request, state)
+        return response
+
+    def _finish(self, request, state) -> None:
+        if (
+            not state.wrote
+            # GETs write read markers; that alone does not pin.
+            or request.method not in UNSAFE_METHODS
+            or not replica_aliases()
+        ):
+            return
+        user = getattr(request, "user", None)
+        if user is not None and user.is_authenticated:
+            pin_to_primary(user)
@@ -0,0 +1,291 @@
+"""
+Full-text search over message content.
+
+``search_messages(user, text, ...)`` returns the messages matching ``text``
+in the caller's conversations, best match first, each with a highlighted
+snippet. The inverted index is maintained by the database itself, so every
+write path (``create``, ``bulk_create``, raw SQL) keeps it current:
+
+* SQLite: the external-content FTS5 table ``chat_message_fts``, kept in sync
+  with ``chat_message`` by triggers; ranked by bm25.
+* Postgres: a GIN index on ``to_tsvector('simple', content)``; ranked by
+  ``ts_rank``, snippets from ``ts_headline``.
+
+Both are created by migration 0016, and migration 0019 indexes
+``chat_archivedmessage`` the same way, so archived history stays
+searchable; hits from both tiers are ranked together (on SQLite each
+tier's bm25 uses its own term statistics). Other databases fall back to an
+unranked ``icontains`` scan.
+
+Snippets are HTML-escaped with matches wrapped in ``<mark>...</mark>``.
+"""
+
+import html
+import re
+from importlib import import_module
+
+from django.db import connections, router
+from django.db.models.signals import post_migrate
+from django.dispatch import receiver
+
+from .models import ArchivedMessage, Message
+from .serializers import message_rows
+
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 50
+SNIPPET_WORDS = 16
+# Must match the expression index created by the migration.
+TS_CONFIG = "simple"
+
+# Private-use characters delimit matches inside the database; they become
+# <mark> tags once the snippet has been HTML-escaped.
+_START = "\ue000"
+_STOP = "\ue001"
+_TOKEN_RE = re.compile(r"\w+")
+
+# FTS5 table -> the migration that created it and owns its trigger SQL.
+SQLITE_INDEXES = {
+    "chat_message_fts": "0016_message_search_index",
+    "chat_archivedmessage_fts": "0019_archived_message_search_index",
+}
+
+# One SELECT per storage tier (hot ``chat_message`` and
+# ``chat_archivedmessage``, see chat/archive.py); ids are unique across
+# both, and the search merges the tiers before paginating.
+_SQLITE_TIER = """
+    SELECT m.id, snippet({fts}, 0, %s, %s, '…', %s) AS snippet,
+        bm25({fts}) AS score
+    FROM {fts}
+    JOIN {table} m ON m.id = {fts}.rowid
+    JOIN chat_conversationmember cm
+        ON cm.conversation_id = m.conversation_id AND cm.user_id = %s
+    WHERE {fts} MATCH %s {conversation_filter}
+"""
+
+_SQLITE_SEARCH = """
+    SELECT id, snippet FROM ({hot} UNION ALL {archived})
+    ORDER BY score, id DESC
+    LIMIT %s OFFSET %s
+"""
+
+_POSTGRES_TIER = f"""
+    SELECT m.id, m.content,
+        ts_rank(to_tsvector('{TS_CONFIG}', m.content), query) AS score
+    FROM {{table}} m
+    JOIN chat_conversationmember cm
+        ON cm.conversation_id = m.conversation_id AND cm.user_id = %s
+    CROSS JOIN to_tsquery('{TS_CONFIG}', %s) AS query
+    WHERE to_tsvector('{TS_CONFIG}', m.content) @@ query {{conversation_filter}}
+"""
+
+# Headlines are built for the requested page only.
+_POSTGRES_SEARCH = f"""
+    SELECT page.id,
+        ts_headline('{TS_CONFIG}', page.content, to_tsquery('{TS_CONFIG}', %s), %s)
+    FROM (
+        SELECT * FROM ({{hot}} UNION ALL {{archived}}) hits
+        ORDER BY score DESC, id DESC
+        LIMIT %s OFFSET %s
+    ) page
+    ORDER BY page.score DESC, page.id DESC
+"""
+
+
+def _tiers(template: str, conversation_id: int | None) -> dict:
+    conversation_filter = (
+        "" if conversation_id is None else "AND m.conversation_id = %s"
+    )
+    return {
+        name: template.format(
+            table=model._meta.db_table,
+            fts=f"{model._meta.db_table}_fts",
+            conversation_filter=conversation_filter,
+        )
+        for name, model in (("hot", Message), ("archived", ArchivedMessage))
+    }
+
+
+def _fts5_query(text: str) -> str | None:
+    """
+    Turn user input into an FTS5 query: every word must match, the last
+    one as a prefix (search-as-you-type). Quoting each word keeps FTS5
+    operators in the input literal.
+    """
+
+    words = _TOKEN_RE.findall(text)
+    if not words:
+        return None
+    return " ".join(f'"{word}"' for word in words) + "*"
+
+
+def _tsquery(text: str) -> str | None:
+    """
+    The Postgres counterpart of ``_fts5_query``: every word must match, the
+    last one as a prefix. Words are quoted lexemes, so tsquery operators in
+    the input stay literal.
+    """
+
+    words = _TOKEN_RE.findall(text)
+    if not words:
+        return None
+    return " & ".join(f"'{word}'" for word in words) + ":*"
+
+
+def _sqlite_hits(cursor, user_id, text, conversation_id, limit, offset):
+    query = _fts5_query(text)
+    if query is None:
+        return []
+    params = [_START, _STOP, SNIPPET_WORDS, user_id, query]
+    if conversation_id is not None:
+        params.append(conversation_id)
+    cursor.execute(
+        _SQLITE_SEARCH.format(**_tiers(_SQLITE_TIER, conversation_id)),
+        [*params, *params, limit, offset],
+    )
+    return cursor.fetchall()
+
+
+def _postgres_hits(cursor, user_id, text, conversation_id, limit, offset):
+    query = _tsquery(text)
+    if query is None:
+        return []
+    options = (
+        f'StartSel="{_START}", StopSel="{_STOP}", '
+        f"MaxWords={SNIPPET_WORDS}, MinWords={SNIPPET_WORDS // 2}"
+    )
+    params = [user_id, query]
+    if conversation_id is not None:
+        params.append(conversation_id)
+    cursor.execute(
+        _POSTGRES_SEARCH.format(**_tiers(_POSTGRES_TIER, conversation_id)),
+        [query, options, *params, *params, limit, offset],
+    )
+    return cursor.fetchall()
+
+
+def _plain_snippet(content: str, text: str) -> str:
+    words = content.split()
+    terms = [term.lower() for term in _TOKEN_RE.findall(text)]
+    first = next(
+        (
+            i
+            for i, word in enumerate(words)
+            if any(term in word.lower() for term in terms)
+        ),
+        0,
+    )
+    start = max(0, first - SNIPPET_WORDS // 2)
+    window = words[start : start + SNIPPET_WORDS]
+    marked = [
+        f"{_START}{word}{_STOP}"
+        if any(term in word.lower() for term in terms)
+        else word
+        for word in window
+    ]
+    prefix = "…" if start else ""
+    suffix = "…" if start + SNIPPET_WORDS < len(words) else ""
+    return prefix + " ".join(marked) + suffix
+
+
+def _fallback_hits(user, text, conversation_id, limit, offset):
+    hits = []
+    for model in (Message, ArchivedMessage):
+        messages = model.objects.filter(
+            conversation__memberships__user=user, content__icontains=text
+        )
+        if conversation_id is not None:
+            messages = messages.filter(conversation_id=conversation_id)
+        hits += messages.order_by("-id").values_list("id", "content")[
+            : offset + limit
+        ]
+    hits.sort(reverse=True)
+    return [
+        (message_id, _plain_snippet(content, text))
+        for message_id, content in hits[offset : offset + limit]
+    ]
+
+
+def _highlight(snippet: str) -> str:
+    return (
+        html.escape(snippet)
+        .replace(_START, "<mark>")
+        .replace(_STOP, "</mark>")
+    )
+
+
+def search_messages(
+    user,
+    text: str,
+    conversation_id: int | None = None,
+    limit: int = DEFAULT_LIMIT,
+    offset: int = 0,
+) -> tuple[list[tuple], bool]:
+    """
+    Rank the caller's messages against ``text``. Returns ([(row, snippet)],
+    has_more) where rows come from ``message_rows``.
+    """
+
+    text = text.strip()
+    if not text:
+        return [], False
+    connection = connections[router.db_for_read(Message)]
+    # One extra hit tells us whether there is another page.
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            hits = _sqlite_hits(
+                cursor, user.id, text, conversation_id, limit + 1, offset
+            )
+        elif connection.vendor == "postgresql":
+            hits = _postgres_hits(
+                cursor, user.id, text, conversation_id, limit + 1, offset
+            )
+        else:
+            hits = _fallback_hits(
+                user, text, conversation_id, limit + 1, offset
+            )
+    has_more = len(hits) > limit
+    hits = hits[:limit]
+    if not hits:
+        return [], False
+
+    message_ids = [message_id for message_id, _ in hits]
+    rows = {
+        row.id: row
+        for row in message_rows(Message.objects.filter(id__in=message_ids))
+    }
+    archived_ids = [
+        message_id for message_id in message_ids if message_id not in rows
+    ]
+    if archived_ids:
+        rows.update(
+            (row.id, row)
+            for row in message_rows(
+                ArchivedMessage.objects.filter(id__in=archived_ids)
+            )
+        )
+    return [
+        (rows[message_id], _highlight(snippet))
+        for message_id, snippet in hits
+        if message_id in rows
+    ], has_more
+
+
+@receiver(post_migrate)
+def _restore_sqlite_triggers(sender, using, **kwargs):
+    if sender.label != "chat":
+        return
+    connection = connections[using]
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for table, migration_name in SQLITE_INDEXES.items():
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = %s", [table]
+            )
+            if cursor.fetchone() is None:
+                # Migrated backwards past this index.
+                continue
+            migration = import_module(f"chat.migrations.{migration_name}")
+            for statement in migration.SQLITE_TRIGGERS:
+                cursor.execute(statement)
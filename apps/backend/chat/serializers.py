@@ -18,9 +18,21 @@ class UserSummarySerializer(serializers.ModelSerializer):
 
 
 class ConversationSerializer(serializers.ModelSerializer):
+    last_message_id = serializers.IntegerField(read_only=True, allow_null=True)
+
     class Meta:
         model = Conversation
-        fields = ("id", "title", "is_group", "created_at", "updated_at")
+        fields = (
+            "id",
+            "title",
+            "is_group",
+            "created_at",
+            "updated_at",
+            "last_message_id",
+            "last_message_preview",
+            "last_message_at",
+            "message_count",
+        )
 
 
 class MessageSerializer(serializers.ModelSerializer):
@@ -60,6 +72,71 @@ class MessageSerializer(serializers.ModelSerializer):
         return bool(mapping.get(obj.id))
 
 
+# Fast path for message lists.
+#
+# MessageSerializer walks sender -> profile per message and pays the DRF
+# field machinery for every row. The helpers below fetch plain rows, build
+# each sender's summary once per page and emit dicts with exactly the same
+# keys, order and value formatting, so the rendered JSON is byte-identical.
+
+MESSAGE_ROW_FIELDS = ("id", "conversation_id", "sender_id", "content", "created_at")
+
+_created_at_field = serializers.DateTimeField()
+
+
+def message_rows(queryset) -> list:
+    """
+    Evaluate a Message queryset as lightweight named rows (``row.id``,
+    ``row.created_at`` ...), skipping model instantiation.
+    """
+
+    return list(queryset.values_list(*MESSAGE_ROW_FIELDS, named=True))
+
+
+def sender_summaries(sender_ids) -> dict:
+    """
+    UserSummarySerializer output for each sender id, from one query.
+    """
+
+    rows = get_user_model().objects.filter(id__in=set(sender_ids)).values_list(
+        "id", "username", "profile__display_name", "profile__avatar_color"
+    )
+    # Like UserSummarySerializer, a sender without a profile gets nulls.
+    return {
+        user_id: {
+            "id": user_id,
+            "username": username,
+            "display_name": display_name,
+            "avatar_color": avatar_color,
+        }
+        for user_id, username, display_name, avatar_color in rows
+    }
+
+
+def serialize_message_rows(rows, user, read_by_all_map=None) -> list[dict]:
+    """
+    Equivalent of ``MessageSerializer(messages, many=True).data`` for rows
+    from ``message_rows``.
+    """
+
+    read_by_all_map = read_by_all_map or {}
+    viewer_id = user.id if getattr(user, "is_authenticated", False) else None
+    senders = sender_summaries(row.sender_id for row in rows)
+    to_datetime = _created_at_field.to_representation
+    return [
+        {
+            "id": row.id,
+            "conversation": row.conversation_id,
+            "sender": senders[row.sender_id],
+            "content": row.content,
+            "created_at": to_datetime(row.created_at),
+            "is_mine": row.sender_id == viewer_id,
+            "read_by_all": bool(read_by_all_map.get(row.id)),
+        }
+        for row in rows
+    ]
+
+
 class ProfileSerializer(serializers.ModelSerializer):
     class Meta:
         model = Profile
@@ -1,3 +1,1912 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import io
+import json
+from datetime import timedelta
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core import mail
+from django.core.cache import caches
+from django.core.mail import EmailMessage
+from django.core.mail.backends.locmem import EmailBackend as LocMemBackend
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connection, transaction
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone as dj_timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed, PermissionDenied
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from . import (
+    authentication,
+    caching,
+    mailqueue,
+    membership,
+    messaging,
+    presence,
+    ratelimit,
+    realtime,
+    refcodes,
+    routers,
+    search,
+    versions,
+    views,
+    websocket,
+)
+from .models import (
+    ArchivedMessage,
+    Conversation,
+    ConversationMember,
+    LoginCode,
+    Message,
+    Profile,
+)
+from .serializers import MessageSerializer, message_rows, serialize_message_rows
+
+
+TEST_SETTINGS = {
+    "CHAT_EMAIL_QUEUE_WORKERS": 0,
+    "CHAT_LAST_SEEN_FLUSH_INTERVAL": 0,
+}
+
+
+class ChatTestMixin:
+    """
+    Shared setup and request helpers. The per-process caches and singletons
+    are rebuilt for every test (ids are reused after each rollback), and
+    requests run their on_commit hooks -- version bumps, realtime events,
+    queued mail -- as a committed request would (see ``committing``).
+    """
+
+    def setUp(self):
+        super().setUp()
+        caches["default"].clear()
+        caching.reset_singletons()
+
+    def committing(self):
+        raise NotImplementedError
+
+    def make_user(self, name: str):
+        user = get_user_model().objects.create(
+            username=name, email=f"{name}@example.com"
+        )
+        refcodes.get_or_create_profile(user)
+        client = APIClient()
+        client.credentials(
+            HTTP_AUTHORIZATION=f"Token {Token.objects.create(user=user).key}"
+        )
+        return user, client
+
+    def get(self, client, path, data=None, **extra):
+        with self.committing():
+            return client.get(path, data, **extra)
+
+    def post(self, client, path, data=None, **extra):
+        with self.committing():
+            return client.post(path, data, format="json", **extra)
+
+    def start_conversation(self, client, other) -> int:
+        response = self.post(
+            client,
+            "/api/conversations/start/",
+            {"ref_code": other.profile.ref_code},
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.json()["id"]
+
+    def send(self, client, conversation_id: int, content: str, **data):
+        return self.post(
+            client,
+            f"/api/conversations/{conversation_id}/messages/",
+            {"content": content, **data},
+        )
+
+
+@override_settings(**TEST_SETTINGS)
+class ChatTestCase(ChatTestMixin, TestCase):
+    """
+    Base class for API tests.
+    """
+
+    def committing(self):
+        return self.captureOnCommitCallbacks(execute=True)
+
+
+@override_settings(**TEST_SETTINGS)
+class ChatTransactionTestCase(ChatTestMixin, TransactionTestCase):
+    """
+    Base class for tests whose code commits from other threads or an event
+    loop (WebSockets, long-polls); hooks run as each statement commits.
+    """
+
+    def committing(self):
+        return contextlib.nullcontext()
+
+
+class ReadReceiptTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice, self.alice_client = self.make_user("alice")
+        self.bob, self.bob_client = self.make_user("bob")
+        self.conversation_id = self.start_conversation(
+            self.alice_client, self.bob
+        )
+        self.url = f"/api/conversations/{self.conversation_id}/messages/"
+
+    def test_first_read_sees_read_by_all(self):
+        message = self.send(self.alice_client, self.conversation_id, "hi")
+        self.get(self.alice_client, self.url)
+
+        # Bob's first read moves the watermark; his own response must
+        # already reflect it.
+        data = self.get(self.bob_client, self.url).json()
+
+        self.assertTrue(data["results"][0]["read_by_all"])
+        self.assertEqual(data["read_up_to"], message.json()["id"])
+
+    def test_unread_message_is_not_read_by_all(self):
+        self.send(self.alice_client, self.conversation_id, "hi")
+
+        data = self.get(self.alice_client, self.url).json()
+
+        self.assertFalse(data["results"][0]["read_by_all"])
+        self.assertIsNone(data["read_up_to"])
+
+
+class IncrementalSyncTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice, self.alice_client = self.make_user("alice")
+        self.bob, self.bob_client = self.make_user("bob")
+        self.conversation_id = self.start_conversation(
+            self.alice_client, self.bob
+        )
+        self.url = f"/api/conversations/{self.conversation_id}/messages/"
+
+    def test_after_returns_only_newer_messages(self):
+        ids = [
+            self.send(self.alice_client, self.conversation_id, f"m{i}").json()["id"]
+            for i in range(4)
+        ]
+
+        data = self.get(self.bob_client, self.url, {"after": ids[0], "limit": 2}).json()
+
+        self.assertEqual([m["id"] for m in data["results"]], ids[1:3])
+        self.assertTrue(data["has_more"])
+        self.assertEqual(data["next_after"], ids[2])
+
+        data = self.get(
+            self.bob_client, self.url, {"after": data["next_after"]}
+        ).json()
+        self.assertEqual([m["id"] for m in data["results"]], ids[3:])
+        self.assertFalse(data["has_more"])
+
+    def test_idle_poll_is_not_modified(self):
+        message = self.send(self.alice_client, self.conversation_id, "hi").json()
+        data = self.get(self.bob_client, self.url, {"after": 0}).json()
+
+        response = self.get(
+            self.bob_client,
+            self.url,
+            {"after": data["next_after"], "read_up_to": data["read_up_to"] or ""},
+        )
+
+        self.assertEqual(data["next_after"], message["id"])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+    def test_read_receipt_change_is_delivered(self):
+        message = self.send(self.alice_client, self.conversation_id, "hi").json()
+        self.get(self.alice_client, self.url)
+        poll = {"after": message["id"], "read_up_to": ""}
+
+        self.assertEqual(self.get(self.alice_client, self.url, poll).status_code, 304)
+
+        self.get(self.bob_client, self.url)
+        response = self.get(self.alice_client, self.url, poll)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"], [])
+        self.assertEqual(response.json()["read_up_to"], message["id"])
+
+
+@override_settings(CHAT_LAST_SEEN_GRANULARITY=60)
+class PresenceStoreTests(ChatTestCase):
+    backends = (presence.InMemoryPresenceStore, presence.CachePresenceStore)
+
+    def test_typing_expires_after_the_ttl(self):
+        now = dj_timezone.now()
+        for backend in self.backends:
+            with self.subTest(backend=backend.__name__):
+                store = backend()
+                store.set_typing(1, 10, True, now)
+                store.set_typing(1, 11, True, now)
+                store.set_typing(1, 11, False, now)
+
+                self.assertEqual(store.typing_ids(1, now), [10])
+                self.assertEqual(store.typing_map([1, 2], now), {1: [10], 2: []})
+                self.assertEqual(
+                    store.typing_ids(1, now + presence.TYPING_TTL), []
+                )
+
+    def test_write_is_due_once_per_granularity(self):
+        now = dj_timezone.now()
+        for backend in self.backends:
+            with self.subTest(backend=backend.__name__):
+                store = backend()
+
+                self.assertTrue(store.touch(10, now))
+                self.assertFalse(store.touch(10, now + timedelta(seconds=1)))
+                self.assertTrue(store.touch(11, now))
+                self.assertEqual(
+                    store.last_seen([10, 11, 12]),
+                    {10: now + timedelta(seconds=1), 11: now},
+                )
+
+        store = presence.InMemoryPresenceStore()
+        store.touch(10, now)
+        self.assertTrue(store.touch(10, now + timedelta(seconds=60)))
+
+    def test_typing_and_presence_do_not_touch_the_database(self):
+        alice, alice_client = self.make_user("alice")
+        bob, bob_client = self.make_user("bob")
+        conversation_id = self.start_conversation(alice_client, bob)
+        url = f"/api/conversations/{conversation_id}/typing/"
+        self.post(alice_client, url, {"is_typing": True})
+
+        with CaptureQueriesContext(connection) as queries:
+            self.post(alice_client, url, {"is_typing": True})
+        data = self.get(bob_client, url).json()
+
+        self.assertFalse(
+            [q for q in queries if not q["sql"].startswith("SELECT")]
+        )
+        self.assertEqual(data["typing_ids"], [alice.id])
+        self.assertEqual(
+            {p["id"]: p["is_online"] for p in data["participants"]},
+            {alice.id: True, bob.id: True},
+        )
+
+
+class LastSeenRecorderTests(ChatTestCase):
+    def test_touches_within_the_granularity_are_coalesced(self):
+        user, _ = self.make_user("alice")
+
+        with self.assertNumQueries(1):
+            for _ in range(3):
+                presence.touch_last_seen(user)
+
+        user.profile.refresh_from_db()
+        self.assertIsNotNone(user.profile.last_seen_at)
+        self.assertEqual(
+            presence.get_last_seen_recorder().metrics(),
+            {
+                "touches": 3,
+                "pending": 0,
+                "statements": 1,
+                "rows_written": 1,
+                "writes_saved": 2,
+            },
+        )
+
+    def test_pending_users_are_flushed_in_one_statement(self):
+        users = [self.make_user(name)[0] for name in ("alice", "bob")]
+        recorder = presence.LastSeenRecorder(interval=3600)
+        now = dj_timezone.now()
+        for offset, user in enumerate(users):
+            recorder.touch(user.id, now + timedelta(seconds=offset), due=True)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(recorder.flush(), 2)
+
+        self.assertEqual(
+            [
+                Profile.objects.get(user=user).last_seen_at
+                for user in users
+            ],
+            [now, now + timedelta(seconds=1)],
+        )
+        self.assertEqual(recorder.flush(), 0)
+
+    def test_metrics_are_staff_only(self):
+        _, client = self.make_user("alice")
+        staff, staff_client = self.make_user("root")
+        staff.is_staff = True
+        staff.save()
+
+        self.assertEqual(self.get(client, "/api/ops/metrics/").status_code, 403)
+        data = self.get(staff_client, "/api/ops/metrics/").json()
+        self.assertEqual(set(data), {"last_seen_writes", "login_emails"})
+        self.assertIn("writes_saved", data["last_seen_writes"])
+
+
+class InboxSummaryTests(ChatTestCase):
+    url = "/api/conversations/"
+
+    def setUp(self):
+        super().setUp()
+        self.alice, self.alice_client = self.make_user("alice")
+        self.bob, self.bob_client = self.make_user("bob")
+        self.conversation_id = self.start_conversation(
+            self.alice_client, self.bob
+        )
+
+    def inbox(self, client) -> dict:
+        return {
+            item["id"]: item
+            for item in self.get(client, self.url).json()["results"]
+        }
+
+    def test_summary_follows_the_newest_message(self):
+        self.send(self.alice_client, self.conversation_id, "first")
+        last = self.send(
+            self.alice_client, self.conversation_id, "  second\n message "
+        ).json()
+
+        item = self.inbox(self.bob_client)[self.conversation_id]
+
+        self.assertEqual(item["last_message_id"], last["id"])
+        self.assertEqual(item["last_message_preview"], "second message")
+        self.assertEqual(item["message_count"], 2)
+        self.assertEqual(item["title"], "alice")
+
+    def test_long_preview_is_truncated(self):
+        self.send(self.alice_client, self.conversation_id, "x" * 300)
+
+        preview = self.inbox(self.bob_client)[self.conversation_id][
+            "last_message_preview"
+        ]
+
+        self.assertEqual(len(preview), messaging.MESSAGE_PREVIEW_LENGTH)
+        self.assertTrue(preview.endswith("…"))
+
+    def test_unread_counts_are_per_member(self):
+        for content in ("one", "two"):
+            self.send(self.alice_client, self.conversation_id, content)
+        self.post(
+            self.bob_client,
+            f"/api/conversations/{self.conversation_id}/messages/bulk/",
+            {"messages": [{"content": "three"}]},
+        )
+
+        self.assertEqual(
+            self.inbox(self.alice_client)[self.conversation_id]["unread_count"], 1
+        )
+        self.assertEqual(
+            self.inbox(self.bob_client)[self.conversation_id]["unread_count"], 2
+        )
+
+        self.get(
+            self.bob_client, f"/api/conversations/{self.conversation_id}/messages/"
+        )
+        self.assertEqual(
+            self.inbox(self.bob_client)[self.conversation_id]["unread_count"], 0
+        )
+
+    def test_query_count_does_not_grow_with_the_inbox(self):
+        def inbox_queries():
+            self.get(self.alice_client, self.url)
+            with CaptureQueriesContext(connection) as queries:
+                self.get(self.alice_client, self.url)
+            return len(queries)
+
+        before = inbox_queries()
+        for name in ("carol", "dave", "erin"):
+            other, _ = self.make_user(name)
+            conversation_id = self.start_conversation(self.alice_client, other)
+            self.send(self.alice_client, conversation_id, "hi")
+
+        self.assertEqual(inbox_queries(), before)
+
+
+class InboxPagingTests(ChatTestCase):
+    url = "/api/conversations/"
+
+    def setUp(self):
+        super().setUp()
+        self.alice, self.alice_client = self.make_user("alice")
+        self.conversation_ids = []
+        for i in range(5):
+            other, _ = self.make_user(f"user{i}")
+            conversation_id = self.start_conversation(self.alice_client, other)
+            self.send(self.alice_client, conversation_id, "hi")
+            self.conversation_ids.append(conversation_id)
+
+    def walk(self, **params) -> list[int]:
+        seen = []
+        data = self.get(self.alice_client, self.url, params).json()
+        seen += [item["id"] for item in data["results"]]
+        while data["next_cursor"]:
+            data = self.get(
+                self.alice_client,
+                self.url,
+                {**params, "cursor": data["next_cursor"]},
+            ).json()
+            seen += [item["id"] for item in data["results"]]
+        return seen
+
+    def test_cursor_walks_newest_first(self):
+        self.send(self.alice_client, self.conversation_ids[1], "bump")
+
+        seen = self.walk(limit=2)
+
+        expected = self.conversation_ids[::-1]
+        expected.remove(self.conversation_ids[1])
+        self.assertEqual(seen, [self.conversation_ids[1], *expected])
+
+    def test_ties_are_broken_by_id(self):
+        ConversationMember.objects.filter(user=self.alice).update(
+            conversation_updated_at=dj_timezone.now()
+        )
+
+        self.assertEqual(self.walk(limit=2), self.conversation_ids[::-1])
+
+    def test_pages_run_no_count_query(self):
+        first = self.get(self.alice_client, self.url, {"limit": 2}).json()
+
+        with CaptureQueriesContext(connection) as queries:
+            self.get(
+                self.alice_client,
+                self.url,
+                {"limit": 2, "cursor": first["next_cursor"]},
+            )
+
+        self.assertFalse(
+            [q for q in queries if "COUNT(" in q["sql"].upper()]
+        )
+
+    def test_legacy_offset_is_still_accepted(self):
+        data = self.get(
+            self.alice_client, self.url, {"limit": 2, "offset": 4}
+        ).json()
+
+        self.assertEqual(
+            [item["id"] for item in data["results"]], self.conversation_ids[:1]
+        )
+        self.assertFalse(data["has_more"])
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.get(self.alice_client, self.url, {"cursor": "bogus"})
+
+        self.assertEqual(response.status_code, 400)
+
+
+class HistoryPagingTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice, self.alice_client = self.make_user("alice")
+        self.bob, self.bob_client = self.make_user("bob")
+        self.conversation_id = self.start_conversation(
+            self.alice_client, self.bob
+        )
+        self.url = f"/api/conversations/{self.conversation_id}/messages/"
+        self.ids = [
+            self.send(self.alice_client, self.conversation_id, f"m{i}").json()["id"]
+            for i in range(7)
+        ]
+
+    def page(self, **params) -> dict:
+        return self.get(self.bob_client, self.url, params).json()
+
+    def test_before_walks_all_history_with_equal_timestamps(self):
+        Message.objects.update(created_at=dj_timezone.now())
+
+        seen = []
+        data = self.page(limit=3)
+        while True:
+            seen = [m["id"] for m in data["results"]] + seen
+            if not data["has_more"]:
+                break
+            data = self.page(limit=3, before=data["next_before"])
+
+        self.assertEqual(seen, self.ids)
+
+    def test_before_needs_no_anchor_row(self):
+        Message.objects.filter(id=self.ids[4]).delete()
+
+        data = self.page(limit=2, before=self.ids[4])
+
+        self.assertEqual([m["id"] for m in data["results"]], self.ids[2:4])
+        self.assertTrue(data["has_more"])
+        self.assertEqual(data["next_before"], self.ids[2])
+
+    def test_around_centres_on_the_target(self):
+        data = self.page(limit=4, around=self.ids[3])
+
+        self.assertEqual([m["id"] for m in data["results"]], self.ids[1:5])
+        self.assertTrue(data["has_more"])
+        self.assertTrue(data["has_newer"])
+
+    def test_around_the_newest_message(self):
+        data = self.page(limit=4, around=self.ids[-1])
+
+        self.assertEqual([m["id"] for m in data["results"]], self.ids[4:])
+        self.assertTrue(data["has_more"])
+        self.assertFalse(data["has_newer"])
+
+
+class MessageRowSerializationTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice, self.alice_client = self.make_user("alice")
+        Profile.objects.filter(user=self.alice).update(
+            display_name="Alice <A>", avatar_color="#ff0066"
+        )
+        self.bob, self.bob_client = self.make_user("bob")
+        # A sender without a profile.
+        self.ghost = get_user_model().objects.create(username="ghost")
+        self.conversation_id = self.start_conversation(
+            self.alice_client, self.bob
+        )
+        ConversationMember.objects.create(
+            conversation_id=self.conversation_id, user=self.ghost
+        )
+        for sender, content in (
+            (self.alice, "hi"),
+            (self.bob, "héllo \"quoted\" <b>html</b> 😀"),
+            (self.ghost, ""),
+            (self.alice, "line\nbreak"),
+        ):
+            Message.objects.create(
+                conversation_id=self.conversation_id,
+                sender=sender,
+                content=content,
+            )
+        self.messages = list(
+            Message.objects.select_related("sender__profile").order_by("id")
+        )
+        self.read_by_all_map = {self.messages[0].id: True, self.messages[1].id: False}
+
+    def assertSameJSON(self, viewer):
+        request = RequestFactory().get("/")
+        request.user = viewer
+        slow = MessageSerializer(
+            self.messages,
+            many=True,
+            context={"request": request, "read_by_all_map": self.read_by_all_map},
+        ).data
+        fast = serialize_message_rows(
+            message_rows(Message.objects.order_by("id")),
+            viewer,
+            self.read_by_all_map,
+        )
+
+        renderer = JSONRenderer()
+        self.assertEqual(renderer.render(fast), renderer.render(slow))
+
+    def test_output_is_byte_identical(self):
+        self.assertSameJSON(self.bob)
+
+    def test_output_is_byte_identical_for_anonymous_viewers(self):
+        self.assertSameJSON(AnonymousUser())
+
+    def test_page_costs_two_queries(self):
+        with self.assertNumQueries(2):
+            serialize_message_rows(
+                message_rows(Message.objects.order_by("id")), self.bob
+            )
+
+
+class ConversationsStatusTests(ChatTestCase):
+    url = "/api/conversations/status/"
+
+    def setUp(self):
+        super().setUp()
+        self.alice, self.alice_client = self.make_user("alice")
+        self.conversations = {}
+        for name in ("bob", "carol", "dave"):
+            other, client = self.make_user(name)
+            self.conversations[name] = (
+                self.start_conversation(self.alice_client, other),
+                other,
+                client,
+            )
+
+    def status(self, ids) -> dict:
+        response = self.get(
+            self.alice_client,
+            self.url,
+            {"conversations": ",".join(str(i) for i in ids)},
+        )
+        self.assertEqual(response.status_code, 200)
+        return {item["id"]: item for item in response.json()["results"]}
+
+    def test_reports_typing_and_presence_per_conversation(self):
+        bob_conversation, bob, bob_client = self.conversations["bob"]
+        carol_conversation, carol, _ = self.conversations["carol"]
+        self.post(
+            bob_client,
+            f"/api/conversations/{bob_conversation}/typing/",
+            {"is_typing": True},
+        )
+
+        results = self.status([bob_conversation, carol_conversation])
+
+        self.assertEqual(results[bob_conversation]["typing_ids"], [bob.id])
+        self.assertEqual(results[carol_conversation]["typing_ids"], [])
+        online = {
+            p["id"]: p["is_online"]
+            for p in results[carol_conversation]["participants"]
+        }
+        # Starting the conversations marked alice as seen.
+        self.assertEqual(online, {self.alice.id: True, carol.id: False})
+        self.assertTrue(
+            next(
+                p["is_online"]
+                for p in results[bob_conversation]["participants"]
+                if p["id"] == bob.id
+            )
+        )
+
+    def test_other_conversations_are_left_out(self):
+        _, bob, bob_client = self.conversations["bob"]
+        _, carol, _ = self.conversations["carol"]
+        private = self.start_conversation(bob_client, carol)
+        ids = [conversation for conversation, _, _ in self.conversations.values()]
+
+        results = self.status([*ids, private, 999999])
+
+        self.assertEqual(sorted(results), sorted(ids))
+        self.assertFalse(
+            ConversationMember.objects.filter(
+                conversation_id=private, user=self.alice
+            ).exists()
+        )
+
+    def test_query_count_does_not_grow_with_conversations(self):
+        ids = [conversation for conversation, _, _ in self.conversations.values()]
+        self.status(ids[:1])
+
+        with CaptureQueriesContext(connection) as one:
+            self.status(ids[:1])
+        with CaptureQueriesContext(connection) as three:
+            self.status(ids)
+
+        self.assertEqual(len(one), len(three))
+
+    def test_is_read_only(self):
+        ids = [conversation for conversation, _, _ in self.conversations.values()]
+        touches = presence.get_last_seen_recorder().metrics()["touches"]
+
+        self.status(ids)
+
+        self.assertEqual(
+            presence.get_last_seen_recorder().metrics()["touches"], touches
+        )
+
+    def test_rejects_bad_and_oversized_requests(self):
+        for value in (
+            "1,two",
+            ",".join(str(i) for i in range(views.STATUS_MAX_CONVERSATIONS + 1)),
+        ):
+            response = self.get(
+                self.alice_client, self.url, {"conversations": value}
+            )
+            self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CHAT_VERSIONED_RESPONSES=True)
+class MembershipTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice, self.alice_client = self.make_user("alice")
+        self.bob, self.bob_client = self.make_user("bob")
+        self.carol, self.carol_client = self.make_user("carol")
+        self.conversation_id = self.start_conversation(
+            self.alice_client, self.bob
+        )
+        self.url = f"/api/conversations/{self.conversation_id}/messages/"
+
+    def test_non_member_is_rejected(self):
+        self.send(self.alice_client, self.conversation_id, "hi")
+
+        self.assertEqual(self.get(self.carol_client, self.url).status_code, 403)
+        self.assertEqual(
+            self.send(self.carol_client, self.conversation_id, "hi").status_code,
+            403,
+        )
+        self.assertEqual(
+            self.get(
+                self.carol_client,
+                f"/api/conversations/{self.conversation_id}/typing/",
+            ).status_code,
+            403,
+        )
+        # Nobody is auto-joined.
+        self.assertFalse(
+            ConversationMember.objects.filter(user=self.carol).exists()
+        )
+
+    def test_unknown_conversation_is_not_found(self):
+        response = self.get(self.alice_client, "/api/conversations/999/messages/")
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_removed_member_gets_no_cached_page(self):
+        self.send(self.alice_client, self.conversation_id, "secret")
+        self.get(self.bob_client, self.url)
+        cached = self.get(self.bob_client, self.url)
+        inbox = self.get(self.bob_client, "/api/conversations/")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ConversationMember.objects.filter(
+                conversation_id=self.conversation_id, user=self.bob
+            ).delete()
+
+        self.assertEqual(self.get(self.bob_client, self.url).status_code, 403)
+        self.assertEqual(
+            self.get(
+                self.bob_client, self.url, HTTP_IF_NONE_MATCH=cached["ETag"]
+            ).status_code,
+            403,
+        )
+        response = self.get(
+            self.bob_client,
+            "/api/conversations/",
+            HTTP_IF_NONE_MATCH=inbox["ETag"],
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"], [])
+
+
+class CachingTests(SimpleTestCase):
+    def test_lru_evicts_least_recently_used(self):
+        cache = caching.LRUCache(2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        self.assertEqual([cache.get(key) for key in "abc"], [1, None, 3])
+
+    def test_entries_expire_after_ttl(self):
+        cache = caching.LRUCache(2, ttl=0)
+        cache.set("a", 1)
+
+        self.assertIsNone(cache.get("a"))
+
+    def test_invalidate_where(self):
+        cache = caching.LRUCache(4)
+        for key, value in (("a", 1), ("b", 2), ("c", 1)):
+            cache.set(key, value)
+
+        cache.invalidate_where(lambda key, value: value == 1)
+
+        self.assertEqual([cache.get(key) for key in "abc"], [None, 2, None])
+
+    def test_singleton_is_rebuilt_after_reset(self):
+        built = []
+
+        @caching.process_singleton
+        def get_thing():
+            built.append(object())
+            return built[-1]
+
+        first = get_thing()
+        self.assertIs(get_thing(), first)
+        caching.reset_singletons()
+        self.assertIsNot(get_thing(), first)
+        self.assertEqual(len(built), 2)
+
+
+class MembershipCacheTests(ChatTestCase):
+    def test_member_is_authorized_from_the_cache(self):
+        alice, alice_client = self.make_user("alice")
+        bob, _ = self.make_user("bob")
+        conversation_id = self.start_conversation(alice_client, bob)
+        membership.require_member(alice, conversation_id)
+
+        with self.assertNumQueries(0):
+            membership.require_member(alice, conversation_id)
+
+    def test_removed_member_is_rejected_at_once(self):
+        alice, alice_client = self.make_user("alice")
+        bob, _ = self.make_user("bob")
+        conversation_id = self.start_conversation(alice_client, bob)
+        membership.require_member(bob, conversation_id)
+
+        ConversationMember.objects.filter(user=bob).delete()
+
+        with self.assertRaises(PermissionDenied):
+            membership.require_member(bob, conversation_id)
+
+
+class TokenCacheTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user, _ = self.make_user("alice")
+        self.key = self.user.auth_token.key
+        self.auth = authentication.CachingTokenAuthentication()
+
+    def authenticate(self):
+        return self.auth.authenticate_credentials(self.key)[0]
+
+    def test_repeated_lookup_is_served_from_the_cache(self):
+        self.authenticate()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.authenticate(), self.user)
+
+    def test_deleted_token_is_rejected(self):
+        self.authenticate()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.auth_token.delete()
+
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_deactivated_user_is_rejected(self):
+        self.authenticate()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_version_bump_from_another_worker_invalidates(self):
+        self.authenticate()
+        # Another worker deletes the token: its signals never run here, but
+        # its version bump lands in the shared cache.
+        Token.objects.filter(key=self.key)._raw_delete(DEFAULT_DB_ALIAS)
+        with self.assertNumQueries(0):
+            self.authenticate()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            versions.bump_auth(self.user.id)
+
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_ttl_is_capped_without_a_shared_version_cache(self):
+        self.assertFalse(versions.shared())
+        self.assertEqual(
+            authentication.get_token_cache().ttl,
+            authentication.UNSHARED_CACHE_TTL,
+        )
+
+
+class DirectConversationTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice, self.alice_client = self.make_user("alice")
+        self.bob, self.bob_client = self.make_user("bob")
+
+    def test_either_side_reuses_the_same_conversation(self):
+        first = self.start_conversation(self.alice_client, self.bob)
+        second = self.start_conversation(self.bob_client, self.alice)
+        again = self.start_conversation(self.alice_client, self.bob)
+
+        self.assertEqual({first, second, again}, {first})
+        conversation = Conversation.objects.get()
+        low, high = sorted((self.alice.id, self.bob.id))
+        self.assertEqual(
+            (conversation.direct_user_min_id, conversation.direct_user_max_id),
+            (low, high),
+        )
+        self.assertEqual(conversation.memberships.count(), 2)
+
+    def test_pair_is_unique_but_groups_are_not_keyed(self):
+        low, high = sorted((self.alice.id, self.bob.id))
+        Conversation.objects.create(
+            direct_user_min_id=low, direct_user_max_id=high
+        )
+        Conversation.objects.create(is_group=True)
+        Conversation.objects.create(is_group=True)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Conversation.objects.create(
+                direct_user_min_id=low, direct_user_max_id=high
+            )
+
+    def test_lookup_cost_does_not_grow_with_conversations(self):
+        def reuse_queries():
+            with CaptureQueriesContext(connection) as queries:
+                self.start_conversation(self.alice_client, self.bob)
+            return len(queries)
+
+        self.start_conversation(self.alice_client, self.bob)
+        before = reuse_queries()
+        for name in ("carol", "dave", "erin"):
+            other, _ = self.make_user(name)
+            self.start_conversation(self.alice_client, other)
+
+        self.assertEqual(reuse_queries(), before)
+
+    def test_cannot_start_a_conversation_with_yourself(self):
+        response = self.post(
+            self.alice_client,
+            "/api/conversations/start/",
+            {"ref_code": self.alice.profile.ref_code},
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Conversation.objects.exists())
+
+
+class LoginCodeTests(ChatTestCase):
+    def request_code(self, email="dora@example.com") -> str:
+        mail.outbox.clear()
+        response = self.post(
+            APIClient(), "/api/auth/request-code/", {"email": email}
+        )
+        self.assertEqual(response.status_code, 200)
+        return mail.outbox[0].body.split("Your login code is: ", 1)[1][:4]
+
+    def verify(self, code, email="dora@example.com"):
+        return self.post(
+            APIClient(), "/api/auth/verify-code/", {"email": email, "code": code}
+        )
+
+    def test_only_a_hash_is_stored(self):
+        code = self.request_code()
+
+        stored = LoginCode.objects.get()
+
+        self.assertEqual(len(stored.code_hash), 64)
+        self.assertEqual(stored.code_hash, LoginCode.hash_code(f" {code.lower()} "))
+
+    def test_code_is_case_insensitive_and_single_use(self):
+        code = self.request_code()
+
+        response = self.verify(f" {code.lower()} ")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("token", response.json())
+
+        self.assertEqual(self.verify(code).status_code, 400)
+
+    def test_expired_code_is_rejected(self):
+        code = self.request_code()
+        LoginCode.objects.update(expires_at=dj_timezone.now())
+
+        self.assertEqual(self.verify(code).status_code, 400)
+
+    def test_purge_removes_expired_and_used_codes(self):
+        for email in ("a@example.com", "b@example.com", "c@example.com"):
+            self.request_code(email)
+        expired, used, live = LoginCode.objects.order_by("id")
+        LoginCode.objects.filter(id=expired.id).update(
+            expires_at=dj_timezone.now() - timedelta(minutes=1)
+        )
+        LoginCode.objects.filter(id=used.id).update(is_used=True)
+
+        out = io.StringIO()
+        call_command("purge_login_codes", batch_size=1, stdout=out)
+
+        self.assertEqual(out.getvalue().strip(), "Purged 2 login codes.")
+        self.assertEqual(list(LoginCode.objects.all()), [live])
+
+
+class FlakyEmailBackend(LocMemBackend):
+    """
+    locmem backend whose first send fails, to exercise the queue's retries.
+    """
+
+    failures = 1
+
+    def send_messages(self, messages):
+        if FlakyEmailBackend.failures:
+            FlakyEmailBackend.failures -= 1
+            raise OSError("connection reset")
+        return super().send_messages(messages)
+
+
+class EmailQueueTests(ChatTestCase):
+    def test_login_code_is_sent_inline_without_workers(self):
+        response = self.post(
+            APIClient(), "/api/auth/request-code/", {"email": "dora@example.com"}
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["dora@example.com"])
+
+    def test_rolled_back_request_sends_nothing(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            mailqueue.enqueue(EmailMessage("code", "1234", to=["x@example.com"]))
+
+        self.assertEqual(mail.outbox, [])
+
+    def test_workers_deliver_before_flush_returns(self):
+        queue = mailqueue.EmailQueue(workers=2, batch_size=3)
+        for index in range(7):
+            queue.enqueue(
+                EmailMessage("code", str(index), to=[f"u{index}@example.com"])
+            )
+
+        self.assertTrue(queue.flush(timeout=5))
+        self.assertEqual(
+            sorted(message.body for message in mail.outbox),
+            [str(index) for index in range(7)],
+        )
+        self.assertEqual(queue.metrics()["sent"], 7)
+
+    @override_settings(EMAIL_BACKEND="chat.tests.FlakyEmailBackend")
+    def test_failed_send_is_retried(self):
+        FlakyEmailBackend.failures = 1
+        queue = mailqueue.EmailQueue(workers=1, retry_delay=0)
+        with self.assertLogs("chat.mailqueue", "ERROR"):
+            queue.enqueue(EmailMessage("code", "1234", to=["x@example.com"]))
+            self.assertTrue(queue.flush(timeout=5))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(
+            queue.metrics(),
+            {"pending": 0, "sent": 1, "retried": 1, "failed": 0},
+        )
+
+
+class RefCodeTests(ChatTestCase):
+    def make_bare_user(self, name: str):
+        return get_user_model().objects.create(
+            username=name, email=f"{name}@example.com"
+        )
+
+    def test_codes_are_canonical_and_distinct(self):
+        users = [self.make_bare_user(f"user{i}") for i in range(20)]
+
+        codes = [refcodes.get_or_create_profile(u).ref_code for u in users]
+
+        self.assertEqual(len(set(codes)), len(codes))
+        for code in codes:
+            self.assertEqual(len(code), refcodes.LENGTH)
+            self.assertEqual(code, refcodes.canonical(code))
+
+    def test_profile_is_created_in_one_write(self):
+        user = self.make_bare_user("alice")
+
+        # One lookup and one INSERT, inside its savepoint.
+        with self.assertNumQueries(4):
+            profile = refcodes.get_or_create_profile(user)
+
+        self.assertEqual(profile.ref_code, refcodes.encode(user.id))
+
+    def test_clash_with_legacy_code_falls_through_to_next_band(self):
+        user = self.make_bare_user("alice")
+        legacy = self.make_bare_user("legacy")
+        Profile.objects.create(user=legacy, ref_code=refcodes.encode(user.id))
+
+        profile = refcodes.get_or_create_profile(user)
+
+        stride = refcodes.SPACE // refcodes.BANDS
+        self.assertEqual(profile.ref_code, refcodes.encode(user.id + stride))
+
+    def test_lookup_ignores_case_and_whitespace(self):
+        alice, alice_client = self.make_user("alice")
+        bob, _ = self.make_user("bob")
+
+        response = self.post(
+            alice_client,
+            "/api/conversations/start/",
+            {"ref_code": f" {bob.profile.ref_code.lower()} "},
+        )
+
+        self.assertEqual(response.status_code, 201)
+
+
+class RateLimitTests(ChatTestCase):
+    def test_token_bucket_rejects_past_the_limit(self):
+        decisions = [
+            ratelimit.check("test", "k", "3/m").allowed for _ in range(4)
+        ]
+
+        self.assertEqual(decisions, [True, True, True, False])
+        # Other keys have their own budget.
+        self.assertTrue(ratelimit.check("test", "other", "3/m").allowed)
+
+    def test_sliding_window_rejects_past_the_limit(self):
+        decisions = [
+            ratelimit.check("test", "k", "3/m", "sliding_window").allowed
+            for _ in range(4)
+        ]
+
+        self.assertEqual(decisions, [True, True, True, False])
+
+    def test_rejected_cost_is_not_charged(self):
+        for algorithm in ratelimit.ALGORITHMS:
+            with self.subTest(algorithm=algorithm):
+                self.assertTrue(
+                    ratelimit.check(algorithm, "k", "5/m", algorithm, 4).allowed
+                )
+                self.assertFalse(
+                    ratelimit.check(algorithm, "k", "5/m", algorithm, 2).allowed
+                )
+                self.assertTrue(
+                    ratelimit.check(algorithm, "k", "5/m", algorithm, 1).allowed
+                )
+
+    def test_per_process_limits_are_flagged_for_deployment(self):
+        self.assertEqual(
+            [w.id for w in ratelimit.check_ratelimit_backend(None)],
+            ["chat.W002"],
+        )
+        with override_settings(
+            CHAT_RATELIMIT_CACHE="shared",
+            CACHES={
+                "default": {
+                    "BACKEND": "django.core.cache.backends.locmem.LocMemCache"
+                },
+                "shared": {
+                    "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+                    "LOCATION": "chat_cache",
+                },
+            },
+        ):
+            self.assertEqual(ratelimit.check_ratelimit_backend(None), [])
+
+    def test_view_returns_429_with_headers(self):
+        client = APIClient()
+        for _ in range(5):
+            self.post(
+                client, "/api/auth/request-code/", {"email": "dora@example.com"}
+            )
+
+        response = self.post(
+            client, "/api/auth/request-code/", {"email": "DORA@example.com"}
+        )
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["X-RateLimit-Remaining"], "0")
+        self.assertGreater(int(response["Retry-After"]), 0)
+        self.assertEqual(len(mail.outbox), 5)
+
+
+class SendTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice, self.alice_client = self.make_user("alice")
+        self.bob, self.bob_client = self.make_user("bob")
+        self.conversation_id = self.start_conversation(
+            self.alice_client, self.bob
+        )
+        self.bulk_url = f"/api/conversations/{self.conversation_id}/messages/bulk/"
+
+    def bulk(self, items):
+        return self.post(self.alice_client, self.bulk_url, {"messages": items})
+
+    def test_repeated_client_msg_id_is_stored_once(self):
+        first = self.send(
+            self.alice_client, self.conversation_id, "hi", client_msg_id="k1"
+        )
+        again = self.send(
+            self.alice_client, self.conversation_id, "hi", client_msg_id="k1"
+        )
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(again.json()["id"], first.json()["id"])
+        self.assertEqual(Message.objects.count(), 1)
+
+    def test_bulk_send_keeps_order_and_skips_repeats(self):
+        self.send(self.alice_client, self.conversation_id, "one", client_msg_id="k1")
+
+        response = self.bulk(
+            [
+                {"content": "one", "client_msg_id": "k1"},
+                {"content": "two", "client_msg_id": "k2"},
+                {"content": "two again", "client_msg_id": "k2"},
+                {"content": "three"},
+            ]
+        )
+
+        self.assertEqual(response.status_code, 201)
+        results = response.json()["results"]
+        self.assertEqual(
+            [message["content"] for message in results],
+            ["one", "two", "two", "three"],
+        )
+        self.assertEqual(results[1]["id"], results[2]["id"])
+        self.assertEqual(
+            list(
+                Message.objects.order_by("id").values_list("content", flat=True)
+            ),
+            ["one", "two", "three"],
+        )
+
+    def test_bulk_send_only_repeats_is_200(self):
+        self.send(self.alice_client, self.conversation_id, "one", client_msg_id="k1")
+
+        response = self.bulk([{"content": "one", "client_msg_id": "k1"}])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Message.objects.count(), 1)
+
+    def test_bulk_send_is_charged_per_message(self):
+        items = [{"content": f"m{index}"} for index in range(50)]
+        self.assertEqual(self.bulk(items).status_code, 201)
+
+        response = self.bulk(items[:20])
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(Message.objects.count(), 50)
+        # Single sends draw from the same budget.
+        for index in range(10):
+            self.send(self.alice_client, self.conversation_id, f"s{index}")
+        self.assertEqual(
+            self.send(self.alice_client, self.conversation_id, "x").status_code,
+            429,
+        )
+
+    def test_oversized_bulk_send_is_rejected_uncharged(self):
+        items = [
+            {"content": f"m{index}"}
+            for index in range(messaging.BULK_MAX_MESSAGES + 1)
+        ]
+
+        response = self.bulk(items)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.has_header("Retry-After"))
+        self.assertEqual(
+            self.bulk(items[: messaging.BULK_MAX_MESSAGES]).status_code, 201
+        )
+
+    def test_bulk_send_rejects_non_member(self):
+        carol, carol_client = self.make_user("carol")
+
+        response = self.post(
+            carol_client, self.bulk_url, {"messages": [{"content": "hi"}]}
+        )
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(Message.objects.count(), 0)
+
+
+class LongPollTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice, self.alice_client = self.make_user("alice")
+        self.bob, self.bob_client = self.make_user("bob")
+        self.conversation_id = self.start_conversation(
+            self.alice_client, self.bob
+        )
+        self.url = f"/api/conversations/{self.conversation_id}/updates/"
+
+    def test_requires_a_valid_token(self):
+        anonymous = APIClient()
+        bad_token = APIClient()
+        bad_token.credentials(HTTP_AUTHORIZATION="Token nope")
+
+        for client in (anonymous, bad_token):
+            response = self.get(client, self.url, {"timeout": 0})
+            self.assertEqual(response.status_code, 401)
+            self.assertIn("detail", response.json())
+
+    def test_unknown_conversation_is_not_found(self):
+        response = self.get(
+            self.alice_client, "/api/conversations/999999/updates/", {"timeout": 0}
+        )
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json(), {"detail": "Not found."})
+
+    def test_non_member_is_rejected(self):
+        carol, carol_client = self.make_user("carol")
+
+        response = self.get(carol_client, self.url, {"timeout": 0})
+
+        self.assertEqual(response.status_code, 403)
+
+    def test_pending_messages_return_at_once(self):
+        first = self.send(self.alice_client, self.conversation_id, "one").json()
+        second = self.send(self.alice_client, self.conversation_id, "two").json()
+
+        data = self.get(
+            self.bob_client, self.url, {"cursor": first["id"], "timeout": 30}
+        ).json()
+
+        self.assertFalse(data["timed_out"])
+        self.assertEqual([m["id"] for m in data["results"]], [second["id"]])
+        self.assertEqual(data["cursor"], second["id"])
+
+    def test_zero_timeout_returns_an_empty_delta(self):
+        message = self.send(self.alice_client, self.conversation_id, "hi").json()
+
+        data = self.get(
+            self.bob_client, self.url, {"cursor": message["id"], "timeout": 0}
+        ).json()
+
+        self.assertFalse(data["timed_out"])
+        self.assertEqual(data["results"], [])
+        self.assertEqual(data["cursor"], message["id"])
+
+
+class ObservedBroker(realtime.InMemoryBroker):
+    """
+    In-process broker that lets a test wait until a consumer subscribed.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.subscribed = asyncio.Event()
+
+    def add_channel(self, subscription, channel):
+        super().add_channel(subscription, channel)
+        self.subscribed.set()
+
+
+@override_settings(CHAT_REALTIME_BACKEND="chat.tests.ObservedBroker")
+class LongPollWakeupTests(ChatTransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice, self.alice_client = self.make_user("alice")
+        self.bob, self.bob_client = self.make_user("bob")
+        self.conversation_id = self.start_conversation(
+            self.alice_client, self.bob
+        )
+        self.url = f"/api/conversations/{self.conversation_id}/updates/"
+        self.messages_url = f"/api/conversations/{self.conversation_id}/messages/"
+        self.cursor = self.send(
+            self.alice_client, self.conversation_id, "hi"
+        ).json()["id"]
+
+    async def park(self, user, timeout=30):
+        """
+        Start a long-poll for ``user``; returns its task once the request
+        is subscribed, so anything published from here on must wake it.
+        """
+
+        token = await sync_to_async(lambda: user.auth_token.key)()
+        task = asyncio.ensure_future(
+            self.async_client.get(
+                self.url,
+                {"cursor": self.cursor, "timeout": timeout},
+                headers={"Authorization": f"Token {token}"},
+            )
+        )
+        await asyncio.wait_for(realtime.get_broker().subscribed.wait(), 2)
+        return task
+
+    async def result(self, task) -> dict:
+        response = await asyncio.wait_for(task, 5)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    async def test_new_message_wakes_the_poll(self):
+        task = await self.park(self.bob)
+
+        sent = await sync_to_async(self.send)(
+            self.alice_client, self.conversation_id, "news"
+        )
+
+        data = await self.result(task)
+        self.assertFalse(data["timed_out"])
+        self.assertEqual([m["id"] for m in data["results"]], [sent.json()["id"]])
+        self.assertEqual(data["cursor"], sent.json()["id"])
+
+    async def test_typing_wakes_the_poll(self):
+        task = await self.park(self.bob)
+
+        await sync_to_async(self.post)(
+            self.alice_client,
+            f"/api/conversations/{self.conversation_id}/typing/",
+            {"is_typing": True},
+        )
+
+        data = await self.result(task)
+        self.assertFalse(data["timed_out"])
+        self.assertEqual(data["results"], [])
+        self.assertEqual(data["typing_ids"], [self.alice.id])
+
+    async def test_read_marker_wakes_the_poll(self):
+        await sync_to_async(self.get)(self.alice_client, self.messages_url)
+        task = await self.park(self.alice)
+
+        await sync_to_async(self.get)(self.bob_client, self.messages_url)
+
+        data = await self.result(task)
+        self.assertFalse(data["timed_out"])
+        self.assertEqual(data["read_up_to"], self.cursor)
+
+    async def test_quiet_conversation_times_out(self):
+        task = await self.park(self.bob, timeout=0.05)
+
+        data = await self.result(task)
+        self.assertTrue(data["timed_out"])
+        self.assertEqual(data["results"], [])
+        self.assertEqual(data["cursor"], self.cursor)
+
+
+class SearchTests(ChatTestCase):
+    url = "/api/search/messages/"
+
+    def setUp(self):
+        super().setUp()
+        self.alice, self.alice_client = self.make_user("alice")
+        self.bob, self.bob_client = self.make_user("bob")
+        self.carol, self.carol_client = self.make_user("carol")
+        self.conversation_id = self.start_conversation(
+            self.alice_client, self.bob
+        )
+
+    def search(self, client, q, **params):
+        response = self.get(client, self.url, {"q": q, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_all_words_must_match_the_last_as_a_prefix(self):
+        match = self.send(
+            self.alice_client, self.conversation_id, "lunch on Friday?"
+        ).json()
+        self.send(self.alice_client, self.conversation_id, "lunch tomorrow")
+
+        data = self.search(self.bob_client, "LUNCH fri")
+
+        self.assertEqual([m["id"] for m in data["results"]], [match["id"]])
+        self.assertEqual(
+            data["results"][0]["snippet"],
+            "<mark>lunch</mark> on <mark>Friday</mark>?",
+        )
+
+    def test_snippet_is_html_escaped(self):
+        self.send(self.alice_client, self.conversation_id, "<b>deploy</b> now")
+
+        data = self.search(self.bob_client, "deploy")
+
+        self.assertEqual(
+            data["results"][0]["snippet"],
+            "&lt;b&gt;<mark>deploy</mark>&lt;/b&gt; now",
+        )
+
+    def test_operators_in_the_query_are_literal(self):
+        self.send(self.alice_client, self.conversation_id, "cats and dogs")
+
+        data = self.search(self.bob_client, 'cats OR "dogs')
+
+        self.assertEqual(data["results"], [])
+
+    def test_only_the_callers_conversations_are_searched(self):
+        self.send(self.alice_client, self.conversation_id, "secret plan")
+
+        self.assertEqual(self.search(self.carol_client, "secret")["results"], [])
+        response = self.get(
+            self.carol_client,
+            self.url,
+            {"q": "secret", "conversation": self.conversation_id},
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_results_are_paginated(self):
+        for i in range(3):
+            self.send(self.alice_client, self.conversation_id, f"ping {i}")
+
+        first = self.search(self.bob_client, "ping", limit=2)
+        second = self.search(
+            self.bob_client, "ping", limit=2, offset=first["next_offset"]
+        )
+
+        self.assertTrue(first["has_more"])
+        self.assertEqual(first["next_offset"], 2)
+        self.assertFalse(second["has_more"])
+        ids = [m["id"] for m in first["results"] + second["results"]]
+        self.assertEqual(len(set(ids)), 3)
+
+    def test_index_follows_edits_and_deletes(self):
+        message = self.send(self.alice_client, self.conversation_id, "draft")
+        Message.objects.filter(id=message.json()["id"]).update(content="final")
+
+        self.assertEqual(self.search(self.bob_client, "draft")["results"], [])
+        self.assertEqual(len(self.search(self.bob_client, "final")["results"]), 1)
+
+        Message.objects.filter(id=message.json()["id"]).delete()
+        self.assertEqual(self.search(self.bob_client, "final")["results"], [])
+
+    def test_postgres_query_has_the_same_semantics(self):
+        self.assertEqual(
+            search._tsquery("lunch & fri!"), "'lunch' & 'fri':*"
+        )
+        self.assertIsNone(search._tsquery("?!"))
+
+    def test_missing_query_is_rejected(self):
+        self.assertEqual(
+            self.get(self.bob_client, self.url, {"q": " "}).status_code, 400
+        )
+
+
+class ArchiveTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice, self.alice_client = self.make_user("alice")
+        self.bob, self.bob_client = self.make_user("bob")
+        self.conversation_id = self.start_conversation(
+            self.alice_client, self.bob
+        )
+        self.url = f"/api/conversations/{self.conversation_id}/messages/"
+        self.ids = [
+            self.send(self.alice_client, self.conversation_id, f"note {i}")
+            .json()["id"]
+            for i in range(6)
+        ]
+
+    def archive(self, count: int):
+        """
+        Age and archive the oldest ``count`` messages.
+        """
+
+        Message.objects.filter(id__in=self.ids[:count]).update(
+            created_at=dj_timezone.now() - timedelta(days=365)
+        )
+        out = io.StringIO()
+        call_command("archive_messages", batch_size=2, stdout=out)
+        self.assertEqual(out.getvalue().strip(), f"Archived {count} messages.")
+
+    def page_ids(self, client, **params):
+        data = self.get(client, self.url, params).json()
+        return [m["id"] for m in data["results"]], data
+
+    def test_newest_message_is_never_archived(self):
+        self.archive(6 - 1)
+        Message.objects.filter(id=self.ids[-1]).update(
+            created_at=dj_timezone.now() - timedelta(days=365)
+        )
+
+        call_command("archive_messages", stdout=io.StringIO())
+
+        self.assertEqual(
+            list(Message.objects.values_list("id", flat=True)), self.ids[-1:]
+        )
+        self.assertEqual(ArchivedMessage.objects.count(), 5)
+
+    def test_before_pages_continue_into_the_archive(self):
+        self.archive(4)
+
+        seen = []
+        ids, data = self.page_ids(self.bob_client, limit=2)
+        seen += ids
+        while data["has_more"]:
+            ids, data = self.page_ids(
+                self.bob_client, limit=2, before=data["next_before"]
+            )
+            seen = ids + seen
+
+        self.assertEqual(seen, self.ids)
+
+    def test_around_an_archived_message(self):
+        self.archive(4)
+
+        ids, data = self.page_ids(self.bob_client, around=self.ids[3], limit=4)
+
+        self.assertEqual(ids, self.ids[1:5])
+        self.assertTrue(data["has_more"])
+        self.assertTrue(data["has_newer"])
+
+    def test_after_continues_from_the_archive(self):
+        self.archive(4)
+
+        ids, data = self.page_ids(self.bob_client, after=self.ids[1], limit=3)
+        self.assertEqual(ids, self.ids[2:5])
+        self.assertTrue(data["has_more"])
+
+        ids, data = self.page_ids(self.bob_client, after=data["next_after"])
+        self.assertEqual(ids, self.ids[5:])
+
+    def test_read_up_to_can_point_into_the_archive(self):
+        self.get(self.alice_client, self.url)
+        self.get(self.bob_client, self.url)
+        later = self.send(self.alice_client, self.conversation_id, "later")
+        self.ids.append(later.json()["id"])
+        self.archive(6)
+
+        data = self.get(
+            self.alice_client, self.url, {"after": self.ids[-1]}
+        ).json()
+
+        self.assertEqual(data["read_up_to"], self.ids[5])
+
+    def test_archived_messages_stay_searchable(self):
+        self.archive(4)
+
+        data = self.get(
+            self.bob_client, "/api/search/messages/", {"q": "note"}
+        ).json()
+
+        self.assertEqual(
+            sorted(m["id"] for m in data["results"]), sorted(self.ids)
+        )
+        first = next(m for m in data["results"] if m["id"] == self.ids[0])
+        self.assertEqual(first["content"], "note 0")
+        self.assertEqual(first["snippet"], "<mark>note</mark> 0")
+        data = self.get(
+            self.bob_client,
+            "/api/search/messages/",
+            {"q": "note 1", "conversation": self.conversation_id},
+        ).json()
+        self.assertEqual([m["id"] for m in data["results"]], [self.ids[1]])
+
+
+@override_settings(CHAT_VERSIONED_RESPONSES=True)
+class VersionedResponseTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice, self.alice_client = self.make_user("alice")
+        self.bob, self.bob_client = self.make_user("bob")
+        self.conversation_id = self.start_conversation(
+            self.alice_client, self.bob
+        )
+        self.url = f"/api/conversations/{self.conversation_id}/messages/"
+        self.send(self.alice_client, self.conversation_id, "hi")
+
+    def assertRevalidates(self, client, path):
+        first = self.get(client, path)
+        self.assertEqual(first.status_code, 200)
+        again = self.get(client, path, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(again.status_code, 304)
+        return first["ETag"]
+
+    def test_new_message_invalidates_etags(self):
+        # Read once so the read marker settles before taking ETags.
+        self.get(self.bob_client, self.url)
+        messages_etag = self.assertRevalidates(self.bob_client, self.url)
+        inbox_etag = self.assertRevalidates(
+            self.bob_client, "/api/conversations/"
+        )
+
+        self.send(self.alice_client, self.conversation_id, "again")
+
+        response = self.get(
+            self.bob_client, self.url, HTTP_IF_NONE_MATCH=messages_etag
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [message["content"] for message in response.json()["results"]],
+            ["hi", "again"],
+        )
+        response = self.get(
+            self.bob_client,
+            "/api/conversations/",
+            HTTP_IF_NONE_MATCH=inbox_etag,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json()["results"][0]["last_message_preview"], "again"
+        )
+
+    def test_etags_are_per_user(self):
+        self.get(self.alice_client, self.url)
+        self.get(self.bob_client, self.url)
+        alice_etag = self.assertRevalidates(self.alice_client, self.url)
+
+        response = self.get(
+            self.bob_client, self.url, HTTP_IF_NONE_MATCH=alice_etag
+        )
+
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(CHAT_VERSIONED_RESPONSES=None)
+    def test_per_process_cache_disables_etags(self):
+        self.assertFalse(versions.enabled())
+        self.assertFalse(self.get(self.bob_client, self.url).has_header("ETag"))
+
+
+@override_settings(CHAT_REPLICA_DATABASES=["replica_0"])
+class ReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        caches["default"].clear()
+        self.router = routers.ReplicaRouter()
+        self.user = get_user_model()(id=1, username="alice")
+        token = routers._state.set(routers._RequestState())
+        self.addCleanup(routers._state.reset, token)
+
+    def get_request(self, method="GET"):
+        request = getattr(RequestFactory(), method.lower())("/")
+        request.user = self.user
+        return request
+
+    def test_opted_in_read_goes_to_replica(self):
+        self.assertEqual(self.router.db_for_read(Message), DEFAULT_DB_ALIAS)
+
+        routers.use_replica(self.get_request())
+
+        self.assertEqual(self.router.db_for_read(Message), "replica_0")
+        self.assertTrue(routers.replica_used())
+
+    def test_pinned_user_reads_primary(self):
+        routers.pin_to_primary(self.user)
+
+        routers.use_replica(self.get_request())
+
+        self.assertEqual(self.router.db_for_read(Message), DEFAULT_DB_ALIAS)
+
+    def test_write_in_request_moves_reads_to_primary(self):
+        routers.use_replica(self.get_request())
+
+        self.assertEqual(self.router.db_for_write(Message), DEFAULT_DB_ALIAS)
+        self.assertEqual(self.router.db_for_read(Message), DEFAULT_DB_ALIAS)
+
+    def test_unsafe_request_never_reads_replica(self):
+        routers.use_replica(self.get_request("POST"))
+
+        self.assertEqual(self.router.db_for_read(Message), DEFAULT_DB_ALIAS)
+
+    @override_settings(CHAT_VERSIONED_RESPONSES=True)
+    def test_replica_page_is_not_cached(self):
+        versions.get_response_cache.reset()
+        routers.use_replica(self.get_request())
+        self.router.db_for_read(Message)
+
+        self.assertEqual(
+            views._versioned_page("key", {"results": []}),
+            (200, {"results": []}, None),
+        )
+
+
+@override_settings(CHAT_REPLICA_DATABASES=["replica_0"])
+class ReplicaPinningTests(ChatTestCase):
+    def test_write_pins_only_the_writer(self):
+        alice, alice_client = self.make_user("alice")
+        bob, _ = self.make_user("bob")
+        conversation_id = self.start_conversation(alice_client, bob)
+
+        self.send(alice_client, conversation_id, "hi")
+
+        self.assertTrue(routers.is_pinned(alice))
+        self.assertFalse(routers.is_pinned(bob))
+
+
+class WebSocketTests(ChatTransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice, self.alice_client = self.make_user("alice")
+        self.bob, self.bob_client = self.make_user("bob")
+        self.conversation_id = self.start_conversation(
+            self.alice_client, self.bob
+        )
+
+    async def connect(self, user):
+        """
+        Open a socket for ``user``; returns (inbox, outbox, task).
+        """
+
+        token = await sync_to_async(lambda: user.auth_token.key)()
+        inbox, outbox = asyncio.Queue(), asyncio.Queue()
+        scope = {
+            "type": "websocket",
+            "path": "/ws/chat/",
+            "query_string": f"token={token}".encode(),
+            "headers": [],
+        }
+        task = asyncio.ensure_future(
+            websocket.websocket_application(scope, inbox.get, outbox.put)
+        )
+        await inbox.put({"type": "websocket.connect"})
+        accepted = await asyncio.wait_for(outbox.get(), 2)
+        self.assertEqual(accepted, {"type": "websocket.accept"})
+        return inbox, outbox, task
+
+    async def disconnect(self, socket):
+        inbox, _, task = socket
+        await inbox.put({"type": "websocket.disconnect"})
+        await asyncio.wait_for(task, 2)
+
+    async def request(self, socket, **frame):
+        await socket[0].put(
+            {"type": "websocket.receive", "text": json.dumps(frame)}
+        )
+
+    async def events(self, socket) -> list[dict]:
+        """
+        Everything the socket sends up to two ping round trips, i.e. every
+        event already published to it.
+        """
+
+        events = []
+        for _ in range(2):
+            await self.request(socket, action="ping")
+            while True:
+                frame = await asyncio.wait_for(socket[1].get(), 2)
+                event = json.loads(frame["text"])
+                if event == {"type": "pong"}:
+                    break
+                events.append(event)
+        return events
+
+    async def test_member_receives_messages_and_typing(self):
+        socket = await self.connect(self.bob)
+        await sync_to_async(self.send)(
+            self.alice_client, self.conversation_id, "hi"
+        )
+        await sync_to_async(self.post)(
+            self.alice_client,
+            f"/api/conversations/{self.conversation_id}/typing/",
+            {"is_typing": True},
+        )
+
+        events = await self.events(socket)
+
+        message = next(e for e in events if e["type"] == "message.new")
+        self.assertEqual(message["message"]["content"], "hi")
+        self.assertFalse(message["message"]["is_mine"])
+        self.assertIn(
+            {
+                "type": "typing",
+                "conversation": self.conversation_id,
+                "user_id": self.alice.id,
+                "is_typing": True,
+            },
+            events,
+        )
+        await self.disconnect(socket)
+
+    async def test_removed_member_stops_receiving(self):
+        socket = await self.connect(self.bob)
+        await self.events(socket)
+
+        await ConversationMember.objects.filter(user=self.bob).adelete()
+        await sync_to_async(self.send)(
+            self.alice_client, self.conversation_id, "after removal"
+        )
+        await self.request(
+            socket, action="subscribe", conversation=self.conversation_id
+        )
+
+        events = await self.events(socket)
+
+        self.assertEqual(
+            [event["type"] for event in events],
+            ["membership.removed", "error"],
+        )
+        await self.disconnect(socket)
+
+    async def test_subscribe_and_typing_require_membership(self):
+        carol, _ = await sync_to_async(self.make_user)("carol")
+        socket = await self.connect(carol)
+
+        for action in ("subscribe", "typing"):
+            await self.request(
+                socket, action=action, conversation=self.conversation_id
+            )
+        await self.request(socket, action="subscribe", conversation=999)
+
+        self.assertEqual(
+            [event["detail"] for event in await self.events(socket)],
+            ["not a member of this conversation"] * 3,
+        )
+        await self.disconnect(socket)
+
+    async def test_offline_only_after_the_last_socket_closes(self):
+        watcher = await self.connect(self.alice)
+        first = await self.connect(self.bob)
+        second = await self.connect(self.bob)
+        # A ping answered means the socket has finished connecting.
+        await self.events(first)
+        await self.events(second)
+        await self.events(watcher)
+
+        await self.disconnect(first)
+        self.assertEqual(await self.events(watcher), [])
+
+        await self.disconnect(second)
+        presence_events = await self.events(watcher)
+        self.assertEqual(len(presence_events), 1)
+        self.assertEqual(presence_events[0]["type"], "presence")
+        self.assertFalse(presence_events[0]["is_online"])
+        await self.disconnect(watcher)
+
+    async def test_invalid_token_is_rejected(self):
+        inbox, outbox = asyncio.Queue(), asyncio.Queue()
+        await inbox.put({"type": "websocket.connect"})
+        scope = {
+            "type": "websocket",
+            "path": "/ws/chat/",
+            "query_string": b"token=nope",
+            "headers": [],
+        }
+
+        await websocket.websocket_application(scope, inbox.get, outbox.put)
+
+        self.assertEqual(
+            await outbox.get(),
+            {"type": "websocket.close", "code": websocket.CLOSE_UNAUTHORIZED},
+        )
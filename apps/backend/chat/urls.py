@@ -5,6 +5,7 @@ from . import views
 
 urlpatterns = [
     path("health/", views.health, name="health"),
+    path("ops/metrics/", views.ops_metrics, name="ops_metrics"),
     path("messages/", views.list_messages, name="messages"),
     path("auth/request-code/", views.request_login_code, name="request_login_code"),
     path("auth/verify-code/", views.verify_login_code, name="verify_login_code"),
@@ -15,11 +16,27 @@ urlpatterns = [
         views.start_conversation_by_ref_code,
         name="start_conversation_by_ref_code",
     ),
+    path(
+        "conversations/status/",
+        views.conversations_status,
+        name="conversations_status",
+    ),
+    path("search/messages/", views.search_messages, name="search_messages"),
     path(
         "conversations/<int:conversation_id>/messages/",
         views.conversation_messages,
         name="conversation_messages",
     ),
+    path(
+        "conversations/<int:conversation_id>/messages/bulk/",
+        views.conversation_messages_bulk,
+        name="conversation_messages_bulk",
+    ),
+    path(
+        "conversations/<int:conversation_id>/updates/",
+        views.conversation_updates,
+        name="conversation_updates",
+    ),
     path(
         "conversations/<int:conversation_id>/typing/",
         views.conversation_typing,
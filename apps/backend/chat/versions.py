@@ -0,0 +1,178 @@
+"""
+Version counters, ETags and a response cache for the poll-heavy endpoints.
+
+Every conversation has a version that is bumped whenever something visible
+in ``conversation_messages`` changes (new message, read marker, membership,
+a member's profile). Every user has an "inbox" version bumped whenever
+something visible in their ``list_conversations`` changes, and an "auth"
+version bumped whenever their tokens or account change (see
+``chat.authentication``). The counters live in a Django cache
+(``settings.CHAT_VERSION_CACHE``) so they can be read without touching the
+ORM.
+
+A (version, viewer, window) key then feeds strong ETags for
+``If-None-Match`` and an in-process LRU of already-serialized payloads
+(``settings.CHAT_RESPONSE_CACHE_SIZE`` entries, 0 disables it).
+
+The counters must be shared by every worker: a bump made in one process has
+to reach the others, or they keep serving their cached payloads and 304s.
+So ETags and the response cache are only used (``enabled()``) when
+``CHAT_VERSION_CACHE`` is a shared backend (Redis, Memcached, database ...).
+With a per-process cache such as the default locmem they stay off unless
+``CHAT_VERSIONED_RESPONSES = True`` declares a single-process deployment,
+which the ``chat.W001`` system check warns about.
+"""
+
+import time
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.utils.crypto import salted_hmac
+
+from .caching import LRUCache, process_singleton
+
+
+DEFAULT_RESPONSE_CACHE_SIZE = 2048
+
+
+# Backends whose state is private to one process.
+PER_PROCESS_CACHES = (LocMemCache, DummyCache)
+
+
+def _cache():
+    return caches[getattr(settings, "CHAT_VERSION_CACHE", "default")]
+
+
+def shared() -> bool:
+    """
+    Whether bumps made in this process reach the other workers.
+    """
+
+    return not isinstance(_cache(), PER_PROCESS_CACHES)
+
+
+def enabled() -> bool:
+    """
+    Whether ETags and the response cache may be used: forced either way by
+    ``CHAT_VERSIONED_RESPONSES``, otherwise only with a shared version
+    cache.
+    """
+
+    forced = getattr(settings, "CHAT_VERSIONED_RESPONSES", None)
+    if forced is not None:
+        return bool(forced)
+    return shared()
+
+
+@checks.register(checks.Tags.caches)
+def check_version_cache(app_configs, **kwargs):
+    if not getattr(settings, "CHAT_VERSIONED_RESPONSES", None):
+        return []
+    if shared():
+        return []
+    return [
+        checks.Warning(
+            "CHAT_VERSIONED_RESPONSES is on but CHAT_VERSION_CACHE is a "
+            "per-process cache.",
+            hint="Version bumps will not reach other workers, which keep "
+            "serving stale pages and 304s. Point CHAT_VERSION_CACHE at a "
+            "shared cache, or only run a single process.",
+            id="chat.W001",
+        )
+    ]
+
+
+def _get_version(key: str) -> int:
+    version = _cache().get(key)
+    if version is None:
+        # A fresh, time-based start value means ETags issued before the
+        # counter was evicted can never match again.
+        _cache().add(key, time.time_ns(), timeout=None)
+        version = _cache().get(key)
+    return version
+
+
+def _bump(key: str) -> None:
+    try:
+        _cache().incr(key)
+    except ValueError:
+        _cache().set(key, time.time_ns(), timeout=None)
+
+
+def conversation_version(conversation_id: int) -> int:
+    return _get_version(f"chat:version:conversation:{conversation_id}")
+
+
+def inbox_version(user_id: int) -> int:
+    return _get_version(f"chat:version:inbox:{user_id}")
+
+
+def bump_conversation(conversation_id: int) -> None:
+    transaction.on_commit(
+        lambda: _bump(f"chat:version:conversation:{conversation_id}")
+    )
+
+
+def bump_inboxes(user_ids) -> None:
+    user_ids = list(user_ids)
+
+    def bump():
+        for user_id in user_ids:
+            _bump(f"chat:version:inbox:{user_id}")
+
+    transaction.on_commit(bump)
+
+
+def auth_version(user_id: int) -> int:
+    return _get_version(f"chat:version:auth:{user_id}")
+
+
+def bump_auth(user_id: int) -> None:
+    transaction.on_commit(lambda: _bump(f"chat:version:auth:{user_id}"))
+
+
+def etag_for(key) -> str:
+    """
+    Strong ETag for a cache key; keyed with SECRET_KEY so it is opaque.
+    """
+
+    digest = salted_hmac("chat.versions.etag", repr(key)).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def etag_matches(request, etag: str) -> bool:
+    header = request.headers.get("If-None-Match")
+    if not header:
+        return False
+    candidates = [value.strip() for value in header.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+def window_key(request) -> str:
+    """
+    Canonical form of the query string, so parameter order does not split
+    cache entries.
+    """
+
+    return "&".join(
+        f"{name}={value}"
+        for name, values in sorted(request.GET.lists())
+        for value in values
+    )
+
+
+@process_singleton
+def get_response_cache() -> LRUCache:
+    """
+    In-process LRU of cache key -> serialized payload.
+    """
+
+    return LRUCache(
+        getattr(
+            settings, "CHAT_RESPONSE_CACHE_SIZE", DEFAULT_RESPONSE_CACHE_SIZE
+        )
+    )
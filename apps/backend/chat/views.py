@@ -1,37 +1,61 @@
+from bisect import bisect_left
 from datetime import datetime, timedelta, timezone
+import asyncio
+import base64
 import random
 import string
 
+from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user_model
-from django.core.mail import send_mail
-from django.shortcuts import get_object_or_404
+from django.core.mail import EmailMessage
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.db.models import Count, Min, Q
+from django.http import Http404, JsonResponse
 from django.utils import timezone as dj_timezone
+from django.views.decorators.http import require_GET
 from rest_framework import status
 from rest_framework.authtoken.models import Token
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import AllowAny
+from rest_framework.exceptions import APIException, NotAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework.response import Response
 
+from . import (
+    archive,
+    mailqueue,
+    membership,
+    messaging,
+    presence,
+    realtime,
+    refcodes,
+    routers,
+    search,
+    versions,
+)
+from .authentication import aget_token_user, token_from_header
 from .models import (
     Conversation,
     ConversationMember,
     LoginCode,
     Message,
     Profile,
-    TypingStatus,
 )
-from .serializers import ConversationSerializer, MessageSerializer, ProfileSerializer
+from .ratelimit import rate_limit
+from .serializers import (
+    ConversationSerializer,
+    ProfileSerializer,
+    message_rows,
+    serialize_message_rows,
+)
 
 
-def _touch_last_seen(user) -> None:
-    """
-    Lightweight helper to bump a user's last_seen_at timestamp.
-    """
-
-    if not getattr(user, "is_authenticated", False):
-        return
-    now = dj_timezone.now()
-    Profile.objects.filter(user=user).update(last_seen_at=now)
+LONG_POLL_DEFAULT_TIMEOUT = 25.0
+LONG_POLL_MAX_TIMEOUT = 30.0
+LONG_POLL_BATCH_SIZE = 200
+STATUS_MAX_CONVERSATIONS = 100
+# Single and bulk sends draw from one per-user message budget.
+MESSAGE_RATE = "60/m"
+MESSAGE_RATE_SCOPE = "messages:user"
 
 
 @api_view(["GET"])
@@ -46,6 +70,21 @@ def health(request):
     )
 
 
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def ops_metrics(request):
+    """
+    Internal counters of the background workers, for staff only.
+    """
+
+    return Response(
+        {
+            "last_seen_writes": presence.get_last_seen_recorder().metrics(),
+            "login_emails": mailqueue.get_email_queue().metrics(),
+        }
+    )
+
+
 @api_view(["GET"])
 @permission_classes([AllowAny])
 def list_messages(request):
@@ -72,10 +111,17 @@ def list_messages(request):
 
 @api_view(["POST"])
 @permission_classes([AllowAny])
+@rate_limit(
+    "email",
+    "5/m",
+    detail="Too many login code requests. "
+    "Please wait a bit before trying again.",
+)
 def request_login_code(request):
     """
     Request a 4-character alphanumeric login code sent to the given email.
-    In development the email is printed to the console (console email backend).
+    The email is queued and sent in the background (see chat/mailqueue.py);
+    in development it is printed to the console (console email backend).
     """
 
     email = (request.data.get("email") or "").strip().lower()
@@ -97,29 +143,20 @@ def request_login_code(request):
 
     now = dj_timezone.now()
 
-    # Simple rate limiting: at most 5 codes per user per rolling minute.
-    recent_count = LoginCode.objects.filter(
-        user=user,
-        created_at__gte=now - timedelta(minutes=1),
-    ).count()
-    if recent_count >= 5:
-        return Response(
-            {
-                "detail": "Too many login code requests. "
-                "Please wait a bit before trying again."
-            },
-            status=status.HTTP_429_TOO_MANY_REQUESTS,
-        )
-
     code = "".join(random.choices(string.ascii_uppercase + string.digits, k=4))
     expires_at = now + timedelta(minutes=10)
-    LoginCode.objects.create(user=user, code=code, expires_at=expires_at)
+    LoginCode.objects.create(
+        user=user, code_hash=LoginCode.hash_code(code), expires_at=expires_at
+    )
 
-    send_mail(
-        subject="Your TrueSight Chat login code",
-        message=f"Your login code is: {code}\nThis code expires in 10 minutes.",
-        from_email=None,
-        recipient_list=[email],
+    # Delivered by the background mail queue; SMTP latency stays off the
+    # login request.
+    mailqueue.enqueue(
+        EmailMessage(
+            subject="Your TrueSight Chat login code",
+            body=f"Your login code is: {code}\nThis code expires in 10 minutes.",
+            to=[email],
+        )
     )
 
     return Response({"detail": "Login code sent."})
@@ -150,27 +187,30 @@ def verify_login_code(request):
             status=status.HTTP_400_BAD_REQUEST,
         )
 
+    # Single seek on the (user, code_hash, expires_at) index; the
+    # conditional UPDATE also stops two requests redeeming the same code.
     now = dj_timezone.now()
-    login_code = (
+    login_code_id = (
         LoginCode.objects.filter(
             user=user,
-            code__iexact=code,
-            is_used=False,
+            code_hash=LoginCode.hash_code(code),
             expires_at__gte=now,
+            is_used=False,
         )
         .order_by("-created_at")
+        .values_list("id", flat=True)
         .first()
     )
+    redeemed = login_code_id is not None and LoginCode.objects.filter(
+        id=login_code_id, is_used=False
+    ).update(is_used=True)
 
-    if login_code is None:
+    if not redeemed:
         return Response(
             {"detail": "Invalid or expired code"},
             status=status.HTTP_400_BAD_REQUEST,
         )
 
-    login_code.is_used = True
-    login_code.save(update_fields=["is_used"])
-
     # Normalise username to avoid leaking email addresses.
     if "@" in (user.username or ""):
         local_part = user.username.split("@", 1)[0]
@@ -178,16 +218,7 @@ def verify_login_code(request):
         user.save(update_fields=["username"])
 
     # Ensure the user has a short reference code profile
-    profile, created = Profile.objects.get_or_create(user=user)
-    if created or not profile.ref_code:
-        # Generate a random 6-character alphanumeric code, unique across profiles
-        alphabet = string.ascii_uppercase + string.digits
-        while True:
-            candidate = "".join(random.choices(alphabet, k=6))
-            if not Profile.objects.filter(ref_code=candidate).exists():
-                profile.ref_code = candidate
-                profile.save(update_fields=["ref_code"])
-                break
+    profile = refcodes.get_or_create_profile(user)
 
     token, _ = Token.objects.get_or_create(user=user)
 
@@ -206,42 +237,123 @@ def verify_login_code(request):
 @api_view(["GET"])
 def list_conversations(request):
     """
-    List conversations for the current authenticated user.
+    List conversations for the current authenticated user, most recently
+    active first. Page with the opaque ?cursor=<next_cursor> from the
+    previous response (?offset= is still accepted for older clients).
     """
 
-    _touch_last_seen(request.user)
+    return _page_response(_inbox_page(request))
+
+
+def _inbox_page(request):
+    """
+    GET flow of list_conversations; returns a page (see _page_response).
+    """
+
+    presence.touch_last_seen(request.user)
+
+    cached = _cached_page(request, _inbox_cache_key(request))
+    if cached is not None:
+        return cached
 
     try:
-        limit = int(request.query_params.get("limit", 20))
-    except (TypeError, ValueError):
-        limit = 20
+        keys_qs, offset, limit = _inbox_window(request)
+    except ValueError:
+        return status.HTTP_400_BAD_REQUEST, {"detail": "invalid cursor"}, None
+
+    routers.use_replica(request)
+    # One extra key tells us whether another page exists; no COUNT needed.
+    keys = list(keys_qs[offset : offset + limit + 1])
+    conversations = list(
+        Conversation.objects.filter(
+            id__in=[key[0] for key in keys[:limit]]
+        ).prefetch_related("memberships__user__profile")
+    )
+    return _versioned_page(
+        _inbox_cache_key(request),
+        _inbox_payload(request, keys, conversations, offset, limit),
+    )
+
+
+def _inbox_window(request):
+    """
+    Parse list_conversations paging into (keys queryset, offset, limit);
+    raises ValueError for a malformed cursor. The queryset yields
+    (conversation_id, conversation_updated_at) newest first, read off the
+    viewer's own (user, conversation_updated_at, conversation) index, so a
+    page costs the same however many conversations the user has.
+    """
+
     try:
-        offset = int(request.query_params.get("offset", 0))
+        limit = int(request.GET.get("limit", 20))
     except (TypeError, ValueError):
-        offset = 0
-
+        limit = 20
     limit = max(1, min(limit, 100))
-    offset = max(0, offset)
 
-    base_qs = (
-        Conversation.objects.filter(memberships__user=request.user)
-        .distinct()
-        .order_by("-updated_at")
-        .prefetch_related("memberships__user__profile")
+    keys_qs = (
+        ConversationMember.objects.filter(user=request.user)
+        .order_by("-conversation_updated_at", "-conversation_id")
+        .values_list("conversation_id", "conversation_updated_at")
     )
-    total_count = base_qs.count()
 
-    qs = base_qs[offset : offset + limit]
+    offset = 0
+    cursor_raw = request.GET.get("cursor")
+    if cursor_raw:
+        position = _decode_conversation_cursor(cursor_raw)
+        if position is None:
+            raise ValueError("invalid cursor")
+        updated_at, conv_id = position
+        # The redundant <= bound lets the index seek straight to the cursor.
+        keys_qs = keys_qs.filter(
+            Q(conversation_updated_at__lt=updated_at)
+            | Q(conversation_updated_at=updated_at, conversation_id__lt=conv_id),
+            conversation_updated_at__lte=updated_at,
+        )
+    else:
+        # Legacy offset paging, kept for older clients.
+        try:
+            offset = max(0, int(request.GET.get("offset", 0)))
+        except (TypeError, ValueError):
+            offset = 0
+    return keys_qs, offset, limit
+
+
+def _inbox_payload(
+    request, keys, conversations, offset: int, limit: int
+) -> dict:
+    """
+    Build the list_conversations page from up to ``limit + 1`` keys from
+    ``_inbox_window`` and the first ``limit`` conversations, loaded with
+    their memberships; runs no queries.
+    """
+
+    has_more = len(keys) > limit
+    keys = keys[:limit]
+    conversations_by_id = {conv.id: conv for conv in conversations}
+    # In key order; a conversation deleted in between is skipped.
+    qs = [
+        conversations_by_id[conv_id]
+        for conv_id, _ in keys
+        if conv_id in conversations_by_id
+    ]
 
     serializer = ConversationSerializer(qs, many=True)
     data = serializer.data
 
     # For 1:1 conversations, show the "other" participant's name as title
     # on a per-user basis, and avoid leaking emails.
-    conversations_by_id = {conv.id: conv for conv in qs}
     for item in data:
         conv_id = item.get("id")
         conv = conversations_by_id.get(conv_id)
+        # Per-viewer unread badge, read off the prefetched memberships.
+        item["unread_count"] = next(
+            (
+                m.unread_count
+                for m in (conv.memberships.all() if conv else ())
+                if m.user_id == request.user.id
+            ),
+            0,
+        )
         if conv and not conv.is_group:
             others = [
                 m.user
@@ -261,26 +373,118 @@ def list_conversations(request):
         if "@" in title:
             item["title"] = title.split("@", 1)[0]
 
-    has_more = offset + len(data) < total_count
-    next_offset = offset + len(data) if has_more else None
+    return {
+        "results": data,
+        "has_more": has_more,
+        "next_cursor": _encode_conversation_cursor(*keys[-1])
+        if has_more
+        else None,
+        "next_offset": offset + len(data) if has_more else None,
+    }
 
-    return Response(
-        {
-            "results": data,
-            "has_more": has_more,
-            "next_offset": next_offset,
-        }
+
+def _inbox_cache_key(request) -> tuple | None:
+    if not versions.enabled():
+        return None
+    return (
+        "inbox",
+        request.user.id,
+        versions.inbox_version(request.user.id),
+        versions.window_key(request),
+    )
+
+
+def _messages_cache_key(request, conversation_id: int) -> tuple | None:
+    if not versions.enabled():
+        return None
+    return (
+        "messages",
+        conversation_id,
+        versions.conversation_version(conversation_id),
+        request.user.id,
+        versions.window_key(request),
     )
 
 
+def _page_response(page):
+    """
+    Render a (status, payload, etag) page built by the shared GET flows; a
+    None payload is an empty 304.
+    """
+
+    status_code, payload, etag = page
+    response = Response(payload, status=status_code)
+    if etag is not None:
+        response["ETag"] = etag
+    return response
+
+
+def _cached_page(request, key):
+    """
+    Answer a poll from the version cache without touching the ORM: 304 when
+    the client's If-None-Match still matches, the stored payload when this
+    exact response was built before, otherwise None. A None ``key`` means
+    versioned responses are off (see versions.enabled).
+    """
+
+    if key is None:
+        return None
+    etag = versions.etag_for(key)
+    if versions.etag_matches(request, etag):
+        return status.HTTP_304_NOT_MODIFIED, None, etag
+    payload = versions.get_response_cache().get(key)
+    if payload is None:
+        return None
+    return status.HTTP_200_OK, payload, etag
+
+
+def _versioned_page(key, payload):
+    """
+    Store a freshly built payload under ``key`` and return it with its ETag.
+    Callers build the key after their own side effects (e.g. read markers),
+    so the next identical poll hits. Payloads read from a replica, or built
+    while versioned responses are off, are returned as they are.
+    """
+
+    if key is None or routers.replica_used():
+        # Replica data may lag the version; don't let it stand for it.
+        return status.HTTP_200_OK, payload, None
+    versions.get_response_cache().set(key, payload)
+    return status.HTTP_200_OK, payload, versions.etag_for(key)
+
+
+def _encode_conversation_cursor(conversation_id: int, updated_at) -> str:
+    raw = f"{updated_at.isoformat()}|{conversation_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_conversation_cursor(value: str):
+    """
+    Inverse of _encode_conversation_cursor; returns (updated_at, id) or
+    None for anything malformed.
+    """
+
+    try:
+        padded = value + "=" * (-len(value) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        updated_at_raw, conv_id_raw = raw.split("|", 1)
+        updated_at = datetime.fromisoformat(updated_at_raw)
+        conv_id = int(conv_id_raw)
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if updated_at.tzinfo is None:
+        return None
+    return updated_at, conv_id
+
+
 @api_view(["GET", "PATCH"])
 def me_profile(request):
     """
     Retrieve or update the authenticated user's profile.
     """
 
-    profile, _ = Profile.objects.get_or_create(user=request.user)
-    _touch_last_seen(request.user)
+    profile = refcodes.get_or_create_profile(request.user)
+    presence.touch_last_seen(request.user)
 
     if request.method == "GET":
         serializer = ProfileSerializer(profile)
@@ -292,6 +496,20 @@ def me_profile(request):
     serializer = ProfileSerializer(profile, data=request.data, partial=True)
     serializer.is_valid(raise_exception=True)
     serializer.save()
+
+    # Names and colours appear in other members' inboxes and message lists.
+    conversation_ids = list(
+        ConversationMember.objects.filter(user=request.user).values_list(
+            "conversation_id", flat=True
+        )
+    )
+    for conversation_id in conversation_ids:
+        versions.bump_conversation(conversation_id)
+    versions.bump_inboxes(
+        ConversationMember.objects.filter(conversation_id__in=conversation_ids)
+        .values_list("user_id", flat=True)
+        .distinct()
+    )
     return Response(serializer.data)
 
 
@@ -301,7 +519,7 @@ def start_conversation_by_ref_code(request):
     Create (or reuse) a 1:1 conversation with another user by their ref_code.
     """
 
-    raw_code = (request.data.get("ref_code") or "").strip().upper()
+    raw_code = refcodes.canonical(request.data.get("ref_code"))
     if not raw_code:
         return Response(
             {"detail": "ref_code is required"},
@@ -310,7 +528,7 @@ def start_conversation_by_ref_code(request):
 
     try:
         target_profile = Profile.objects.select_related("user").get(
-            ref_code__iexact=raw_code
+            ref_code=raw_code
         )
     except Profile.DoesNotExist:
         return Response(
@@ -319,184 +537,570 @@ def start_conversation_by_ref_code(request):
         )
 
     target_user = target_profile.user
-    _touch_last_seen(request.user)
+    presence.touch_last_seen(request.user)
     if target_user == request.user:
         return Response(
             {"detail": "You cannot start a conversation with yourself"},
             status=status.HTTP_400_BAD_REQUEST,
         )
 
-    # Try to find an existing direct conversation between the two users.
-    conv_qs = (
-        Conversation.objects.filter(is_group=False)
-        .filter(memberships__user=request.user)
-        .filter(memberships__user=target_user)
-        .distinct()
-    )
-    conversation = conv_qs.first()
+    # A direct chat is keyed by its (lower, higher) user ids: one lookup on
+    # the unique pair index, and a concurrent duplicate insert loses cleanly.
+    low_id, high_id = sorted((request.user.id, target_user.id))
+    pair = {"direct_user_min_id": low_id, "direct_user_max_id": high_id}
+    conversation = Conversation.objects.filter(**pair).first()
 
     if conversation is None:
         # Create a new conversation and add both users.
         display_label = (
             target_profile.display_name or target_user.username or "User"
         )
-        conversation = Conversation.objects.create(
-            title=display_label, is_group=False
-        )
-        ConversationMember.objects.bulk_create(
-            [
-                ConversationMember(conversation=conversation, user=request.user),
-                ConversationMember(conversation=conversation, user=target_user),
-            ],
-            ignore_conflicts=True,
+        try:
+            with transaction.atomic():
+                conversation = Conversation.objects.create(
+                    title=display_label, is_group=False, **pair
+                )
+                ConversationMember.objects.bulk_create(
+                    [
+                        ConversationMember(
+                            conversation=conversation,
+                            user=user,
+                            conversation_updated_at=conversation.updated_at,
+                        )
+                        for user in (request.user, target_user)
+                    ],
+                    ignore_conflicts=True,
+                )
+        except IntegrityError:
+            # Another request created this pair's chat first.
+            return Response(
+                ConversationSerializer(
+                    Conversation.objects.get(**pair)
+                ).data,
+                status=status.HTTP_201_CREATED,
+            )
+        versions.bump_inboxes([request.user.id, target_user.id])
+
+        realtime.publish_conversation_created(
+            ConversationSerializer(conversation).data,
+            [request.user.id, target_user.id],
         )
 
     serializer = ConversationSerializer(conversation)
     return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
+def _int_param(request, name: str) -> int | None:
+    try:
+        return int(request.GET.get(name))
+    except (TypeError, ValueError):
+        return None
+
+
+def _authorized_conversation(user, conversation_id: int):
+    """
+    Load a conversation the user belongs to; returns (conversation,
+    membership_id). Raises Http404 / PermissionDenied otherwise.
+    """
+
+    membership_id = membership.require_member(user, conversation_id)
+    return Conversation.objects.get(id=conversation_id), membership_id
+
+
+def _refresh_read_watermark(conversation) -> None:
+    """
+    Recompute Conversation.read_watermark: the oldest last_read_at across
+    members, or None while someone has read nothing or nobody else is in
+    the conversation.
+    """
+
+    stats = (
+        ConversationMember.objects.using(DEFAULT_DB_ALIAS)
+        .filter(conversation=conversation)
+        .aggregate(
+            members=Count("id"),
+            never_read=Count("id", filter=Q(last_read_at__isnull=True)),
+            oldest=Min("last_read_at"),
+        )
+    )
+    watermark = (
+        stats["oldest"]
+        if stats["members"] > 1 and not stats["never_read"]
+        else None
+    )
+    if watermark != conversation.read_watermark:
+        # update() rather than save() so updated_at (inbox order) is kept.
+        Conversation.objects.filter(pk=conversation.pk).update(
+            read_watermark=watermark
+        )
+        conversation.read_watermark = watermark
+
+
+def _read_by_all_map(messages, watermark) -> dict[int, bool]:
+    """
+    "Read by all" flags for messages the viewer has already read (the
+    caller marks the window read first, so the viewer never holds the
+    watermark below these messages): one comparison per message.
+    """
+
+    return {
+        msg.id: watermark is not None and watermark >= msg.created_at
+        for msg in messages
+    }
+
+
+def _read_counts(conversation, user, messages) -> tuple[dict[int, int], int]:
+    """
+    Per-message "read by N" counts over the other members plus the number
+    of other members, from one query and a bisect per message.
+    """
+
+    others = list(
+        ConversationMember.objects.filter(conversation=conversation)
+        .exclude(user=user)
+        .values_list("last_read_at", flat=True)
+    )
+    read_at = sorted(value for value in others if value is not None)
+    counts = {
+        msg.id: len(read_at) - bisect_left(read_at, msg.created_at)
+        for msg in messages
+    }
+    return counts, len(others)
+
+
+def _read_up_to_id(conversation) -> int | None:
+    """
+    Return the id of the newest message every member has read.
+
+    This is the read-receipt watermark handed to clients: every message with
+    an id at or below it is "read by all". ``None`` means nothing has been
+    read by everyone yet (or there is nobody else in the conversation).
+    """
+
+    if conversation.read_watermark is None:
+        return None
+    return archive.newest_until(
+        conversation,
+        conversation.read_watermark,
+        Message.objects.filter(
+            conversation=conversation,
+            created_at__lte=conversation.read_watermark,
+        )
+        .order_by("-created_at", "-id")
+        .values_list("id", flat=True)
+        .first(),
+    )
+
+
+def _mark_read(conversation, membership_id: int, timestamp) -> None:
+    """
+    Advance a member's read marker, refresh their unread counter and
+    announce the new read receipt. ``conversation`` is updated in place
+    when the read watermark moves.
+
+    Everything here runs on the primary, even when the rest of the request
+    reads from a replica: a lagging copy of the marker would move it
+    backwards. The UPDATE only applies while the stored marker is older, so
+    concurrent reads cannot regress it either.
+    """
+
+    members = ConversationMember.objects.using(DEFAULT_DB_ALIAS)
+    member = members.get(pk=membership_id)
+    if member.last_read_at is not None and member.last_read_at >= timestamp:
+        return
+    previous = member.last_read_at
+    if (
+        conversation.last_message_at is None
+        or timestamp >= conversation.last_message_at
+    ):
+        # Caught up with the newest message: no need to count anything.
+        unread_count = 0
+    else:
+        unread_count = (
+            Message.objects.using(DEFAULT_DB_ALIAS)
+            .filter(conversation=conversation, created_at__gt=timestamp)
+            .exclude(sender_id=member.user_id)
+            .count()
+        )
+    updated = members.filter(
+        Q(last_read_at__isnull=True) | Q(last_read_at__lt=timestamp),
+        pk=membership_id,
+    ).update(last_read_at=timestamp, unread_count=unread_count)
+    if not updated:
+        # A concurrent request already moved the marker further.
+        return
+    if (
+        previous is None
+        or conversation.read_watermark is None
+        or previous <= conversation.read_watermark
+    ):
+        # This member may have been holding the watermark back.
+        _refresh_read_watermark(conversation)
+    versions.bump_conversation(conversation.id)
+    versions.bump_inboxes([member.user_id])
+    realtime.publish_read(member.conversation_id, member.user_id, timestamp)
+
+
+def _message_limit(request) -> int:
+    try:
+        limit = int(request.GET.get("limit", 50))
+    except (TypeError, ValueError):
+        limit = 50
+    return max(1, min(limit, 200))
+
+
+def _messages_delta(
+    request, conversation, membership_id: int, after_id: int, limit: int
+) -> dict:
+    """
+    Messages with an id greater than ``after_id`` (oldest first, at most
+    ``limit``, continuing from the archive when ``after_id`` lies in it)
+    plus the current read-receipt watermark. Delivered messages
+    are marked as read for the requesting member.
+    """
+
+    new_messages = archive.newer(
+        conversation,
+        after_id + 1,
+        message_rows(
+            Message.objects.filter(conversation=conversation, id__gt=after_id)
+            .order_by("id")[: limit + 1]
+        ),
+        limit,
+    )
+    has_more = len(new_messages) > limit
+    new_messages = new_messages[:limit]
+
+    if new_messages:
+        _mark_read(conversation, membership_id, new_messages[-1].created_at)
+
+    results = serialize_message_rows(
+        new_messages,
+        request.user,
+        _read_by_all_map(new_messages, conversation.read_watermark),
+    )
+    return {
+        "results": results,
+        "has_more": has_more,
+        "next_after": new_messages[-1].id if new_messages else after_id,
+        "read_up_to": _read_up_to_id(conversation),
+    }
+
+
+def _conversation_messages_since(
+    request, conversation, membership_id: int, after_id: int, limit: int
+):
+    """
+    Incremental sync for conversation_messages.
+
+    When nothing is new and the client's ``read_up_to`` still matches, the
+    response is an empty 304 so idle chats cost a couple of indexed lookups
+    and no serialization.
+    """
+
+    delta = _messages_delta(
+        request, conversation, membership_id, after_id, limit
+    )
+    if _delta_not_modified(request, delta):
+        return status.HTTP_304_NOT_MODIFIED, None, None
+    return _versioned_page(
+        _messages_cache_key(request, conversation.id), delta
+    )
+
+
+def _delta_not_modified(request, delta: dict) -> bool:
+    """
+    True when a delta has no new messages and the client's ``read_up_to``
+    is still current.
+    """
+
+    if delta["results"]:
+        return False
+    client_read_up_to = request.GET.get("read_up_to")
+    read_up_to = delta["read_up_to"]
+    return client_read_up_to is not None and client_read_up_to == str(
+        read_up_to if read_up_to is not None else ""
+    )
+
+
 @api_view(["GET", "POST"])
+@rate_limit(
+    "user",
+    MESSAGE_RATE,
+    scope=MESSAGE_RATE_SCOPE,
+    detail="You're sending messages too quickly. "
+    "Please slow down for a moment.",
+)
 def conversation_messages(request, conversation_id: int):
     """
     GET: List messages in a conversation.
          Supports optional ?limit=... (default 50, max 200).
+         ?before=<message_id> pages back through history by id,
+         continuing into archived messages (see chat/archive.py).
+         ?around=<message_id> returns a window centred on that message
+         (jump-to-message); has_newer says whether to continue with after=.
+         ?read_counts=1 adds a per-message read_by_count ("read by N of
+         other_member_count").
+         With ?after=<message_id> only messages newer than that id are
+         returned (incremental sync). Pass the last seen ?read_up_to=... as
+         well and an unchanged conversation answers 304 with no body.
+    With versioned responses on (see chat/versions.py), GET responses carry
+    a strong ETag; a matching If-None-Match, or a poll identical to one
+    already served at the same conversation version, is answered from the
+    version cache without querying the database.
     POST: Append a new message with {"content": "..."} for the current user.
+          An optional "client_msg_id" makes the send idempotent: repeating
+          it returns the original message with 200 instead of a duplicate.
     """
 
-    conversation = get_object_or_404(Conversation, id=conversation_id)
+    if request.method == "POST":
+        return _create_message(request, conversation_id)
+    return _page_response(_messages_page(request, conversation_id))
 
-    # Ensure the user is a member; auto-add for now.
-    membership, _ = ConversationMember.objects.get_or_create(
-        conversation=conversation,
-        user=request.user,
+
+def _messages_page(request, conversation_id: int):
+    """
+    GET flow of conversation_messages; returns a page (see _page_response).
+    """
+
+    # Authorize before answering from the cache: a removed member must not
+    # be served a cached page or a 304.
+    membership_id = membership.require_member(request.user, conversation_id)
+    cached = _cached_page(
+        request, _messages_cache_key(request, conversation_id)
     )
+    if cached is not None:
+        return cached
 
-    if request.method == "GET":
-        try:
-            limit = int(request.query_params.get("limit", 50))
-        except (TypeError, ValueError):
-            limit = 50
-        limit = max(1, min(limit, 200))
-
-        before_raw = request.query_params.get("before")
-        messages_qs = Message.objects.filter(conversation=conversation)
-        if before_raw:
-            try:
-                before_id = int(before_raw)
-            except (TypeError, ValueError):
-                before_id = None
-            if before_id is not None:
-                anchor = (
-                    Message.objects.filter(
-                        conversation=conversation, id=before_id
-                    )
-                    .order_by("-created_at")
-                    .first()
-                )
-                if anchor is not None:
-                    messages_qs = messages_qs.filter(
-                        created_at__lt=anchor.created_at
-                    )
+    conversation = Conversation.objects.get(id=conversation_id)
+    routers.use_replica(request)
 
-        messages_qs = messages_qs.order_by("-created_at")[:limit]
-        # Return oldest-to-newest within the window
-        messages_qs = list(messages_qs)[::-1]
-
-        # Mark messages as read for the current user.
-        if messages_qs:
-            last_timestamp = messages_qs[-1].created_at
-            if (
-                membership.last_read_at is None
-                or membership.last_read_at < last_timestamp
-            ):
-                membership.last_read_at = last_timestamp
-                membership.save(update_fields=["last_read_at"])
-
-        # Compute a simple "read by all" flag per message based on other
-        # members' last_read_at timestamps.
-        other_members = ConversationMember.objects.filter(
-            conversation=conversation
-        ).exclude(user=request.user)
-        other_last_seen = {
-            m.user_id: m.last_read_at for m in other_members
-        }
+    limit = _message_limit(request)
 
-        read_by_all_map: dict[int, bool] = {}
-        for msg in messages_qs:
-            if not other_last_seen:
-                # In a 1:1 where the other user hasn't opened the chat yet,
-                # treat as not-read.
-                read_by_all_map[msg.id] = False
-                continue
-            read_by_all_map[msg.id] = all(
-                last_read_at is not None
-                and last_read_at >= msg.created_at
-                for last_read_at in other_last_seen.values()
-            )
+    after_id = _int_param(request, "after")
+    if after_id is not None:
+        return _conversation_messages_since(
+            request, conversation, membership_id, after_id, limit
+        )
 
-        has_more = False
-        next_before = None
-        if messages_qs:
-            oldest = messages_qs[0]
-            has_more = Message.objects.filter(
-                conversation=conversation,
-                created_at__lt=oldest.created_at,
-            ).exists()
-            if has_more:
-                next_before = oldest.id
-
-        serializer = MessageSerializer(
-            messages_qs,
-            many=True,
-            context={
-                "request": request,
-                "read_by_all_map": read_by_all_map,
-            },
+    messages_qs = Message.objects.filter(conversation=conversation)
+    before_id = _int_param(request, "before")
+    around_id = _int_param(request, "around")
+    has_newer = None
+
+    if around_id is not None:
+        # Jump-to-message: roughly half the window on either side of the
+        # target (inclusive), each side probing one extra row.
+        older_limit = limit // 2
+        newer_limit = limit - older_limit
+        older = archive.older(
+            conversation,
+            around_id,
+            message_rows(
+                messages_qs.filter(id__lt=around_id).order_by("-id")[
+                    : older_limit + 1
+                ]
+            ),
+            older_limit,
         )
-        return Response(
-            {
-                "results": serializer.data,
-                "has_more": has_more,
-                "next_before": next_before,
-            }
+        newer = archive.newer(
+            conversation,
+            around_id,
+            message_rows(
+                messages_qs.filter(id__gte=around_id).order_by("id")[
+                    : newer_limit + 1
+                ]
+            ),
+            newer_limit,
         )
+        has_more = len(older) > older_limit
+        has_newer = len(newer) > newer_limit
+        messages_qs = older[:older_limit][::-1] + newer[:newer_limit]
+    else:
+        # Keyset pagination on (conversation_id, id); the extra row
+        # tells us whether there is older history. Past the oldest hot
+        # message the page continues from the archive.
+        if before_id is not None:
+            messages_qs = messages_qs.filter(id__lt=before_id)
+        page = archive.older(
+            conversation,
+            before_id,
+            message_rows(messages_qs.order_by("-id")[: limit + 1]),
+            limit,
+        )
+        has_more = len(page) > limit
+        # Return oldest-to-newest within the window
+        messages_qs = page[:limit][::-1]
+
+    # Mark messages as read for the current user.
+    if messages_qs:
+        _mark_read(
+            conversation, membership_id, messages_qs[-1].created_at
+        )
+
+    # "Read by all" is a single comparison against the maintained
+    # conversation read watermark.
+    read_by_all_map = _read_by_all_map(
+        messages_qs, conversation.read_watermark
+    )
+
+    has_more = has_more and bool(messages_qs)
+    next_before = messages_qs[0].id if has_more else None
+
+    payload = {
+        "results": serialize_message_rows(
+            messages_qs, request.user, read_by_all_map
+        ),
+        "has_more": has_more,
+        "next_before": next_before,
+        "next_after": messages_qs[-1].id if messages_qs else None,
+        "read_up_to": _read_up_to_id(conversation),
+    }
+    if has_newer is not None:
+        payload["has_newer"] = has_newer
+    if request.GET.get("read_counts"):
+        counts, other_count = _read_counts(
+            conversation, request.user, messages_qs
+        )
+        for item in payload["results"]:
+            item["read_by_count"] = counts.get(item["id"], 0)
+        payload["other_member_count"] = other_count
+    return _versioned_page(
+        _messages_cache_key(request, conversation.id), payload
+    )
+
+
+def _create_message(request, conversation_id: int):
+    """
+    POST branch of conversation_messages. Answers 201 for a new message and
+    200 with the original message when ``client_msg_id`` repeats a send.
+    """
+
+    membership.require_member(request.user, conversation_id)
 
-    # POST: create new message
     content = request.data.get("content", "").strip()
     if not content:
         return Response(
             {"detail": "content is required"},
             status=status.HTTP_400_BAD_REQUEST,
         )
+    try:
+        client_msg_id = _clean_client_msg_id(request.data.get("client_msg_id"))
+    except ValueError as exc:
+        return Response(
+            {"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST
+        )
 
-    # Simple rate limiting: cap message sends per user.
-    now = dj_timezone.now()
-    recent_messages = Message.objects.filter(
-        sender=request.user,
-        created_at__gte=now - timedelta(minutes=1),
-    ).count()
-    if recent_messages >= 60:
+    message, created = messaging.send_message(
+        conversation_id, request.user, content, client_msg_id
+    )
+    payload = serialize_message_rows([message], request.user)[0]
+    if not created:
+        return Response(payload, status=status.HTTP_200_OK)
+    realtime.publish_message(payload)
+    return Response(payload, status=status.HTTP_201_CREATED)
+
+
+def _clean_client_msg_id(value) -> str | None:
+    """
+    Normalize an optional client_msg_id; raises ValueError when invalid.
+    """
+
+    if value is None:
+        return None
+    value = str(value).strip()
+    if not value or len(value) > messaging.CLIENT_MSG_ID_MAX_LENGTH:
+        raise ValueError(
+            "client_msg_id must be 1-"
+            f"{messaging.CLIENT_MSG_ID_MAX_LENGTH} characters"
+        )
+    return value
+
+
+def _bulk_message_count(request) -> int:
+    """
+    Rate-limit cost of a bulk send: one per message, so a batch draws on the
+    same budget as sending its messages one by one. Batches the view rejects
+    as malformed or too large cost nothing and get their 400.
+    """
+
+    raw_items = request.data.get("messages")
+    if not isinstance(raw_items, list):
+        return 0
+    if len(raw_items) > messaging.BULK_MAX_MESSAGES:
+        return 0
+    return len(raw_items)
+
+
+@api_view(["POST"])
+@rate_limit(
+    "user",
+    MESSAGE_RATE,
+    scope=MESSAGE_RATE_SCOPE,
+    cost=_bulk_message_count,
+    detail="You're sending messages too quickly. "
+    "Please slow down for a moment.",
+)
+def conversation_messages_bulk(request, conversation_id: int):
+    """
+    POST: Send several queued messages at once, e.g. when a client comes
+    back online:
+        {"messages": [{"content": "...", "client_msg_id": "..."}, ...]}
+    At most messaging.BULK_MAX_MESSAGES items, stored in the given order.
+    Each item counts against the sender's MESSAGE_RATE; a batch the
+    remaining budget does not cover is rejected whole with a 429.
+    Items whose client_msg_id was already sent are not stored again.
+    Returns {"results": [...]} with one message per item (in order); 201 if
+    anything new was stored, else 200.
+    """
+
+    membership.require_member(request.user, conversation_id)
+
+    raw_items = request.data.get("messages")
+    if not isinstance(raw_items, list) or not raw_items:
+        return Response(
+            {"detail": "messages must be a non-empty list"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    if len(raw_items) > messaging.BULK_MAX_MESSAGES:
         return Response(
             {
-                "detail": "You're sending messages too quickly. "
-                "Please slow down for a moment."
+                "detail": "at most "
+                f"{messaging.BULK_MAX_MESSAGES} messages per request"
             },
-            status=status.HTTP_429_TOO_MANY_REQUESTS,
+            status=status.HTTP_400_BAD_REQUEST,
         )
 
-    message = Message.objects.create(
-        conversation=conversation,
-        sender=request.user,
-        content=content,
-    )
+    items = []
+    for index, raw in enumerate(raw_items):
+        content = raw.get("content") if isinstance(raw, dict) else None
+        content = content.strip() if isinstance(content, str) else ""
+        if not content:
+            return Response(
+                {"detail": f"messages[{index}]: content is required"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            client_msg_id = _clean_client_msg_id(raw.get("client_msg_id"))
+        except ValueError as exc:
+            return Response(
+                {"detail": f"messages[{index}]: {exc}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        items.append((content, client_msg_id))
 
-    # Touch conversation updated_at
-    Conversation.objects.filter(pk=conversation.pk).update(
-        updated_at=dj_timezone.now()
+    sent = messaging.send_messages(conversation_id, request.user, items)
+    payloads = serialize_message_rows(
+        [message for message, _ in sent], request.user
+    )
+    for payload, (_, created) in zip(payloads, sent):
+        if created:
+            realtime.publish_message(payload)
+    any_created = any(created for _, created in sent)
+    return Response(
+        {"results": payloads},
+        status=status.HTTP_201_CREATED if any_created else status.HTTP_200_OK,
     )
-
-    serializer = MessageSerializer(message, context={"request": request})
-    return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
 @api_view(["GET", "POST"])
@@ -506,69 +1110,257 @@ def conversation_typing(request, conversation_id: int):
     POST: Update the current user's typing state in this conversation.
     """
 
-    conversation = get_object_or_404(Conversation, id=conversation_id)
-    membership, _ = ConversationMember.objects.get_or_create(
-        conversation=conversation,
-        user=request.user,
-    )
-    _touch_last_seen(request.user)
+    if request.method == "GET":
+        membership.require_member(request.user, conversation_id)
+        presence.touch_last_seen(request.user)
+        routers.use_replica(request)
+        memberships = list(
+            ConversationMember.objects.filter(conversation_id=conversation_id)
+            .select_related("user__profile")
+            .order_by("joined_at")
+        )
 
-    if request.method == "POST":
-        is_typing = bool(request.data.get("is_typing", True))
-        TypingStatus.objects.update_or_create(
-            conversation=conversation,
-            user=request.user,
-            defaults={"is_typing": is_typing},
+        now = dj_timezone.now()
+        last_seen = presence.last_seen_map(
+            {m.user_id: getattr(m.user, "profile", None) for m in memberships}
         )
-        return Response({"detail": "updated"})
 
-    # GET: status
-    now = dj_timezone.now()
-    active_threshold = now - timedelta(seconds=10)
+        participants = []
+        for m in memberships:
+            user = m.user
+            profile = getattr(user, "profile", None)
+            last_seen_at = last_seen.get(user.id)
+            is_online = presence.is_online(last_seen_at, now)
+            display_label = (
+                (getattr(profile, "display_name", "") or "").strip()
+                or (user.username or "").strip()
+                or "User"
+            )
+            participants.append(
+                {
+                    "id": user.id,
+                    "username": user.username,
+                    "display_name": display_label,
+                    "last_seen_at": last_seen_at.isoformat()
+                    if last_seen_at
+                    else None,
+                    "is_online": is_online,
+                }
+            )
 
-    memberships = (
-        ConversationMember.objects.filter(conversation=conversation)
-        .select_related("user__profile")
-        .order_by("joined_at")
-    )
+        return Response(
+            {
+                "participants": participants,
+                "typing_ids": presence.typing_ids(conversation_id),
+            }
+        )
+
+    membership.require_member(request.user, conversation_id)
+    presence.touch_last_seen(request.user)
+    is_typing = bool(request.data.get("is_typing", True))
+    presence.set_typing(conversation_id, request.user.id, is_typing)
+    realtime.publish_typing(conversation_id, request.user.id, is_typing)
+    return Response({"detail": "updated"})
+
+
+@api_view(["GET"])
+def conversations_status(request):
+    """
+    Typing and online status for several conversations at once.
 
-    participants = []
-    for m in memberships:
-        user = m.user
-        profile = getattr(user, "profile", None)
-        last_seen_at = getattr(profile, "last_seen_at", None)
-        is_online = bool(
-            last_seen_at and last_seen_at >= now - timedelta(seconds=60)
+    GET ?conversations=1,2,3 (at most STATUS_MAX_CONVERSATIONS ids). Only
+    conversations the user is a member of are returned; unlike
+    conversation_typing this is read-only -- no auto-join and no last-seen
+    touch -- and costs one query however many conversations are asked for.
+    """
+
+    raw = request.query_params.get("conversations", "")
+    try:
+        conversation_ids = {int(v) for v in raw.split(",") if v.strip()}
+    except ValueError:
+        return Response(
+            {"detail": "conversations must be a comma-separated list of ids."},
+            status=status.HTTP_400_BAD_REQUEST,
         )
-        display_label = (
-            (getattr(profile, "display_name", "") or "").strip()
-            or (user.username or "").strip()
-            or "User"
+    if len(conversation_ids) > STATUS_MAX_CONVERSATIONS:
+        return Response(
+            {
+                "detail": "At most "
+                f"{STATUS_MAX_CONVERSATIONS} conversations per request."
+            },
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    rows = (
+        ConversationMember.objects.filter(
+            conversation_id__in=conversation_ids,
+            conversation__memberships__user=request.user,
         )
-        participants.append(
+        .order_by("joined_at")
+        .values_list("conversation_id", "user_id", "user__profile__last_seen_at")
+    )
+
+    members: dict[int, list[int]] = {}
+    persisted = {}
+    for conversation_id, user_id, last_seen_at in rows:
+        members.setdefault(conversation_id, []).append(user_id)
+        persisted[user_id] = last_seen_at
+    last_seen = dict(persisted)
+    last_seen.update(presence.get_presence_store().last_seen(list(persisted)))
+    typing = presence.typing_map(list(members))
+
+    now = dj_timezone.now()
+    results = []
+    for conversation_id in sorted(members):
+        participants = []
+        for user_id in members[conversation_id]:
+            last_seen_at = last_seen.get(user_id)
+            participants.append(
+                {
+                    "id": user_id,
+                    "last_seen_at": last_seen_at.isoformat()
+                    if last_seen_at
+                    else None,
+                    "is_online": presence.is_online(last_seen_at, now),
+                }
+            )
+        results.append(
             {
-                "id": user.id,
-                "username": user.username,
-                "display_name": display_label,
-                "last_seen_at": last_seen_at.isoformat()
-                if last_seen_at
-                else None,
-                "is_online": is_online,
+                "id": conversation_id,
+                "participants": participants,
+                "typing_ids": typing.get(conversation_id, []),
             }
         )
+    return Response({"results": results})
 
-    typing_qs = TypingStatus.objects.filter(
-        conversation=conversation,
-        is_typing=True,
-        updated_at__gte=active_threshold,
-    )
-    typing_ids = list(
-        typing_qs.values_list("user_id", flat=True).distinct()
-    )
 
+@api_view(["GET"])
+@rate_limit("user", "30/m", methods=("GET",))
+def search_messages(request):
+    """
+    Full-text search over messages in the caller's conversations.
+
+    GET ?q=<words> (the last word matches as a prefix), optional
+    ?conversation=<id>, ?limit= (default 20, max 50) and ?offset=. Results
+    come best match first; each is a message plus a "snippet" in which
+    matches are wrapped in <mark>...</mark> (the rest is HTML-escaped).
+    """
+
+    text = request.query_params.get("q", "").strip()
+    if not text:
+        return Response(
+            {"detail": "q is required"}, status=status.HTTP_400_BAD_REQUEST
+        )
+    conversation_id = _int_param(request, "conversation")
+    if conversation_id is not None:
+        membership.require_member(request.user, conversation_id)
+    try:
+        limit = int(request.query_params.get("limit", search.DEFAULT_LIMIT))
+    except (TypeError, ValueError):
+        limit = search.DEFAULT_LIMIT
+    limit = max(1, min(limit, search.MAX_LIMIT))
+    offset = max(0, _int_param(request, "offset") or 0)
+
+    hits, has_more = search.search_messages(
+        request.user, text, conversation_id, limit, offset
+    )
+    results = serialize_message_rows([row for row, _ in hits], request.user)
+    for item, (_, snippet) in zip(results, hits):
+        item["snippet"] = snippet
     return Response(
         {
-            "participants": participants,
-            "typing_ids": typing_ids,
+            "results": results,
+            "has_more": has_more,
+            "next_offset": offset + len(results) if has_more else None,
         }
     )
+
+
+async def _authenticate(request) -> bool:
+    """
+    Token authentication for plain async views, which bypass DRF: sets
+    ``request.user`` and returns whether the token was valid.
+    """
+
+    user = await aget_token_user(
+        token_from_header(request.headers.get("Authorization"))
+    )
+    if user is None:
+        return False
+    request.user = user
+    return True
+
+
+def _error_response(exc: Exception) -> JsonResponse:
+    """
+    The JSON response DRF would have rendered for an error raised by a sync
+    flow called from a plain async view.
+    """
+
+    if isinstance(exc, Http404):
+        return JsonResponse(
+            {"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND
+        )
+    return JsonResponse({"detail": str(exc.detail)}, status=exc.status_code)
+
+
+def _conversation_updates_delta(request, conversation_id: int, cursor: int):
+    conversation, membership_id = _authorized_conversation(
+        request.user, conversation_id
+    )
+    delta = _messages_delta(
+        request, conversation, membership_id, cursor, LONG_POLL_BATCH_SIZE
+    )
+    delta["cursor"] = delta.pop("next_after")
+    delta["typing_ids"] = presence.typing_ids(conversation.id)
+    return delta
+
+
+@require_GET
+async def conversation_updates(request, conversation_id: int):
+    """
+    Long-poll for changes in a conversation.
+
+    GET ?cursor=<last message id>&timeout=<seconds, default 25, max 30>.
+    Returns immediately when messages newer than the cursor exist; otherwise
+    parks the request until the notification hub reports a new message, a
+    typing change or a read-marker bump in this conversation, or until the
+    timeout expires. Either way the response carries the current delta and
+    the cursor to use for the next call. Authenticated with the DRF token.
+    """
+
+    if not await _authenticate(request):
+        return _error_response(NotAuthenticated())
+
+    try:
+        cursor = int(request.GET.get("cursor", 0))
+    except (TypeError, ValueError):
+        cursor = 0
+    try:
+        timeout = float(request.GET.get("timeout", LONG_POLL_DEFAULT_TIMEOUT))
+    except (TypeError, ValueError):
+        timeout = LONG_POLL_DEFAULT_TIMEOUT
+    timeout = max(0.0, min(timeout, LONG_POLL_MAX_TIMEOUT))
+
+    get_delta = sync_to_async(_conversation_updates_delta)
+
+    # Subscribe before reading so nothing published in between is missed.
+    subscription = realtime.get_broker().subscribe(
+        [realtime.conversation_channel(conversation_id)]
+    )
+    try:
+        try:
+            delta = await get_delta(request, conversation_id, cursor)
+        except (Http404, APIException) as exc:
+            return _error_response(exc)
+        if delta["results"] or timeout == 0:
+            return JsonResponse({**delta, "timed_out": False})
+
+        try:
+            await asyncio.wait_for(subscription.get(), timeout)
+        except asyncio.TimeoutError:
+            return JsonResponse({**delta, "timed_out": True})
+        delta = await get_delta(request, conversation_id, cursor)
+        return JsonResponse({**delta, "timed_out": False})
+    finally:
+        subscription.close()
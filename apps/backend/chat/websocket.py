@@ -0,0 +1,251 @@
+"""
+Native ASGI WebSocket endpoint pushing chat events to connected members.
+
+Clients connect to ``settings.CHAT_WEBSOCKET_PATH`` (``/ws/chat/`` by
+default) and authenticate with their DRF token, either via an
+``Authorization: Token <key>`` header or a ``?token=<key>`` query parameter
+(browsers cannot set headers on WebSocket handshakes).
+
+Once connected the socket is subscribed to every conversation the user is a
+member of and receives JSON events:
+
+    {"type": "message.new", "message": {...}}
+    {"type": "typing", "conversation": 1, "user_id": 2, "is_typing": true}
+    {"type": "presence", "conversation": 1, "user_id": 2, "is_online": true,
+     "last_seen_at": ...}
+    {"type": "read", "conversation": 1, "user_id": 2, "last_read_at": ...}
+    {"type": "conversation.new", "conversation": {...}}
+    {"type": "membership.removed", "conversation": 1}
+
+When the user is removed from a conversation the socket drops its channel
+and forwards ``membership.removed``; conversation events still queued for it
+are discarded. Subscribing and typing go through the same membership check
+as the HTTP endpoints. A user is announced offline only when their last
+socket closes.
+
+Clients may send {"action": "ping"}, {"action": "subscribe", "conversation":
+<id>}, {"action": "unsubscribe", "conversation": <id>} and {"action":
+"typing", "conversation": <id>, "is_typing": true}.
+"""
+
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import Http404
+from django.utils import timezone as dj_timezone
+from rest_framework.exceptions import PermissionDenied
+
+from . import membership, presence, realtime
+from .authentication import aget_token_user, token_from_header
+from .models import ConversationMember
+
+
+DEFAULT_PATH = "/ws/chat/"
+
+# Application-level close codes (4000-4999 are reserved for applications).
+CLOSE_NOT_FOUND = 4404
+CLOSE_UNAUTHORIZED = 4401
+
+
+def _token_from_scope(scope) -> str | None:
+    for name, value in scope.get("headers", []):
+        if name == b"authorization":
+            return token_from_header(value.decode("latin-1"))
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    tokens = query.get("token")
+    return tokens[0] if tokens else None
+
+
+async def _conversation_ids(user) -> list[int]:
+    return [
+        conversation_id
+        async for conversation_id in ConversationMember.objects.filter(
+            user=user
+        ).values_list("conversation_id", flat=True)
+    ]
+
+
+async def _member_error(user, conversation_id: int) -> dict | None:
+    """
+    Run membership.require_member; returns an error event when it refuses.
+    """
+
+    try:
+        await sync_to_async(membership.require_member)(user, conversation_id)
+    except (Http404, PermissionDenied):
+        return {"type": "error", "detail": "not a member of this conversation"}
+    return None
+
+
+def _set_presence(user, conversation_ids, is_online: bool) -> None:
+    presence.touch_last_seen(user)
+    realtime.publish_presence(
+        user.id, conversation_ids, is_online, dj_timezone.now()
+    )
+
+
+def _connected(user, conversation_ids) -> None:
+    presence.socket_opened(user.id)
+    _set_presence(user, conversation_ids, is_online=True)
+
+
+def _disconnected(user, conversation_ids) -> None:
+    if presence.socket_closed(user.id):
+        # Another socket of this user is still open: still online.
+        presence.touch_last_seen(user)
+        return
+    _set_presence(user, conversation_ids, is_online=False)
+
+
+def _set_typing(user, conversation_id: int, is_typing: bool) -> None:
+    presence.set_typing(conversation_id, user.id, is_typing)
+    realtime.publish_typing(conversation_id, user.id, is_typing)
+
+
+async def _handle_client_message(user, subscription, conversation_ids, text):
+    """
+    Apply one client frame and return an optional reply event.
+    ``conversation_ids`` is the set of conversations the socket follows.
+    """
+
+    try:
+        payload = json.loads(text or "")
+    except ValueError:
+        return {"type": "error", "detail": "invalid JSON"}
+    if not isinstance(payload, dict):
+        return {"type": "error", "detail": "expected a JSON object"}
+
+    action = payload.get("action")
+    if action == "ping":
+        return {"type": "pong"}
+
+    try:
+        conversation_id = int(payload.get("conversation"))
+    except (TypeError, ValueError):
+        return {"type": "error", "detail": "conversation is required"}
+    channel = realtime.conversation_channel(conversation_id)
+
+    if action == "unsubscribe":
+        subscription.remove(channel)
+        conversation_ids.discard(conversation_id)
+        return None
+    error = await _member_error(user, conversation_id)
+    if error is not None:
+        return error
+
+    if action == "subscribe":
+        subscription.add(channel)
+        conversation_ids.add(conversation_id)
+        return None
+    if action == "typing":
+        is_typing = bool(payload.get("is_typing", True))
+        await sync_to_async(_set_typing)(user, conversation_id, is_typing)
+        return None
+    return {"type": "error", "detail": "unknown action"}
+
+
+def _event_conversation(event: dict) -> int | None:
+    """
+    The conversation a conversation-channel event belongs to.
+    """
+
+    if event.get("type") == "message.new":
+        return event["message"].get("conversation")
+    if event.get("type") in ("typing", "read", "presence"):
+        return event.get("conversation")
+    return None
+
+
+def _personalise(user, event: dict) -> dict:
+    if event.get("type") == "message.new":
+        message = dict(event["message"])
+        message["is_mine"] = (message.get("sender") or {}).get("id") == user.id
+        event = {**event, "message": message}
+    return event
+
+
+async def _send_json(send, payload: dict) -> None:
+    await send({"type": "websocket.send", "text": json.dumps(payload)})
+
+
+async def websocket_application(scope, receive, send):
+    """
+    ASGI application for ``websocket`` scopes.
+    """
+
+    event = await receive()
+    if event["type"] != "websocket.connect":
+        return
+
+    path = getattr(settings, "CHAT_WEBSOCKET_PATH", DEFAULT_PATH)
+    if scope.get("path") != path:
+        await send({"type": "websocket.close", "code": CLOSE_NOT_FOUND})
+        return
+
+    user = await aget_token_user(_token_from_scope(scope))
+    if user is None:
+        await send({"type": "websocket.close", "code": CLOSE_UNAUTHORIZED})
+        return
+
+    await send({"type": "websocket.accept"})
+
+    conversation_ids = set(await _conversation_ids(user))
+    subscription = realtime.get_broker().subscribe(
+        [realtime.user_channel(user.id)]
+        + [realtime.conversation_channel(c) for c in conversation_ids]
+    )
+    await sync_to_async(_connected)(user, conversation_ids)
+
+    receive_task = asyncio.ensure_future(receive())
+    event_task = asyncio.ensure_future(subscription.get())
+    try:
+        while True:
+            done, _ = await asyncio.wait(
+                {receive_task, event_task},
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if receive_task in done:
+                message = receive_task.result()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message["type"] == "websocket.receive":
+                    reply = await _handle_client_message(
+                        user,
+                        subscription,
+                        conversation_ids,
+                        message.get("text"),
+                    )
+                    if reply is not None:
+                        await _send_json(send, reply)
+                receive_task = asyncio.ensure_future(receive())
+            if event_task in done:
+                pushed = event_task.result()
+                event_task = asyncio.ensure_future(subscription.get())
+                if pushed.get("type") == "conversation.new":
+                    # Follow conversations created after we connected.
+                    conversation_id = pushed["conversation"]["id"]
+                    subscription.add(
+                        realtime.conversation_channel(conversation_id)
+                    )
+                    conversation_ids.add(conversation_id)
+                elif pushed.get("type") == "membership.removed":
+                    conversation_id = pushed["conversation"]
+                    subscription.remove(
+                        realtime.conversation_channel(conversation_id)
+                    )
+                    conversation_ids.discard(conversation_id)
+                elif _event_conversation(pushed) not in (
+                    None,
+                    *conversation_ids,
+                ):
+                    # Queued before a membership.removed was processed.
+                    continue
+                await _send_json(send, _personalise(user, pushed))
+    finally:
+        receive_task.cancel()
+        event_task.cancel()
+        subscription.close()
+        await sync_to_async(_disconnected)(user, conversation_ids)
@@ -59,6 +59,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'chat.routers.ReplicaRoutingMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -104,6 +105,25 @@ else:
         }
     }
 
+# Optional read replicas: a comma-separated list of database URLs, added as
+# "replica_0", "replica_1", ... The read-heavy chat endpoints read from them
+# (see chat/routers.py); everything else uses "default".
+DATABASE_REPLICA_URLS = [
+    url.strip()
+    for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",")
+    if url.strip()
+]
+CHAT_REPLICA_DATABASES = []
+if dj_database_url is not None:
+    for index, url in enumerate(DATABASE_REPLICA_URLS):
+        alias = f"replica_{index}"
+        DATABASES[alias] = dj_database_url.parse(url, conn_max_age=600)
+        # Tests run against the primary's test database.
+        DATABASES[alias]["TEST"] = {"MIRROR": "default"}
+        CHAT_REPLICA_DATABASES.append(alias)
+
+DATABASE_ROUTERS = ["chat.routers.ReplicaRouter"]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -150,7 +170,7 @@ CORS_ALLOW_ALL_ORIGINS = True
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'chat.authentication.CachingTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -158,3 +178,76 @@ REST_FRAMEWORK = {
 }
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+
+# Login-code emails are sent by background worker threads in batches over a
+# reused connection, with retries (see chat/mailqueue.py). 0 workers sends
+# inline, e.g. for tests.
+CHAT_EMAIL_QUEUE_WORKERS = int(os.getenv("CHAT_EMAIL_QUEUE_WORKERS", "1"))
+CHAT_EMAIL_BATCH_SIZE = 50
+CHAT_EMAIL_MAX_ATTEMPTS = 5
+CHAT_EMAIL_RETRY_DELAY = 2  # seconds, doubled per attempt
+
+# Real-time delivery (see chat/realtime.py and chat/websocket.py).
+# The in-memory broker only reaches sockets connected to the same process.
+CHAT_REALTIME_BACKEND = os.getenv(
+    "CHAT_REALTIME_BACKEND", "chat.realtime.InMemoryBroker"
+)
+CHAT_WEBSOCKET_PATH = "/ws/chat/"
+
+# Presence and typing state (see chat/presence.py). Point
+# CHAT_PRESENCE_BACKEND at chat.presence.CachePresenceStore to share it
+# between workers through the CHAT_PRESENCE_CACHE cache alias.
+CHAT_PRESENCE_BACKEND = os.getenv(
+    "CHAT_PRESENCE_BACKEND", "chat.presence.InMemoryPresenceStore"
+)
+CHAT_PRESENCE_CACHE = "default"
+# Persist last_seen_at at most once per granularity window per user; the
+# buffered writes are flushed in bulk every flush interval (0 = inline).
+CHAT_LAST_SEEN_GRANULARITY = 60  # seconds
+CHAT_LAST_SEEN_FLUSH_INTERVAL = 5  # seconds
+
+# Version counters behind ETags and the in-process response cache for
+# conversation_messages / list_conversations (see chat/versions.py). The
+# counters must be shared by all workers, so both features are off while
+# CHAT_VERSION_CACHE is a per-process cache (like the locmem default) unless
+# CHAT_VERSIONED_RESPONSES is True (single-process deployments only).
+CHAT_VERSION_CACHE = "default"
+CHAT_VERSIONED_RESPONSES = None  # None: on iff the version cache is shared
+CHAT_RESPONSE_CACHE_SIZE = 2048  # entries per process, 0 disables
+
+# Rate limiting (see chat/ratelimit.py). CacheBackend shares limits between
+# workers through the CHAT_RATELIMIT_CACHE cache alias, which must be a
+# shared cache in production (check --deploy warns otherwise, chat.W002);
+# chat.ratelimit.InMemoryBackend counts per process.
+CHAT_RATELIMIT_BACKEND = os.getenv(
+    "CHAT_RATELIMIT_BACKEND", "chat.ratelimit.CacheBackend"
+)
+CHAT_RATELIMIT_CACHE = "default"
+
+# Key of the permutation that turns user ids into Profile.ref_code (see
+# chat/refcodes.py); defaults to SECRET_KEY. Changing it only affects codes
+# allocated afterwards.
+CHAT_REF_CODE_KEY = os.getenv("CHAT_REF_CODE_KEY") or None
+
+# Token -> user cache used by CachingTokenAuthentication and the WebSocket /
+# async entry points (see chat/authentication.py). Entries are checked
+# against per-user versions in CHAT_VERSION_CACHE, so token and account
+# changes reach every worker at once; with a per-process version cache the
+# TTL is capped at a few seconds instead.
+CHAT_AUTH_CACHE_SIZE = 4096  # entries per process, 0 disables
+CHAT_AUTH_CACHE_TTL = 300  # seconds
+
+# Per-process cache of (user, conversation) -> membership used to authorize
+# conversation endpoints (see chat/membership.py).
+CHAT_MEMBERSHIP_CACHE_SIZE = 65536  # entries, 0 disables
+CHAT_MEMBERSHIP_CACHE_TTL = 60  # seconds
+
+# Messages older than this are moved to the archive tier by
+# `manage.py archive_messages` (see chat/archive.py).
+CHAT_ARCHIVE_AFTER_DAYS = 180
+
+# After a user's write request, keep their reads on the primary for this
+# long so they see their own writes despite replica lag. Pins are stored in
+# the CHAT_REPLICA_PIN_CACHE cache alias (see chat/routers.py).
+CHAT_REPLICA_PIN_SECONDS = 10
+CHAT_REPLICA_PIN_CACHE = "default"
@@ -36,6 +36,7 @@ class _ChatShellPageState extends State<ChatShellPage> {
   bool _isLoadingConversations = false;
   String? _conversationsError;
   bool _hasMoreConversations = false;
+  String? _conversationsCursor;
 
   final List<ChatMessage> _messages = [];
   bool _isLoadingMessages = false;
@@ -198,9 +199,10 @@ class _ChatShellPageState extends State<ChatShellPage> {
     });
 
     try {
-      final offset = append ? _conversations.length : 0;
+      final cursor = append ? _conversationsCursor : null;
       final uri = Uri.parse(
-        '$backendBaseUrl/api/conversations/?limit=20&offset=$offset',
+        '$backendBaseUrl/api/conversations/?limit=20'
+        '${cursor != null ? '&cursor=$cursor' : ''}',
       );
       final response = await http.get(uri, headers: _authHeaders);
 
@@ -219,6 +221,7 @@ class _ChatShellPageState extends State<ChatShellPage> {
         }
         _conversations.addAll(items);
         _hasMoreConversations = (body['has_more'] as bool?) ?? false;
+        _conversationsCursor = body['next_cursor'] as String?;
         if (!append &&
             _conversations.isNotEmpty &&
             _selectedConversation == null) {